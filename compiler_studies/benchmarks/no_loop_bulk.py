@@ -0,0 +1,102 @@
+import argparse
+import sys
+import threading
+import time
+
+from compiler_studies.benchmarks.no_loop_modes import MODES
+from compiler_studies.no_loop import scanner
+from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop import bulk
+from compiler_studies.no_loop import interpreter
+from compiler_studies.no_loop import lists
+from compiler_studies.no_loop.runtime import Env
+
+
+# Squares and cubes over a range, as in f_range.nl: recursing in No-Loop,
+# with map and functions it calls once per element (since they assign a
+# variable), and with map and functions it compiles
+PROGRAMS = {
+    'recursive': '''
+square = \\(n) { return n*n }
+cube = \\(n) { return n*n*n }
+f_range = \\(f, lo, hi) {
+  if lo == hi { return list() } else { return cons(f(lo), f_range(f, lo + 1, hi)) }
+}
+result = sum(f_range(square, 0, %(n)d)) + sum(f_range(cube, 0, %(n)d))
+''',
+    'called': '''
+square = \\(n) { r = n*n return r }
+cube = \\(n) { r = n*n*n return r }
+result = sum(map(square, range(0, %(n)d))) + sum(map(cube, range(0, %(n)d)))
+''',
+    'compiled': '''
+square = \\(n) { return n*n }
+cube = \\(n) { return n*n*n }
+result = sum(map(square, range(0, %(n)d))) + sum(map(cube, range(0, %(n)d)))
+''',
+}
+
+
+def bench(mode, program, repeat):
+    best = None
+    result = None
+
+    for _ in range(repeat):
+        ast = parser.parse(parser.Stream(scanner.scan(program)))
+        env = Env(**lists.builtins(), **bulk.builtins(interpreter.CALLS[mode]))
+
+        start = time.perf_counter()
+        MODES[mode](ast, env)
+        elapsed = time.perf_counter() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+        result = env['result']
+
+    return best, result
+
+
+def parse_args():
+    argsparser = argparse.ArgumentParser(
+        description='Compares mapping functions over ranges recursively and with the bulk natives')
+    argsparser.add_argument('-n', type=int, default=1000000, help='range length')
+    argsparser.add_argument(
+        '--recursive-n', type=int, default=5000,
+        help='range length when recursing, since the stack grows with it')
+    argsparser.add_argument('--repeat', type=int, default=3)
+    argsparser.add_argument('--modes', nargs='+', choices=list(MODES), default=['closure', 'vm'])
+    return argsparser.parse_args()
+
+
+def main():
+    args = parse_args()
+    passed = True
+
+    for mode in args.modes:
+        rates = {}
+        for name, program in PROGRAMS.items():
+            n = args.recursive_n if name == 'recursive' else args.n
+            elapsed, result = bench(mode, program % {'n': n}, args.repeat)
+
+            expected = sum(i * i + i * i * i for i in range(n))
+            passed = passed and result == expected
+            rates[name] = 2 * n / elapsed
+            print('{:>8} {:>9}: {} elements in {:.3f}s, {:.2f}M elements/s, correct: {}'.format(
+                mode, name, 2 * n, elapsed, rates[name] / 1e6, result == expected))
+
+        print('{:>8}: compiled is {:.0f}x recursive, {:.0f}x called'.format(
+            mode, rates['compiled'] / rates['recursive'], rates['compiled'] / rates['called']))
+
+    return passed
+
+
+if __name__ == '__main__':
+    # f_range recurses once per element
+    sys.setrecursionlimit(1000000)
+    threading.stack_size(512 * 1024 * 1024)
+    passed = []
+    thread = threading.Thread(target=lambda: passed.append(main()))
+    thread.start()
+    thread.join()
+
+    if passed != [True]:
+        raise SystemExit('FAIL')
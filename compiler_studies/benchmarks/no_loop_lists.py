@@ -0,0 +1,101 @@
+import argparse
+import sys
+import threading
+import time
+
+from compiler_studies.benchmarks.no_loop_modes import MODES
+from compiler_studies.no_loop import scanner
+from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop import lists
+from compiler_studies.no_loop.runtime import Env, NativeFunction
+
+
+# make_range, map and print_list from pairs.nl, printing with `emit`
+CHURCH = '''
+make_pair = \\(a, b) { return \\(getter) { return getter(a, b) } }
+get_head = \\(pair) { return pair(\\(a, b) { return a }) }
+get_tail = \\(pair) { return pair(\\(a, b) { return b }) }
+empty_list = \\() { return 0 }
+
+make_range = \\(lo, hi) {
+  if lo == hi { return empty_list } else { return make_pair(lo, make_range(lo + 1, hi)) }
+}
+map = \\(f, lst) {
+  if lst == empty_list { return empty_list } else { return make_pair(f(get_head(lst)), map(f, get_tail(lst))) }
+}
+print_list = \\(lst) {
+  if lst == empty_list { return 0 } else { emit(get_head(lst)) return print_list(get_tail(lst)) }
+}
+
+print_list(map(\\(n) { return n * n }, make_range(0, %d)))
+'''
+
+NATIVE = '''
+make_range = \\(lo, hi) {
+  if lo == hi { return list() } else { return cons(lo, make_range(lo + 1, hi)) }
+}
+map = \\(f, lst) {
+  if lst == list() { return list() } else { return cons(f(head(lst)), map(f, tail(lst))) }
+}
+print_list = \\(lst) {
+  if lst == list() { return 0 } else { emit(head(lst)) return print_list(tail(lst)) }
+}
+
+print_list(map(\\(n) { return n * n }, make_range(0, %d)))
+'''
+
+
+def bench(mode, program, repeat):
+    best = None
+    emitted = None
+
+    for _ in range(repeat):
+        ast = parser.parse(parser.Stream(scanner.scan(program)))
+        emitted = []
+        env = Env(emit=NativeFunction('emit', emitted.append), **lists.builtins())
+
+        start = time.perf_counter()
+        MODES[mode](ast, env)
+        elapsed = time.perf_counter() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, emitted
+
+
+def parse_args():
+    argsparser = argparse.ArgumentParser(
+        description='Compares Church encoded lists, as in pairs.nl, with the native ones')
+    argsparser.add_argument('-n', type=int, default=2000, help='list length')
+    argsparser.add_argument('--repeat', type=int, default=5)
+    argsparser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    return argsparser.parse_args()
+
+
+def main():
+    args = parse_args()
+    failed = False
+
+    for mode in args.modes:
+        church, church_emitted = bench(mode, CHURCH % args.n, args.repeat)
+        native, native_emitted = bench(mode, NATIVE % args.n, args.repeat)
+
+        same = church_emitted == native_emitted == [i * i for i in range(args.n)]
+        failed = failed or not same
+        print('{:>8}: church {:.3f}s, native {:.3f}s, {:.2f}x faster, same output: {}'.format(
+            mode, church, native, church / native, same))
+
+    return not failed
+
+
+if __name__ == '__main__':
+    # The lists are built recursively
+    sys.setrecursionlimit(1000000)
+    threading.stack_size(512 * 1024 * 1024)
+    passed = []
+    thread = threading.Thread(target=lambda: passed.append(main()))
+    thread.start()
+    thread.join()
+
+    if passed != [True]:
+        raise SystemExit('FAIL')
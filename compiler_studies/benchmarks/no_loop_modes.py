@@ -0,0 +1,102 @@
+import argparse
+import time
+
+from compiler_studies.no_loop import async_eval
+from compiler_studies.no_loop import scanner
+from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop import compiler
+from compiler_studies.no_loop import interpreter
+from compiler_studies.no_loop import resolver
+from compiler_studies.no_loop import stack_eval
+from compiler_studies.no_loop import vm
+
+
+FIB = '''
+fib = \\(n) {
+  if n == 0 {
+    return 0
+  } else {
+    if n == 1 {
+      return 1
+    } else {
+      return fib(n-1) + fib(n-2)
+    }
+  }
+}
+
+result = fib(%d)
+'''
+
+
+def run_eval(ast, env):
+    interpreter.eval(ast, env)
+
+
+def run_closure(ast, env):
+    interpreter.compile(resolver.resolve(ast))(env)
+
+
+def run_stack(ast, env):
+    stack_eval.eval(ast, env)
+
+
+def run_vm(ast, env):
+    vm.run(compiler.compile(resolver.resolve(ast)), env)
+
+
+def run_async(ast, env):
+    async_eval.run(ast, env)
+
+
+MODES = {
+    'eval': run_eval,
+    'closure': run_closure,
+    'stack': run_stack,
+    'vm': run_vm,
+    'async': run_async,
+}
+
+
+def bench(mode, program, repeat):
+    best = None
+    result = None
+
+    for _ in range(repeat):
+        ast = parser.parse(parser.Stream(scanner.scan(program)))
+        env = interpreter.Env()
+
+        start = time.perf_counter()
+        MODES[mode](ast, env)
+        elapsed = time.perf_counter() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+        result = env['result']
+
+    return best, result
+
+
+def parse_args():
+    argsparser = argparse.ArgumentParser(
+        description='Compares the No-Loop execution modes on fib(n)')
+    argsparser.add_argument('-n', type=int, default=25)
+    argsparser.add_argument('--repeat', type=int, default=5)
+    return argsparser.parse_args()
+
+
+def main():
+    args = parse_args()
+    program = FIB % args.n
+
+    timings = {}
+    for mode in MODES:
+        timings[mode], result = bench(mode, program, args.repeat)
+        print('{:>8}: fib({}) = {} in {:.3f}s'.format(mode, args.n, result, timings[mode]))
+
+    for mode in MODES:
+        if mode != 'eval':
+            print('{:>8}: {:.2f}x the speed of eval'.format(
+                mode, timings['eval'] / timings[mode]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import time
+import tracemalloc
+
+from compiler_studies.no_loop import scanner
+from compiler_studies.no_loop import ast_parser as parser
+
+
+# Every statement kind, so `generate` can cycle through them
+STATEMENTS = [
+    'x{i} = {i} * (y + 2) - z / 4',
+    'f{i} = \\(a, b) {{ if a <= b {{ return a }} else {{ return f{i}(a - b, b) }} }}',
+    'if x{i} == 0 {{ y = y + 1 }} else {{ y = g(x{i}, \'odd\') }}',
+    '// statement {i}',
+    'print(f(x{i})(1, 2), "hello", 3 >= 4)',
+]
+
+
+def generate(count):
+    '''A program of `count` top level statements'''
+    return '\n'.join(
+        STATEMENTS[i % len(STATEMENTS)].format(i=i)
+        for i in range(count))
+
+
+def parse(program):
+    return parser.parse(parser.Stream(scanner.scan(program)))
+
+
+def parse_args():
+    argsparser = argparse.ArgumentParser(
+        description='Times parsing a large No-Loop program and measures its AST')
+    argsparser.add_argument('--statements', type=int, default=100000)
+    argsparser.add_argument('--repeat', type=int, default=5)
+    return argsparser.parse_args()
+
+
+def main():
+    args = parse_args()
+    program = generate(args.statements)
+
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        parse(program)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    ast = parse(program)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('{} statements, {:.1f} MB of source'.format(
+        len(ast.stmts), len(program) / 1024 / 1024))
+    print('parsed in {:.3f}s, AST takes {:.1f} MB'.format(best, size / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
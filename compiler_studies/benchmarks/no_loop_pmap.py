@@ -0,0 +1,70 @@
+import argparse
+import time
+
+from compiler_studies.benchmarks.no_loop_modes import MODES
+from compiler_studies.no_loop import scanner
+from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop import bulk
+from compiler_studies.no_loop import interpreter
+from compiler_studies.no_loop import lists
+from compiler_studies.no_loop import parallel
+from compiler_studies.no_loop.runtime import Env
+
+
+PROGRAM = '''
+fib = \\(n) { if n <= 1 { return n } else { return fib(n-1) + fib(n-2) } }
+result = %s(fib, map(\\(i) { return %d + i * 0 }, range(0, %d)))
+'''
+
+
+def bench(mode, program, repeat):
+    best = None
+    result = None
+
+    for _ in range(repeat):
+        ast = parser.parse(parser.Stream(scanner.scan(program)))
+        env = Env(**lists.builtins(), **bulk.builtins(interpreter.CALLS[mode]), **parallel.builtins(mode))
+
+        start = time.perf_counter()
+        MODES[mode](ast, env)
+        elapsed = time.perf_counter() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+        result = env['result']
+
+    return best, result
+
+
+def parse_args():
+    argsparser = argparse.ArgumentParser(
+        description='Compares map and pmap on computing fib(n) for each element of a list')
+    argsparser.add_argument('-n', type=int, default=20)
+    argsparser.add_argument('--elements', type=int, default=64)
+    argsparser.add_argument('--workers', type=int, default=parallel.WORKERS)
+    argsparser.add_argument('--repeat', type=int, default=3)
+    argsparser.add_argument('--modes', nargs='+', choices=list(MODES), default=['closure', 'vm'])
+    return argsparser.parse_args()
+
+
+def main():
+    args = parse_args()
+    parallel.WORKERS = args.workers
+    print('{} workers, fib({}) for {} elements'.format(args.workers, args.n, args.elements))
+
+    failed = False
+    for mode in args.modes:
+        serial, expected = bench(mode, PROGRAM % ('map', args.n, args.elements), args.repeat)
+        # Once more, so that the pool is already started
+        bench(mode, PROGRAM % ('pmap', args.n, 1), 1)
+        parallel_time, result = bench(mode, PROGRAM % ('pmap', args.n, args.elements), args.repeat)
+
+        failed = failed or result != expected
+        print('{:>8}: map {:.3f}s, pmap {:.3f}s, {:.2f}x faster, same result: {}'.format(
+            mode, serial, parallel_time, serial / parallel_time, result == expected))
+
+    if failed:
+        raise SystemExit('FAIL')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+
+from compiler_studies.no_loop import scanner
+
+
+EXAMPLES = os.path.join(os.path.dirname(scanner.__file__), 'examples', '*.nl')
+
+
+def generate(size):
+    '''Builds a program of at least `size` bytes out of the examples'''
+    sources = []
+    for path in sorted(glob.glob(EXAMPLES)):
+        with open(path) as f:
+            sources.append(f.read())
+
+    chunk = '\n'.join(sources)
+    return chunk * (size // len(chunk) + 1)
+
+
+def timed(scan, program):
+    start = time.perf_counter()
+    lexemes = scan(program)
+    return time.perf_counter() - start, lexemes
+
+
+def memory(scan, program):
+    '''Bytes allocated per lexeme for the result of `scan(program)`'''
+    tracemalloc.start()
+    try:
+        lexemes = scan(program)
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return size / len(lexemes)
+
+
+def parse_args():
+    argsparser = argparse.ArgumentParser(
+        description='Compares scanner.scan against scanner.scan_by_char')
+    argsparser.add_argument('--size', type=float, default=10, help='program size in MB')
+    argsparser.add_argument('--min-speedup', type=float, default=5)
+    return argsparser.parse_args()
+
+
+def main():
+    args = parse_args()
+    program = generate(int(args.size * 1024 * 1024))
+
+    print('Scanning {:.1f} MB'.format(len(program) / 1024 / 1024))
+
+    by_char_time, by_char = timed(scanner.scan_by_char, program)
+    print('scan_by_char: {:.2f}s'.format(by_char_time))
+
+    scan_time, lexemes = timed(scanner.scan, program)
+    print('        scan: {:.2f}s'.format(scan_time))
+
+    same = len(lexemes) == len(by_char) and all(
+        a.type == b.type and a.value == b.value
+        for (a, b) in zip(lexemes, by_char))
+
+    speedup = by_char_time / scan_time
+    print('{} lexemes, identical: {}, speedup: {:.1f}x'.format(len(lexemes), same, speedup))
+
+    # Smaller, since tracing allocations is slow
+    program = generate(len(program) // 10)
+    print('bytes per lexeme: {:.1f} for scan_by_char, {:.1f} for scan'.format(
+        memory(scanner.scan_by_char, program), memory(scanner.scan, program)))
+
+    if not same or speedup < args.min_speedup:
+        raise SystemExit('FAIL')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import io
+import random
+import time
+
+from compiler_studies.benchmarks.no_loop_scanner import generate
+from compiler_studies.no_loop import scanner
+
+
+# Characters the mutations draw from: mostly the ones that start or end
+# strings and comments, plus a few invalid ones
+ALPHABET = '/*"\'\n \\{}()=abc12A\r'
+
+
+def scan_iter(program):
+    # Small chunks, so that most lexemes end up spanning a few of them
+    return list(scanner.scan_iter(io.StringIO(program), chunk_size=7))
+
+
+SCANNERS = {
+    'scan_by_char': scanner.scan_by_char,
+    'scan': scanner.scan,
+    'scan_iter': scan_iter,
+}
+
+
+def outcome(scan, program):
+    '''The lexemes in `program` or the error scanning it'''
+    try:
+        return [(lexeme.type, lexeme.value) for lexeme in scan(program)]
+    except scanner.MalformedInput as e:
+        return str(e)
+
+
+def truncated(program, rng, count):
+    for _ in range(count):
+        yield program[:rng.randrange(len(program) + 1)]
+
+
+def mutated(program, rng, count):
+    for _ in range(count):
+        pos = rng.randrange(len(program) + 1)
+        yield program[:pos] + rng.choice(ALPHABET) + program[pos:]
+
+
+def fuzz(cases):
+    '''Checks that every scanner agrees on every case'''
+    failures = 0
+
+    for program in cases:
+        outcomes = {name: outcome(scan, program) for (name, scan) in SCANNERS.items()}
+
+        if len(set(map(repr, outcomes.values()))) != 1:
+            failures += 1
+            print('Scanners disagree on {!r}:'.format(program[:80]))
+            for name, result in outcomes.items():
+                print('  {:>12}: {!r}'.format(name, result if isinstance(result, str) else result[:5]))
+
+    return failures
+
+
+def long_comments(size):
+    '''Times every scanner on a `size` bytes comment, closed and unclosed'''
+    for closed in (True, False):
+        program = 'a = 1\n/*' + 'comment ' * (size // 8) + ('*/' if closed else '')
+
+        for name, scan in SCANNERS.items():
+            start = time.perf_counter()
+            result = outcome(scan, program)
+            elapsed = time.perf_counter() - start
+
+            print('{:>12}: {:.1f} MB {} comment in {:.3f}s ({})'.format(
+                name, len(program) / 1024 / 1024, 'closed' if closed else 'unclosed',
+                elapsed, result if isinstance(result, str) else '{} lexemes'.format(len(result))))
+
+
+def parse_args():
+    argsparser = argparse.ArgumentParser(
+        description='Fuzzes the No-Loop scanners against each other and times them on long comments')
+    argsparser.add_argument('--cases', type=int, default=2000)
+    argsparser.add_argument('--comment-size', type=float, default=4, help='comment size in MB')
+    argsparser.add_argument('--seed', type=int, default=0)
+    return argsparser.parse_args()
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    program = generate(0)
+
+    failures = fuzz(truncated(program, rng, args.cases))
+    failures += fuzz(mutated(program, rng, args.cases))
+    print('{} cases, {} failures'.format(2 * args.cases, failures))
+
+    long_comments(int(args.comment_size * 1024 * 1024))
+
+    if failures:
+        raise SystemExit('FAIL')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from compiler_studies.no_loop.batch import percentile
+
+
+PROGRAM = '''
+square = \\(n) { return n * n }
+print(square(%d))
+'''
+
+
+def connect(path, process):
+    '''A connection to the server at `path`, once it's listening'''
+    while True:
+        if process.poll() is not None:
+            raise SystemExit('The server exited with code {}'.format(process.returncode))
+        try:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(path)
+            return client
+        except (FileNotFoundError, ConnectionRefusedError):
+            client.close()
+            time.sleep(0.01)
+
+
+def bench_server(requests, jobs):
+    '''Round trip seconds of each request, and whether they all printed what they should'''
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'server.sock')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'compiler_studies.no_loop.server', '--socket', path, '--jobs', str(jobs)],
+        stderr=subprocess.DEVNULL)
+
+    latencies = []
+    correct = True
+    try:
+        client = connect(path, process)
+        responses = client.makefile('r')
+
+        for i in range(requests):
+            start = time.perf_counter()
+            client.sendall((json.dumps({'id': i, 'source': PROGRAM % i}) + '\n').encode())
+            response = json.loads(responses.readline())
+            latencies.append(time.perf_counter() - start)
+
+            correct = correct and response['id'] == i and response['stdout'] == '{}\n'.format(i * i)
+
+        client.close()
+    finally:
+        process.terminate()
+        process.wait()
+        os.rmdir(directory)
+
+    return latencies, correct
+
+
+def bench_processes(requests):
+    '''Seconds taken by running the program in a new interpreter process, each time'''
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'square.nl')
+
+    latencies = []
+    try:
+        for i in range(requests):
+            with open(path, 'w') as f:
+                f.write(PROGRAM % i)
+
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, '-m', 'compiler_studies.no_loop.interpreter', '--no-cache', path],
+                check=True, stdout=subprocess.DEVNULL)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        os.remove(path)
+        os.rmdir(directory)
+
+    return latencies
+
+
+def describe(latencies):
+    latencies = sorted(latencies)
+    return 'p50 {:.2f}ms, p99 {:.2f}ms'.format(
+        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000)
+
+
+def parse_args():
+    argsparser = argparse.ArgumentParser(
+        description='Compares the latency of small programs run by the server and by new processes')
+    argsparser.add_argument('--requests', type=int, default=1000)
+    argsparser.add_argument('--processes', type=int, default=20, help='programs to run in new processes')
+    argsparser.add_argument('--jobs', type=int, default=1)
+    return argsparser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    server, correct = bench_server(args.requests, args.jobs)
+    processes = bench_processes(args.processes)
+
+    print('{} requests to the server: {}, all correct: {}'.format(
+        args.requests, describe(server), correct))
+    print('{} new processes: {}'.format(args.processes, describe(processes)))
+    print('speedup: {:.0f}x'.format(
+        percentile(sorted(processes), 50) / percentile(sorted(server), 50)))
+
+    if not correct:
+        raise SystemExit('FAIL')
+
+
+if __name__ == '__main__':
+    main()
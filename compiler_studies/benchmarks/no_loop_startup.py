@@ -0,0 +1,70 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from compiler_studies.benchmarks.no_loop_parser import generate
+from compiler_studies.no_loop import nlcache
+
+
+def timed(source_file, repeat, before=None, **kwargs):
+    '''Best time to get every statement of `source_file` out of `nlcache.parse_file`'''
+    best = None
+    for _ in range(repeat):
+        if before is not None:
+            before()
+
+        start = time.perf_counter()
+        count = sum(1 for _ in nlcache.parse_file(source_file, **kwargs))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, count
+
+
+def parse_args():
+    argsparser = argparse.ArgumentParser(
+        description='Times loading a large No-Loop program without, with a stale and with a fresh cache entry')
+    argsparser.add_argument('--statements', type=int, default=100000)
+    argsparser.add_argument('--repeat', type=int, default=5)
+    argsparser.add_argument('--min-speedup', type=float, default=2)
+    return argsparser.parse_args()
+
+
+def main():
+    args = parse_args()
+    directory = tempfile.mkdtemp()
+
+    try:
+        source_file = os.path.join(directory, 'library.nl')
+        with open(source_file, 'w') as f:
+            f.write(generate(args.statements))
+
+        def remove_entry():
+            shutil.rmtree(os.path.join(directory, nlcache.DIRECTORY), ignore_errors=True)
+
+        print('{} statements, {:.1f} MB of source'.format(
+            args.statements, os.path.getsize(source_file) / 1024 / 1024))
+
+        uncached, count = timed(source_file, args.repeat, use_cache=False)
+        print('    no cache: {:.3f}s'.format(uncached))
+
+        cold, _ = timed(source_file, args.repeat, before=remove_entry)
+        print('  cold start: {:.3f}s (parse and store)'.format(cold))
+
+        warm, warm_count = timed(source_file, args.repeat)
+        print('  warm start: {:.3f}s, {:.1f} MB entry'.format(
+            warm, os.path.getsize(nlcache.cache_path(source_file)) / 1024 / 1024))
+
+        speedup = cold / warm
+        print('speedup: {:.1f}x'.format(speedup))
+    finally:
+        shutil.rmtree(directory)
+
+    if warm_count != count or speedup < args.min_speedup:
+        raise SystemExit('FAIL')
+
+
+if __name__ == '__main__':
+    main()
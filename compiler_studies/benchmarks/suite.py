@@ -0,0 +1,258 @@
+import argparse
+import fnmatch
+import json
+import platform
+import sys
+import threading
+import time
+
+from compiler_studies.add_mult import scanner as add_mult_scanner
+from compiler_studies.add_mult import ast_parser as add_mult_parser
+from compiler_studies.add_mult import interpreter as add_mult_interpreter
+from compiler_studies.no_loop import scanner
+from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop import interpreter
+
+
+# Benchmark suite
+#
+# Times the scanner, parser and evaluator of both front ends, separately, on
+# generated programs, and stores the best of a few runs of every stage as
+# JSON:
+#
+#   {"python": ..., "scale": ..., "repeat": ...,
+#    "results": {"no_loop.deep_recursion.eval": {"size": ..., "seconds": ...}, ...}}
+#
+# Comparing against a baseline stored the same way fails (exit status 1)
+# when any stage got slower by more than the threshold:
+#
+#   python -m compiler_studies.benchmarks.suite --output baseline.json
+#   ... change things ...
+#   python -m compiler_studies.benchmarks.suite --baseline baseline.json
+#
+# Timings only compare on the same machine and Python, so the baseline isn't
+# checked in.
+
+STAGES = ('scan', 'parse', 'eval')
+
+# Stages which take this many seconds longer or less haven't regressed,
+# whatever the percentage: that's noise for the shortest ones
+NOISE = 0.001
+
+
+# Programs of size `n`
+
+
+def no_loop_deep_recursion(n):
+    '''A non tail recursive function, `n` calls deep'''
+    return '''
+sum_to = \\(n) {{
+  if n == 0 {{
+    return 0
+  }} else {{
+    return n + sum_to(n - 1)
+  }}
+}}
+result = sum_to({})
+'''.format(n)
+
+
+def no_loop_long_expression(n):
+    '''A single expression with `n` operands'''
+    operators = ['+', '*', '-', '+']
+    terms = ['0']
+    for i in range(1, n):
+        terms.append(' {} {}'.format(operators[i % len(operators)], i % 10))
+    return 'result = {}\n'.format(''.join(terms))
+
+
+def no_loop_many_statements(n):
+    '''`n` short top level statements'''
+    statements = ['x = 0']
+    for i in range(1, n):
+        if i % 3 == 0:
+            statements.append('f{0} = \\(a) {{ return a + {0} }}'.format(i))
+        elif i % 3 == 1:
+            statements.append('x = f{}(x)'.format(i - 1) if i > 1 else 'x = 1')
+        else:
+            statements.append('if x >= {0} {{ x = x - {0} }} else {{ x = x + {0} }}'.format(i))
+    return '\n'.join(statements) + '\n'
+
+
+def no_loop_big_comments(n):
+    '''A few statements between comments `n` characters long in total'''
+    text = 'A comment which goes on and on, without any code in it. '
+    comment = (text * (1000 // len(text) + 1))[:1000]
+
+    chunks = []
+    for i in range(max(1, n // 2000)):
+        chunks.append('/* {} */'.format(comment))
+        chunks.append('// {}'.format(comment))
+        chunks.append('x{} = {}'.format(i, i))
+    return '\n'.join(chunks) + '\n'
+
+
+def add_mult_long_expression(n):
+    '''An expression with `n` operands'''
+    return ' + '.join(
+        '{} * {}'.format(i % 10, (i + 1) % 10) if i % 2 else '{}'.format(i % 10)
+        for i in range(n))
+
+
+def add_mult_deep_nesting(n):
+    '''`n` nested parenthesized expressions'''
+    return '(' * n + '1' + ''.join(' + {}) * 1'.format(i % 10) for i in range(n))
+
+
+# Front ends, with a function for each stage taking the previous one's output
+
+
+def no_loop_eval(ast):
+    env = interpreter.Env()
+    interpreter.eval(ast, env)
+    return env
+
+
+FRONT_ENDS = {
+    'no_loop': {
+        'stages': {
+            'scan': scanner.scan,
+            'parse': lambda lexemes: parser.parse(parser.Stream(lexemes)),
+            'eval': no_loop_eval,
+        },
+        'programs': {
+            'deep_recursion': (no_loop_deep_recursion, 20000),
+            'long_expression': (no_loop_long_expression, 20000),
+            'many_statements': (no_loop_many_statements, 10000),
+            'big_comments': (no_loop_big_comments, 2000000),
+        },
+    },
+    'add_mult': {
+        'stages': {
+            'scan': add_mult_scanner.scan,
+            'parse': lambda lexemes: add_mult_parser.parse(add_mult_parser.Stream(lexemes)),
+            'eval': add_mult_interpreter.eval,
+        },
+        'programs': {
+            'long_expression': (add_mult_long_expression, 5000),
+            'deep_nesting': (add_mult_deep_nesting, 2000),
+        },
+    },
+}
+
+
+def best_time(function, arg, repeat):
+    '''The shortest time `function(arg)` took, and what it returned'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(scale=1.0, repeat=5, only=None):
+    '''Times every stage of every program, as the "results" stored as JSON'''
+    results = {}
+
+    for front_end, config in FRONT_ENDS.items():
+        for program, (generate, size) in config['programs'].items():
+            name = '{}.{}'.format(front_end, program)
+            if only and not any(fnmatch.fnmatch(name, pattern) for pattern in only):
+                continue
+
+            size = max(1, int(size * scale))
+            value = generate(size)
+
+            # Each stage runs on what the one before returned
+            for stage in STAGES:
+                seconds, value = best_time(config['stages'][stage], value, repeat)
+                results['{}.{}'.format(name, stage)] = {'size': size, 'seconds': seconds}
+                print('{:<40} {:>9} {:>10.4f}s'.format(
+                    '{}.{}'.format(name, stage), size, seconds), file=sys.stderr)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    '''The stages which got slower than `baseline` by more than `threshold` percent'''
+    regressions = []
+
+    print('{:<40} {:>11} {:>11} {:>9}'.format('stage', 'baseline', 'now', 'change'))
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if before is None or before['size'] != result['size']:
+            print('{:<40} not in the baseline, or of another size'.format(name))
+            continue
+
+        change = (result['seconds'] - before['seconds']) / before['seconds'] * 100
+        regressed = change > threshold and result['seconds'] - before['seconds'] > NOISE
+        print('{:<40} {:>10.4f}s {:>10.4f}s {:>+8.1f}%{}'.format(
+            name, before['seconds'], result['seconds'], change, '  REGRESSED' if regressed else ''))
+
+        if regressed:
+            regressions.append(name)
+
+    return regressions
+
+
+def parse_args():
+    argsparser = argparse.ArgumentParser(
+        description='Times the scanners, parsers and evaluators on generated programs, '
+                    'failing on regressions against a baseline')
+    argsparser.add_argument(
+        '--scale', type=float, default=1.0, help='multiplies the size of every program')
+    argsparser.add_argument('--repeat', type=int, default=5)
+    argsparser.add_argument(
+        '--only', nargs='+', metavar='PATTERN',
+        help='only the programs matching these patterns, as in no_loop.* or *.deep_*')
+    argsparser.add_argument('--output', metavar='FILE', help='write the results to FILE')
+    argsparser.add_argument('--baseline', metavar='FILE', help='compare the results to FILE')
+    argsparser.add_argument(
+        '--threshold', type=float, default=10.0, metavar='PCT',
+        help='fail when a stage takes PCT percent longer than in the baseline (default 10)')
+    return argsparser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = run(args.scale, args.repeat, args.only)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'scale': args.scale,
+                'repeat': args.repeat,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if baseline is None:
+        return True
+
+    regressions = compare(results, baseline['results'], args.threshold)
+    if regressions:
+        print('{} of {} stages regressed by more than {:g}%'.format(
+            len(regressions), len(results), args.threshold))
+    return not regressions
+
+
+if __name__ == '__main__':
+    # The recursive descent parsers and evaluators recurse once per nesting
+    # level, or operand for Add-Mult
+    sys.setrecursionlimit(1000000)
+    threading.stack_size(512 * 1024 * 1024)
+    passed = []
+    thread = threading.Thread(target=lambda: passed.append(main()))
+    thread.start()
+    thread.join()
+
+    if passed != [True]:
+        raise SystemExit('FAIL')
@@ -2,101 +2,113 @@ from compiler_studies.no_loop import scanner
 
 
 class Node:
-    __counter = 0
+    __slots__ = ()
 
-    def __init__(self):
-        self.id = Node.__counter
-        Node.__counter += 1
+    def label(self):
+        return self.__class__.__name__
 
     def __str__(self):
-        return '"{}" [label = "{}"]'.format(self.id, self.__class__.__name__)
+        return self.label()
 
 
 class ASTNode(Node):
+    __slots__ = ('type', 'children')
+
     def __init__(self, type, children=None):
-        super().__init__()
         self.type = type
+        self.children = children or []
 
-        # Filter out production rules -> $
-        self.children = [c for c in children if c is not None] or []
-
-    def __str__(self):
-        return '"{}" [label = "{}"]'.format(self.id, self.type)
+    def label(self):
+        return self.type
 
 
 class ASTLeaf(Node):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
 
 class Atom(Node):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
-    def __str__(self):
-        return '"{}" [label = "{}"]'.format(self.id, self.value)
+    def label(self):
+        return self.value
 
 
 class Comment(Node):
+    __slots__ = ('value',)
+
     def __init__(self, value):
-        super().__init__()
         self.value = value
 
 
 class Num(Atom):
-    def __init__(self, value):
-        super().__init__(value)
+    __slots__ = ()
 
 
 class String(Atom):
-    def __init__(self, value):
-        super().__init__(value)
+    __slots__ = ()
+
+
+class Const(Atom):
+    '''A literal value worked out ahead of time by the optimizer'''
+    __slots__ = ()
 
 
 class VarLookup(Atom):
+    # Filled in by the resolver: how many frames up the name lives and
+    # its position in that frame (None for globals, looked up by name), and
+    # the (depth, slot) pairs to look in while it's unset
+    __slots__ = ('depth', 'slot', 'fallbacks')
+
     def __init__(self, value):
         super().__init__(value)
+        self.depth = None
+        self.slot = None
+        self.fallbacks = ()
 
 
 class FunCall(Node):
+    __slots__ = ('expr', 'args')
+
     def __init__(self, expr, args):
-        super().__init__()
         self.expr = expr
         self.args = args
 
-    def __str__(self):
-        return '"{}" [label = "{}"]'.format(self.id, 'FunCall')
-
     @property
     def children(self):
         return self.args
 
 
 class IfElse(Node):
+    __slots__ = ('cond', 'cons', 'alt')
+
     def __init__(self, cond, cons, alt):
-        super().__init__()
         self.cond = cond
         self.cons = cons
         self.alt = alt
 
-    def __str__(self):
-        return '"{}" [label = "{}"]'.format(self.id, 'IfElse')
-
     @property
     def children(self):
         return [self.cond, self.cons, self.alt]
 
 
 class LambDef(Node):
-    def __init__(self, args, body):
-        super().__init__()
+    # `nslots` is filled in by the resolver: arguments plus local variables.
+    # `memoize` is set by `memo.mark`, for functions to memoize. `position`
+    # is the line and column of the backslash, when known.
+    __slots__ = ('args', 'body', 'nslots', 'memoize', 'position')
+
+    def __init__(self, args, body, position=None):
         self.args = args
         self.body = body
-
-    def __str__(self):
-        return '"{}" [label = "{}"]'.format(self.id, 'LambDef')
+        self.nslots = None
+        self.memoize = None
+        self.position = position
 
     @property
     def children(self):
@@ -104,20 +116,19 @@ class LambDef(Node):
 
 
 class Return(Node):
+    __slots__ = ('expr',)
+
     def __init__(self, expr):
-        super().__init__()
         self.expr = expr
 
 
 class Stmts(Node):
+    # Weak references let bulk cache what it compiles from function bodies
+    __slots__ = ('stmts', '__weakref__')
+
     def __init__(self, stmts):
-        super().__init__()
         self.stmts = stmts
 
-    def __str__(self):
-        #return '<{} Stmts>'.format(self.id)
-        return '"{}" [label = "{}"]'.format(self.id, 'Stmts')
-
     @property
     def children(self):
         return self.stmts
@@ -127,13 +138,21 @@ class InvalidSyntax(Exception):
     pass
 
 
+def where(lexeme):
+    '''Where `lexeme` is in the program, for error messages'''
+    position = lexeme.position()
+    if position is None:
+        return ''
+    return ' at line {}, column {}'.format(*position)
+
+
 def stmts(stream):
     lst = []
 
     s = stmt(stream)
 
     if s is None:
-        raise InvalidSyntax('Invalid statement {}'.format(stream.head))
+        raise InvalidSyntax('Invalid statement {}{}'.format(stream.head, where(stream.head)))
 
     while s is not None:
         lst.append(s)
@@ -177,7 +196,7 @@ def stmt(stream):
     if a is not None:
         return a
 
-    raise InvalidSyntax('Unable to parse statement')
+    raise InvalidSyntax('Unable to parse statement{}'.format(where(stream.head)))
 
 
 def ret(stream):
@@ -284,96 +303,57 @@ def asgn_prime(stream):
         return None
 
 
-def comp(stream):
-    e = expr(stream)
-    prime = comp_prime(stream)
+# Binding power of the binary operators: the higher, the tighter
+PRECEDENCE = {
+    '==': 1,
+    '>=': 1,
+    '<=': 1,
+    '+': 2,
+    '-': 2,
+    '*': 3,
+    '/': 3,
+}
 
-    if prime is not None:
-        prime.children = [e] + prime.children
-        return prime
-    else:
-        return e
+COMPARISON, SUM, PRODUCT = 1, 2, 3
 
+# Comparisons don't chain: `a == b == c` is a syntax error
+NON_ASSOCIATIVE = {COMPARISON}
 
-def comp_prime(stream):
-    if stream.head.value in ['==', '<=', '>=']:
-        w = stream.head
-        next(stream)
-        e = expr(stream)
-
-        return ASTNode(w.type, [e])
 
-    return None
+def binary(stream, min_precedence):
+    '''Parses factors joined by operators of at least `min_precedence`
 
+    Precedence climbing: operators of the same precedence are folded into
+    left-associative nodes in a loop, so we only recurse to parse the
+    tighter binding right hand side of an operator.
+    '''
+    left = factor(stream)
 
-def expr(stream):
-    t = term(stream)
-    prime = expr_prime(stream)
-
-    if prime is not None:
-        prime.children = [t] + prime.children
-        return prime
-    else:
-        return t
+    while True:
+        op = stream.head.type
+        precedence = PRECEDENCE.get(op)
 
+        if precedence is None or precedence < min_precedence:
+            return left
 
-def expr_prime(stream):
-    if stream.head.type in '+-':
-        w = stream.head
         next(stream)
-        t = term(stream)
-        prime = expr_prime(stream)
+        right = binary(stream, precedence + 1)
+        left = ASTNode(op, [left, right])
 
-        if prime is not None:
-            prime.children = [t] + prime.children
-            return ASTNode(
-                w.type,
-                [prime]
-            )
+        if precedence in NON_ASSOCIATIVE:
+            min_precedence = precedence + 1
 
-        else:
-            return ASTNode(
-                w.type,
-                [t]
-            )
-
-    return None
-
-
-def term(stream):
-    f = factor(stream)
-    prime = term_prime(stream)
-
-    if prime is not None:
-        prime.children = [f] + prime.children
-        return prime
-
-    else:
-        return f
 
+def comp(stream):
+    return binary(stream, COMPARISON)
 
-def term_prime(stream):
-    if stream.head.type in '*/':
-        w = stream.head
-        next(stream)
 
-        f = factor(stream)
-        prime = term_prime(stream)
+def expr(stream):
+    return binary(stream, SUM)
 
-        if prime is not None:
-            prime.children = [f] + prime.children
-            return ASTNode(
-                w.type,
-                [prime]
-            )
 
-        else:
-            return ASTNode(
-                w.type,
-               [f]
-            )
-    else:
-        return None
+def term(stream):
+    return binary(stream, PRODUCT)
 
 
 def factor(stream):
@@ -413,7 +393,7 @@ def factor(stream):
         next(stream)
         return e
 
-    raise InvalidSyntax('Unable to parse atom {}'.format(stream.head.value))
+    raise InvalidSyntax('Unable to parse atom {}{}'.format(stream.head.value, where(stream.head)))
 
 
 def callsargs(stream):
@@ -462,6 +442,7 @@ def lambdef(stream):
     if stream.head.value != '\\':
         return None
 
+    position = stream.head.position()
     next(stream)
     al = argsdef(stream)
     stream.test('{')
@@ -469,12 +450,21 @@ def lambdef(stream):
     ss = stmts(stream)
     stream.test('}')
     next(stream)
-    return LambDef(al, ss)
+    return LambDef(al, ss, position)
 
 
 parse = stmts
 
 
+def parse_iter(stream):
+    '''Yields the top level statements of a program as they are parsed'''
+    s = stmt(stream)
+
+    while s is not None:
+        yield s
+        s = morestmts(stream)
+
+
 def pprint(node, indent=0):
     print('{}{}'.format('\t'*indent, node))
     if isinstance(node, ASTNode):
@@ -483,15 +473,22 @@ def pprint(node, indent=0):
 
 
 def print_dot(node):
+    # Vertex ids, only handed out for the graph
+    ids = {}
+
+    def vertex(node):
+        if node not in ids:
+            ids[node] = len(ids)
+            print('"{}" [label = "{}"];'.format(ids[node], node.label()))
+        return ids[node]
 
     def inner(node):
+        vertex(node)
         if not hasattr(node, 'children'):
-            print('{};'.format(node))
             return
-        print('{};'.format(node))
 
         for child in node.children:
-            print('{} -> {};'.format(node.id, child.id))
+            print('{} -> {};'.format(vertex(node), vertex(child)))
             inner(child)
 
     print('digraph G {')
@@ -500,6 +497,8 @@ def print_dot(node):
 
 
 class Stream:
+    # Only ever holds on to the current lexeme, so `lexemes` can be a
+    # generator like `scanner.scan_iter`
     def __init__(self, lexemes):
         self.iter = iter(lexemes)
         self.head = None
@@ -521,7 +520,8 @@ class Stream:
 
     def test(self, expected_value):
         if self.head.value != expected_value:
-            raise InvalidSyntax('Expected {}; found {}'.format(expected_value, self.head.value))
+            raise InvalidSyntax('Expected {}; found {}{}'.format(
+                expected_value, self.head.value, where(self.head)))
 
     def next_and_test(self, value):
         next(self)
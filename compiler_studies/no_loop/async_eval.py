@@ -0,0 +1,248 @@
+import asyncio
+import inspect
+import os
+import threading
+
+from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop import memo
+from compiler_studies.no_loop.runtime import Env, Function, NativeFunction
+
+
+# A tree-walking evaluator with the same semantics as `interpreter.eval`,
+# but made of coroutines, so that natives can be coroutine functions too:
+# their calls are awaited, and the event loop runs something else while they
+# wait for I/O.
+#
+# Consecutive arguments of a call which are calls to natives that only wait
+# or read (OVERLAPPING), of values or other such calls, are evaluated
+# concurrently, as tasks, so that `pair(http_get(a), http_get(b))` makes both
+# requests at once. They start once the arguments before them are done.
+# Everything else is evaluated in order: calls to natives writing (as
+# `pair(write_file(p, t), read_file(p))` does), and calls to functions, which
+# might, and whose calls the profiler and limits expect to nest.
+#
+# Natives calling functions (as map does) wait for them with `run_sync`,
+# which can't block the loop the native was called from: it runs them on a
+# loop of their own, in a thread of its own.
+
+# Natives whose calls can overlap, by name
+OVERLAPPING = {'read_file', 'http_get', 'sleep'}
+
+# The event loop programs run on, created by the first one
+LOOP = None
+
+# Loops running in threads of their own, which `run_sync` isn't waiting on
+IDLE_LOOPS = []
+IDLE_LOOPS_LOCK = threading.Lock()
+
+
+def loop():
+    global LOOP
+    if LOOP is None:
+        LOOP = asyncio.new_event_loop()
+    return LOOP
+
+
+def forget_loops():
+    # Processes forked while a program runs (as pmap's workers) get copies of
+    # the loops which seem to be running, and none of their threads
+    global LOOP, IDLE_LOOPS
+    LOOP = None
+    IDLE_LOOPS = []
+
+
+os.register_at_fork(after_in_child=forget_loops)
+
+
+def run(ast, env):
+    return run_sync(eval(ast, env))
+
+
+def run_sync(awaitable):
+    '''Waits for `awaitable`, from code which isn't a coroutine'''
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        task = loop().create_task(awaitable)
+        try:
+            return loop().run_until_complete(task)
+        except BaseException:
+            # Interrupted (as by the limits' timer): don't leave it to run
+            # with the next program
+            task.cancel()
+            raise
+
+    # Called by a native (as import, or map), from a coroutine
+    with IDLE_LOOPS_LOCK:
+        thread_loop = IDLE_LOOPS.pop() if IDLE_LOOPS else None
+    if thread_loop is None:
+        thread_loop = asyncio.new_event_loop()
+        threading.Thread(target=thread_loop.run_forever, daemon=True).start()
+
+    future = asyncio.run_coroutine_threadsafe(awaitable, thread_loop)
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
+    finally:
+        with IDLE_LOOPS_LOCK:
+            IDLE_LOOPS.append(thread_loop)
+
+
+async def eval(ast, env):
+    if isinstance(ast, parser.Stmts):
+        for stmt in ast.stmts:
+            if isinstance(stmt, parser.Return):
+                return await eval(stmt.expr, env)
+
+            # We can return from a if-else block
+            elif isinstance(stmt, parser.IfElse):
+                ret = await eval(stmt, env)
+                if ret is not None:
+                    return ret
+            else:
+                await eval(stmt, env)
+
+    elif isinstance(ast, parser.ASTNode):
+        return await eval_astnode(ast, env)
+
+    elif isinstance(ast, parser.VarLookup):
+        return env.lookup(ast.value)
+
+    elif isinstance(ast, parser.Num):
+        return int(ast.value)
+
+    elif isinstance(ast, (parser.String, parser.Const)):
+        return ast.value
+
+    elif isinstance(ast, parser.IfElse):
+        if await eval(ast.cond, env):
+            return await eval(ast.cons, env)
+        return await eval(ast.alt, env)
+
+    elif isinstance(ast, parser.LambDef):
+        if ast.memoize:
+            return memo.memoized(Function(ast.args, ast.body, env), ast.memoize, call_blocking)
+        return Function(ast.args, ast.body, env)
+
+    elif isinstance(ast, parser.FunCall):
+        return await apply(ast, env)
+
+
+async def eval_astnode(ast, env):
+    left, right = ast.children
+
+    if ast.type == '=':
+        env[left.value] = await eval(right, env)
+        return env[left.value]
+
+    elif ast.type == '+':
+        return await eval(left, env) + await eval(right, env)
+    elif ast.type == '-':
+        return await eval(left, env) - await eval(right, env)
+    elif ast.type == '*':
+        return await eval(left, env) * await eval(right, env)
+    elif ast.type == '/':
+        return await eval(left, env) / await eval(right, env)
+    elif ast.type == '==':
+        return await eval(left, env) == await eval(right, env)
+    elif ast.type == '>=':
+        return await eval(left, env) >= await eval(right, env)
+    elif ast.type == '<=':
+        return await eval(left, env) <= await eval(right, env)
+
+
+async def eval_args(args, env):
+    values = []
+
+    # Arguments since the last one which doesn't overlap, which start once
+    # it's done
+    run = []
+    for arg in args:
+        if overlaps(arg, env):
+            run.append(arg)
+            continue
+
+        values.extend(await eval_together(run, env))
+        run = []
+        values.append(await eval(arg, env))
+
+    values.extend(await eval_together(run, env))
+    return values
+
+
+async def eval_together(args, env):
+    calls = [arg for arg in args if isinstance(arg, parser.FunCall)]
+    if len(calls) < 2:
+        return [await eval(arg, env) for arg in args]
+
+    tasks = {
+        id(arg): asyncio.ensure_future(eval(arg, env))
+        for arg in calls
+    }
+    try:
+        return [await tasks[id(arg)] if id(arg) in tasks else await eval(arg, env) for arg in args]
+    except BaseException:
+        # Don't leave the others running, nor their errors unretrieved
+        for task in tasks.values():
+            if task.done() and not task.cancelled():
+                task.exception()
+            task.cancel()
+        raise
+
+
+def overlaps(ast, env):
+    '''Whether `ast` only waits or reads, so can run alongside other arguments'''
+    if isinstance(ast, parser.FunCall):
+        if not isinstance(ast.expr, parser.VarLookup):
+            return False
+        try:
+            fun = env.lookup(ast.expr.value)
+        except Exception:
+            return False
+        return (isinstance(fun, NativeFunction) and fun.name in OVERLAPPING
+                and all(overlaps(arg, env) for arg in ast.args))
+
+    elif isinstance(ast, parser.ASTNode):
+        return ast.type != '=' and all(overlaps(child, env) for child in ast.children)
+
+    return not isinstance(ast, (parser.Stmts, parser.IfElse, parser.Return))
+
+
+async def apply(ast, env):
+    fun = await eval(ast.expr, env)
+
+    args = await eval_args(ast.args, env)
+
+    if isinstance(fun, NativeFunction):
+        ret = fun.callable(*args)
+        if inspect.isawaitable(ret):
+            ret = await ret
+        return ret
+
+    return await call(fun, args)
+
+
+async def call(fun, args):
+    if len(fun.args) != len(args):
+        raise RuntimeError('Wrong number of arguments: expected {}, got {}'.format(
+            len(fun.args), len(args)))
+
+    # Augment function environment with arguments
+    new_env = Env(fun.env, **{
+        name: value
+        for (name, value) in zip(fun.args, args)
+    })
+
+    ret = await eval(fun.body, new_env)
+
+    if ret is None:
+        raise RuntimeError('Missing return statement')
+
+    return ret
+
+
+def call_blocking(fun, args):
+    '''Calls `fun` from a native, waiting for it'''
+    return run_sync(call(fun, args))
@@ -0,0 +1,237 @@
+import collections
+import contextlib
+import io
+import math
+import multiprocessing
+import multiprocessing.connection
+import sys
+import time
+import traceback
+
+
+# Batch runs
+#
+# `run` runs many independent programs on a pool of worker processes, each
+# file in globals of its own, and prints what each one printed, returned or
+# raised, in the order of the files.
+#
+# A worker runs one file at a time, so a file which doesn't finish in time is
+# stopped by killing its worker, which is then replaced, like one which
+# crashes. The other files don't notice.
+
+OK, FAILED, TIMED_OUT, CRASHED = 'ok', 'failed', 'timed out', 'crashed'
+
+Result = collections.namedtuple('Result', 'path status stdout stderr value error elapsed')
+
+
+def capture(run_file, path):
+    '''Runs `path` with `run_file`, returning what it printed, returned or raised'''
+    stdout, stderr = io.StringIO(), io.StringIO()
+    value = error = None
+
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            value = run_file(path)
+        except Exception:
+            error = traceback.format_exc(limit=-1).strip().splitlines()[-1]
+
+    return (FAILED if error else OK, stdout.getvalue(), stderr.getvalue(),
+            None if value is None else str(value), error)
+
+
+def serve(conn, run_file):
+    '''Runs the files received on `conn`, until it receives None'''
+    while True:
+        path = conn.recv()
+        if path is None:
+            return
+        conn.send(capture(run_file, path))
+
+
+class Worker:
+    def __init__(self, run_file):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve, args=(child_conn, run_file), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        # The index of the file being run, and when it was sent
+        self.index = None
+        self.started = None
+
+    def send(self, index, path):
+        self.index = index
+        self.started = time.perf_counter()
+        self.conn.send(path)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+def run_files(files, run_file, jobs, timeout=None, done=None):
+    '''Runs `files` with `run_file(path)` on `jobs` workers
+
+    Calls `done(index, result)` as each file finishes, and returns every
+    Result, in the order of `files`.
+    '''
+    if jobs < 1:
+        raise ValueError('Need at least one job, got {}'.format(jobs))
+
+    results = [None] * len(files)
+    pending = collections.deque(enumerate(files))
+    idle = [Worker(run_file) for _ in range(min(jobs, len(files)))]
+    busy = []
+
+    def finish(worker, status, stdout='', stderr='', value=None, error=None):
+        elapsed = time.perf_counter() - worker.started
+        results[worker.index] = result = Result(
+            files[worker.index], status, stdout, stderr, value, error, elapsed)
+        busy.remove(worker)
+        if done is not None:
+            done(worker.index, result)
+
+    try:
+        while pending or busy:
+            while pending and idle:
+                worker = idle.pop()
+                worker.send(*pending.popleft())
+                busy.append(worker)
+
+            wait = None
+            if timeout is not None:
+                first_deadline = min(worker.started for worker in busy) + timeout
+                wait = max(0, first_deadline - time.perf_counter())
+
+            ready = multiprocessing.connection.wait([worker.conn for worker in busy], wait)
+
+            for worker in list(busy):
+                if worker.conn in ready:
+                    try:
+                        finish(worker, *worker.conn.recv())
+                        idle.append(worker)
+                        continue
+                    except (EOFError, OSError):
+                        worker.kill()
+                        finish(worker, CRASHED, error='Worker exited with code {}'.format(
+                            worker.process.exitcode))
+
+                elif timeout is not None and time.perf_counter() - worker.started >= timeout:
+                    worker.kill()
+                    finish(worker, TIMED_OUT, error='Timed out after {}s'.format(timeout))
+
+                else:
+                    continue
+
+                idle.append(Worker(run_file))
+    finally:
+        for worker in idle:
+            worker.stop()
+        for worker in busy:
+            worker.kill()
+
+    return results
+
+
+def percentile(values, q):
+    '''The nearest rank `q` percentile of sorted `values`'''
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def report(result, file=None):
+    header = '==> {} <== {} in {:.1f}ms'.format(result.path, result.status, result.elapsed * 1000)
+    if result.value is not None:
+        header += ', returned {}'.format(result.value)
+    if result.error is not None:
+        header += ': {}'.format(result.error)
+
+    print(header, file=file)
+    print(result.stdout, end='', file=file)
+    if result.stderr:
+        print(result.stderr, end='', file=sys.stderr)
+
+
+def summary(results, elapsed):
+    counts = collections.Counter(result.status for result in results)
+    latencies = sorted(result.elapsed for result in results)
+
+    text = '{} files in {:.2f}s ({:.1f} files/s): {}'.format(
+        len(results), elapsed, len(results) / elapsed if elapsed else 0,
+        ', '.join('{} {}'.format(counts[status], status)
+                  for status in (OK, FAILED, TIMED_OUT, CRASHED) if counts[status] or status == OK))
+    if latencies:
+        text += '; latency p50 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms'.format(
+            percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, latencies[-1] * 1000)
+    return text
+
+
+def run(files, run_file, jobs, timeout=None):
+    '''Runs and reports on `files`, returning the exit status'''
+    # Files are reported in order, as soon as the ones before them are done
+    finished = {}
+    next_index = 0
+
+    def done(index, result):
+        nonlocal next_index
+        finished[index] = result
+        while next_index in finished:
+            report(finished.pop(next_index))
+            next_index += 1
+        sys.stdout.flush()
+
+    start = time.perf_counter()
+    results = run_files(files, run_file, jobs, timeout, done)
+    elapsed = time.perf_counter() - start
+
+    print(summary(results, elapsed), file=sys.stderr)
+    return 0 if all(result.status == OK for result in results) else 1
+
+
+def test():
+    '''Runs files which print, fail, time out and use pmap on a pool of workers'''
+    import functools
+    import os
+    import shutil
+    import tempfile
+
+    from compiler_studies.no_loop import interpreter
+
+    programs = [
+        # Source, status and what it prints
+        ('print(1 + 2)', OK, '3\n'),
+        ('print(sum(pmap(\\(x) { return x * 2 }, range(0, 100))))', OK, '9900\n'),
+        ('print(pmap(\\(x) { return x * 2 }, list(1, 2, 3), 1))', OK, '[2, 4, 6]\n'),
+        ('print(1 / 0)', FAILED, ''),
+        ('f = \\(n) { return f(n + 1) } f(0)', TIMED_OUT, ''),
+    ]
+
+    directory = tempfile.mkdtemp()
+    files = []
+    for i, (source, _, _) in enumerate(programs):
+        files.append(os.path.join(directory, '{}.nl'.format(i)))
+        with open(files[-1], 'w') as f:
+            f.write(source)
+
+    args = interpreter.make_argsparser().parse_args(['--no-cache'])
+    try:
+        for mode in ('closure', 'vm'):
+            args.mode = mode
+            results = run_files(files, functools.partial(interpreter.run_isolated, args=args), 2, 1)
+
+            for (source, status, stdout), result in zip(programs, results):
+                assert (result.status, result.stdout) == (status, stdout), (mode, source, result)
+                print('ok {:>8} {:<10} {}'.format(mode, result.status, source))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,209 @@
+import array
+import functools
+import itertools
+import weakref
+
+from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop.lists import EMPTY, Slice, check_list
+from compiler_studies.no_loop.runtime import NativeFunction
+
+
+# Bulk operations over lists
+#
+# `range`, `map`, `filter`, `reduce` and `sum` loop in Python rather than
+# recursing in No-Loop. Their results are lists whose elements are kept in an
+# array('q') when they're all integers (or array('d') when they're all floats),
+# at 8 bytes per element.
+#
+# When passed a function which just returns arithmetic (`+ - * /`) or
+# comparisons of its arguments and literals, like `\(n) { return n*n }`, they
+# don't call it once per element: it's compiled into a Python lambda, which
+# `map`, `itertools.compress` or `functools.reduce` apply to the whole array,
+# with the same results, since No-Loop's operators are Python's. Any other
+# function (or one taking more or fewer arguments than it's passed, which
+# fails as calling it would) is called once per element through the
+# execution mode's `call`.
+
+OPERATORS = {'+', '-', '*', '/', '==', '>=', '<='}
+
+# Elements range and sum go through at a time, so that signal handlers (as
+# the limits' timer) get to run in between
+CHUNK = 1 << 16
+
+# Compiled lambdas (or None) by LambDef body, for as long as it's used
+KERNELS = weakref.WeakKeyDictionary()
+
+
+def kernel(function):
+    '''A Python function computing what `function` does, if it's just arithmetic'''
+    code = function.code
+    if function.body is not None:
+        args, body = function.args, function.body
+    elif getattr(code, 'lambdef', None) is not None:
+        args, body = code.lambdef.args, code.lambdef.body
+    else:
+        return None
+
+    if body not in KERNELS:
+        KERNELS[body] = compile_kernel(args, body)
+    return KERNELS[body]
+
+
+def compile_kernel(args, body):
+    stmts = [stmt for stmt in body.stmts if not isinstance(stmt, parser.Comment)]
+    if len(stmts) != 1 or not isinstance(stmts[0], parser.Return) or len(set(args)) != len(args):
+        return None
+
+    consts = []
+
+    def source(ast):
+        if isinstance(ast, parser.Num):
+            return repr(int(ast.value))
+
+        elif isinstance(ast, (parser.String, parser.Const)):
+            consts.append(ast.value)
+            return '_k[{}]'.format(len(consts) - 1)
+
+        elif isinstance(ast, parser.VarLookup) and ast.value in args:
+            return '_{}'.format(args.index(ast.value))
+
+        elif isinstance(ast, parser.ASTNode) and ast.type in OPERATORS:
+            left, right = (source(child) for child in ast.children)
+            if left is not None and right is not None:
+                return '({} {} {})'.format(left, ast.type, right)
+
+        return None
+
+    expr = source(stmts[0].expr)
+    if expr is None:
+        return None
+
+    params = ', '.join('_{}'.format(i) for i in range(len(args)))
+    return eval('lambda {}: {}'.format(params, expr), {'_k': tuple(consts)})
+
+
+def python_function(function, call, nargs):
+    '''A Python function calling `function` with its `nargs` arguments'''
+    if isinstance(function, NativeFunction):
+        return function.callable
+
+    # Calls with the wrong number of arguments fail as they do in the mode
+    compiled = kernel(function)
+    if compiled is not None and compiled.__code__.co_argcount == nargs:
+        return compiled
+
+    return lambda *args: call(function, list(args))
+
+
+def items(lst):
+    '''The elements of `lst` as a Python sequence'''
+    if isinstance(lst, Slice):
+        return lst.items[lst.start:] if lst.start else lst.items
+    return list(lst)
+
+
+def pack(values):
+    '''A list of `values`, in an array if they're all of the same number type'''
+    if not values:
+        return EMPTY
+
+    types = set(map(type, values))
+    try:
+        if types == {int}:
+            return Slice(array.array('q', values))
+        elif types == {float}:
+            return Slice(array.array('d', values))
+    except OverflowError:
+        pass
+
+    return Slice(tuple(values))
+
+
+def make_range(lo, hi):
+    if type(lo) is not int or type(hi) is not int:
+        raise Exception('range expects integers, got {} and {}'.format(lo, hi))
+
+    if lo >= hi:
+        return EMPTY
+
+    try:
+        values = array.array('q')
+        for start in range(lo, hi, CHUNK):
+            values.extend(range(start, min(start + CHUNK, hi)))
+        return Slice(values)
+    except OverflowError:
+        return Slice(tuple(range(lo, hi)))
+
+
+def builtins(call):
+    '''The bulk natives, calling functions with `call(function, args)`'''
+
+    def map_list(function, lst):
+        check_list(lst, 'map')
+        return pack(list(map(python_function(function, call, 1), items(lst))))
+
+    def filter_list(function, lst):
+        check_list(lst, 'filter')
+        values = items(lst)
+        return pack(list(itertools.compress(values, map(python_function(function, call, 1), values))))
+
+    def reduce_list(function, lst, *initial):
+        check_list(lst, 'reduce')
+        if not lst and not initial:
+            raise Exception('reduce of an empty list with no initial value')
+        return functools.reduce(python_function(function, call, 2), items(lst), *initial)
+
+    def sum_list(lst):
+        check_list(lst, 'sum')
+        values = items(lst)
+        if not isinstance(values, array.array):
+            return sum(values)
+
+        total = 0
+        for start in range(0, len(values), CHUNK):
+            total = sum(values[start:start + CHUNK], total)
+        return total
+
+    return {
+        name: NativeFunction(name, callable)
+        for (name, callable) in [
+            ('range', make_range),
+            ('map', map_list),
+            ('filter', filter_list),
+            ('reduce', reduce_list),
+            ('sum', sum_list),
+        ]
+    }
+
+
+def test():
+    '''Checks that compiled functions are called like the modes call them'''
+    from compiler_studies.no_loop import interpreter
+
+    programs = [
+        # Program and what it returns, or the start of the error it raises
+        ('return map(\\(n) { return n * n }, range(0, 4))', [0, 1, 4, 9]),
+        ('return filter(\\(n) { return n - 2 }, range(0, 4))', [0, 1, 3]),
+        ('return reduce(\\(a, b) { return a * b }, range(1, 5))', 24),
+        ('return map(\\(a, b) { return a + b }, list(1, 2))', 'Wrong number of arguments'),
+        ('return filter(\\() { return 1 }, list(1, 2))', 'Wrong number of arguments'),
+        ('return reduce(\\(a) { return a }, list(1, 2))', 'Wrong number of arguments'),
+        ('return pmap(\\(a, b) { return a + b }, list(1, 2))', 'Wrong number of arguments'),
+    ]
+
+    for mode in ['eval', 'closure', 'stack', 'vm', 'async']:
+        args = interpreter.make_argsparser().parse_args(['--no-cache', '--mode', mode])
+        for program, expected in programs:
+            try:
+                result = interpreter.run_isolated('<test>', args, program)
+            except RuntimeError as e:
+                result = str(e)[:len(expected)] if isinstance(expected, str) else e
+            if isinstance(result, Slice):
+                result = list(result)
+            assert result == expected, (mode, program, result)
+
+    print('ok')
+
+
+if __name__ == '__main__':
+    test()
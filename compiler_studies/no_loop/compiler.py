@@ -0,0 +1,343 @@
+import array
+
+from compiler_studies.no_loop import ast_parser as parser
+
+
+# Lowers a (resolved) No-Loop AST to bytecode for `vm.run`.
+#
+# The code buffer is an array of ints: each instruction is its opcode
+# followed by as many operands as OPERANDS says. Operands that don't fit in
+# an int (constants, names, frame coordinates) live in the code object's
+# tables and the operand is an index into them.
+
+LOAD = 0              # push slot `arg` of the current frame
+LOAD_CHECKED = 1      # push the local at `names[arg]` = (0, slot, name,
+                      # fallbacks), which might not have been assigned yet
+LOAD_DEREF = 2        # push the slot at `names[arg]` = (depth, slot, name,
+                      # fallbacks)
+LOAD_GLOBAL = 3       # push the global at `names[arg]` = (depth, name)
+CONST = 4             # push `consts[arg]`
+STORE = 5             # pop into slot `arg` of the current frame
+STORE_GLOBAL = 6      # pop into the global named `names[arg]`
+POP = 7
+ADD = 8               # pop two values and push the result
+SUB = 9
+MUL = 10
+DIV = 11
+EQ = 12
+GE = 13
+LE = 14
+ADD_CONST = 15        # replace the top of the stack `x` with `x + consts[arg]`
+SUB_CONST = 16
+MUL_CONST = 17
+DIV_CONST = 18
+EQ_CONST = 19
+GE_CONST = 20
+LE_CONST = 21
+JUMP = 22             # jump to `arg`
+JUMP_IF_FALSE = 23    # pop and jump to `arg` if falsy
+MAKE_FUNCTION = 24    # push a function running code object `consts[arg]`
+CALL = 25             # call with the `arg` values on top of the stack
+RETURN = 26           # pop and return; a None return jumps to `arg` instead
+
+# Superinstructions for the most common sequences, taking two operands
+EQ_CONST_JUMP = 27    # EQ_CONST `arg`, JUMP_IF_FALSE `arg2`
+CALL_GLOBAL = 28      # call the global at `names[arg]` with `arg2` values
+
+# Calls in tail position, which reuse the caller's place in the VM instead
+# of returning to it. Calling a native pushes its result as usual.
+TAIL_CALL = 29
+TAIL_CALL_GLOBAL = 30
+
+OPNAMES = [
+    'LOAD', 'LOAD_CHECKED', 'LOAD_DEREF', 'LOAD_GLOBAL', 'CONST', 'STORE',
+    'STORE_GLOBAL', 'POP', 'ADD', 'SUB', 'MUL', 'DIV', 'EQ', 'GE', 'LE',
+    'ADD_CONST', 'SUB_CONST', 'MUL_CONST', 'DIV_CONST', 'EQ_CONST',
+    'GE_CONST', 'LE_CONST', 'JUMP', 'JUMP_IF_FALSE', 'MAKE_FUNCTION', 'CALL',
+    'RETURN', 'EQ_CONST_JUMP', 'CALL_GLOBAL', 'TAIL_CALL', 'TAIL_CALL_GLOBAL',
+]
+
+# Number of operands following each opcode
+OPERANDS = [1] * len(OPNAMES)
+for op in (POP, ADD, SUB, MUL, DIV, EQ, GE, LE):
+    OPERANDS[op] = 0
+for op in (EQ_CONST_JUMP, CALL_GLOBAL, TAIL_CALL_GLOBAL):
+    OPERANDS[op] = 2
+
+BINARY_OPCODES = {
+    '+': ADD,
+    '-': SUB,
+    '*': MUL,
+    '/': DIV,
+    '==': EQ,
+    '>=': GE,
+    '<=': LE,
+}
+
+# For a literal right operand
+BINARY_CONST_OPCODES = {
+    '+': ADD_CONST,
+    '-': SUB_CONST,
+    '*': MUL_CONST,
+    '/': DIV_CONST,
+    '==': EQ_CONST,
+    '>=': GE_CONST,
+    '<=': LE_CONST,
+}
+
+
+# Nodes compiled to a constant
+LITERALS = (parser.Num, parser.String, parser.Const)
+
+
+class Code:
+    __slots__ = ('name', 'instrs', 'consts', 'names', 'nargs', 'nslots', 'memoize', 'lambdef')
+
+    def __init__(self, name, instrs, consts, names, nargs, nslots, memoize=None, lambdef=None):
+        self.name = name
+        self.instrs = instrs
+        self.consts = consts
+        self.names = names
+        self.nargs = nargs
+        self.nslots = nslots
+
+        # From the LambDef, for MAKE_FUNCTION
+        self.memoize = memoize
+
+        # The LambDef itself, for natives looking into the functions they're
+        # passed, since VM functions have no AST
+        self.lambdef = lambdef
+
+    def __repr__(self):
+        return '<Code {}>'.format(self.name)
+
+
+class Label:
+    def __init__(self):
+        self.pos = None
+        self.refs = []
+
+
+class Compiler:
+    def __init__(self, name, nargs=0, nslots=0, function=False):
+        self.name = name
+        self.nargs = nargs
+        self.nslots = nslots
+        self.function = function
+
+        self.instrs = []
+        self.consts = []
+        self.const_index = {}
+        self.names = []
+        self.name_index = {}
+        self.labels = []
+
+    def emit(self, op, *args):
+        self.instrs.append(op)
+
+        for arg in args:
+            if isinstance(arg, Label):
+                arg.refs.append(len(self.instrs))
+                arg = 0
+            self.instrs.append(arg)
+
+    def mark(self, label):
+        label.pos = len(self.instrs)
+
+    def const(self, value):
+        # Keyed by type too, so that 1, 1.0 and True don't get merged
+        key = (type(value), value)
+        if key not in self.const_index:
+            self.const_index[key] = len(self.consts)
+            self.consts.append(value)
+        return self.const_index[key]
+
+    def intern(self, entry):
+        if entry not in self.name_index:
+            self.name_index[entry] = len(self.names)
+            self.names.append(entry)
+        return self.name_index[entry]
+
+    def new_label(self):
+        label = Label()
+        self.labels.append(label)
+        return label
+
+    def code(self):
+        instrs = array.array('i', self.instrs)
+        for label in self.labels:
+            for ref in label.refs:
+                instrs[ref] = label.pos
+
+        return Code(self.name, instrs, self.consts, self.names, self.nargs, self.nslots)
+
+    def compile_body(self, stmts):
+        self.compile_stmts(stmts, None)
+
+        # Falling off the end of a body returns None, which `vm.run`
+        # reports as a missing return for functions
+        self.emit(CONST, self.const(None))
+        self.emit(RETURN, 0)
+
+        return self.code()
+
+    def compile_stmts(self, ast, end_of_block):
+        for stmt in ast.stmts:
+            if isinstance(stmt, parser.Comment):
+                continue
+
+            elif isinstance(stmt, parser.Return):
+                if self.function and isinstance(stmt.expr, parser.FunCall):
+                    self.compile_funcall(stmt.expr, tail=True)
+                else:
+                    self.compile(stmt.expr)
+
+                # Just like in `interpreter.eval`, returning None from an
+                # if-else block carries on after it
+                self.emit(RETURN, end_of_block or 0)
+
+            elif isinstance(stmt, parser.IfElse):
+                self.compile_ifelse(stmt)
+
+            elif isinstance(stmt, parser.ASTNode) and stmt.type == '=':
+                self.compile_asgn(stmt)
+
+            else:
+                self.compile(stmt)
+                self.emit(POP)
+
+    def compile_ifelse(self, ast):
+        alt = self.new_label()
+        end = self.new_label()
+
+        cond = ast.cond
+        if (isinstance(cond, parser.ASTNode) and cond.type == '=='
+                and isinstance(cond.children[1], LITERALS)):
+            self.compile(cond.children[0])
+            self.emit(EQ_CONST_JUMP, self.literal(cond.children[1]), alt)
+        else:
+            self.compile(cond)
+            self.emit(JUMP_IF_FALSE, alt)
+        self.compile_stmts(ast.cons, end)
+        self.emit(JUMP, end)
+        self.mark(alt)
+        self.compile_stmts(ast.alt, end)
+        self.mark(end)
+
+    def compile_asgn(self, ast):
+        left, right = ast.children
+
+        if not isinstance(left, parser.VarLookup):
+            raise RuntimeError('Cannot assign to {}'.format(left.__class__.__name__))
+
+        if isinstance(right, parser.LambDef):
+            self.compile_lambdef(right, left.value)
+        else:
+            self.compile(right)
+
+        if left.slot is None:
+            self.emit(STORE_GLOBAL, self.intern(left.value))
+        else:
+            self.emit(STORE, left.slot)
+
+    def compile(self, ast):
+        if isinstance(ast, parser.ASTNode):
+            if ast.type == '=':
+                raise RuntimeError('Unexpected assignment')
+
+            left, right = ast.children
+            self.compile(left)
+
+            if isinstance(right, LITERALS):
+                self.emit(BINARY_CONST_OPCODES[ast.type], self.literal(right))
+            else:
+                self.compile(right)
+                self.emit(BINARY_OPCODES[ast.type])
+
+        elif isinstance(ast, parser.VarLookup):
+            self.compile_varlookup(ast)
+
+        elif isinstance(ast, LITERALS):
+            self.emit(CONST, self.literal(ast))
+
+        elif isinstance(ast, parser.LambDef):
+            self.compile_lambdef(ast)
+
+        elif isinstance(ast, parser.FunCall):
+            self.compile_funcall(ast)
+
+        else:
+            raise RuntimeError('Unable to compile {}'.format(ast.__class__.__name__))
+
+    def compile_funcall(self, ast, tail=False):
+        # Looking up a global has no side effects and arguments can't
+        # assign to globals, so it's fine to do it after the arguments
+        if isinstance(ast.expr, parser.VarLookup) and ast.expr.slot is None:
+            for arg in ast.args:
+                self.compile(arg)
+            name = self.intern((ast.expr.depth, ast.expr.value))
+            self.emit(TAIL_CALL_GLOBAL if tail else CALL_GLOBAL, name, len(ast.args))
+
+        else:
+            self.compile(ast.expr)
+            for arg in ast.args:
+                self.compile(arg)
+            self.emit(TAIL_CALL if tail else CALL, len(ast.args))
+
+    def literal(self, ast):
+        if isinstance(ast, parser.Num):
+            return self.const(int(ast.value))
+        return self.const(ast.value)
+
+    def compile_lambdef(self, ast, name='<lambda>'):
+        compiler = Compiler(name, len(ast.args), ast.nslots, function=True)
+        code = compiler.compile_body(ast.body)
+        code.memoize = ast.memoize
+        code.lambdef = ast
+        self.emit(MAKE_FUNCTION, self.const(code))
+
+    def compile_varlookup(self, ast):
+        if ast.slot is None:
+            self.emit(LOAD_GLOBAL, self.intern((ast.depth, ast.value)))
+
+        elif ast.depth == 0 and ast.slot < self.nargs:
+            self.emit(LOAD, ast.slot)
+
+        elif ast.depth == 0:
+            self.emit(LOAD_CHECKED, self.intern((0, ast.slot, ast.value, ast.fallbacks)))
+
+        else:
+            self.emit(LOAD_DEREF, self.intern((ast.depth, ast.slot, ast.value, ast.fallbacks)))
+
+
+def compile(ast):
+    '''Compiles a resolved program into its top level code object'''
+    return Compiler('<program>').compile_body(ast)
+
+
+def dis(code, indent=0):
+    print('{}{}:'.format('\t'*indent, code))
+
+    nested = []
+    pc = 0
+    while pc < len(code.instrs):
+        op = code.instrs[pc]
+        args = code.instrs[pc+1:pc+1+OPERANDS[op]].tolist()
+
+        if op in (CONST, MAKE_FUNCTION, EQ_CONST_JUMP) or op in BINARY_CONST_OPCODES.values():
+            detail = repr(code.consts[args[0]])
+        elif op in (LOAD_CHECKED, LOAD_DEREF, LOAD_GLOBAL, STORE_GLOBAL, CALL_GLOBAL,
+                    TAIL_CALL_GLOBAL):
+            detail = repr(code.names[args[0]])
+        else:
+            detail = ''
+
+        if op == MAKE_FUNCTION:
+            nested.append(code.consts[args[0]])
+
+        print('{}{:>4} {:<14} {:>8} {}'.format(
+            '\t'*indent, pc, OPNAMES[op], ' '.join(map(str, args)), detail))
+        pc += 1 + OPERANDS[op]
+
+    for code in nested:
+        dis(code, indent + 1)
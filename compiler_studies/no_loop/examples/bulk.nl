@@ -0,0 +1,27 @@
+/*
+ * f_range.nl with the bulk natives: range, map, filter, reduce and sum
+ */
+
+square = \(n) {
+  return n*n
+}
+
+cube = \(n) {
+  return n*n*n
+}
+
+// Prints [0, 1, 4, 9, ..., 81]
+print(map(square, range(0, 10)))
+
+// Prints [0, 1, 8, ..., 729]
+print(map(cube, range(0, 10)))
+
+// Prints [6, 8]
+print(filter(\(n) { return (n >= 5) }, map(\(n) { return n * 2 }, range(0, 5))))
+
+// Functions which aren't just arithmetic work too, they're only slower.
+// Prints [1, 2, 3]
+print(map(\(lst) { return head(lst) }, list(list(1), list(2), list(3))))
+
+// Prints 285 and 2025
+print(sum(map(square, range(0, 10))), reduce(\(a, b) { return a + b }, map(cube, range(0, 10)), 0))
@@ -0,0 +1,13 @@
+// Modules run once, however many times they're imported, and keep their
+// variables to themselves
+lists = import('lib/lists.nl')
+again = import('./lib/lists.nl')
+
+print(lists == again)
+
+make_range = lists('make_range')
+map = lists('map')
+print_list = lists('print_list')
+
+print('Cubes:')
+print_list(map(\(n) { return n * n * n }, make_range(0, 5)))
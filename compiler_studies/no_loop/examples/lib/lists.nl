@@ -0,0 +1,53 @@
+/*
+ * Pairs and lists of pairs, as in pairs.nl, to be imported:
+ *
+ *   lists = import('lib/lists.nl')
+ *   make_pair = lists('make_pair')
+ */
+
+make_pair = \(a, b) {
+  return \(getter) {
+    return getter(a, b)
+  }
+}
+
+get_head = \(pair) {
+  return pair(\(a, b) {
+    return a
+  })
+}
+
+get_tail = \(pair) {
+  return pair(\(a, b) {
+    return b
+  })
+}
+
+empty_list = \() {
+  return 0
+}
+
+make_range = \(lo, hi) {
+  if lo == hi {
+    return empty_list
+  } else {
+    return make_pair(lo, make_range(lo + 1, hi))
+  }
+}
+
+map = \(f, lst) {
+  if lst == empty_list {
+    return empty_list
+  } else {
+    return make_pair(f(get_head(lst)), map(f, get_tail(lst)))
+  }
+}
+
+print_list = \(lst) {
+  if lst == empty_list {
+    return 0
+  } else {
+    print(get_head(lst))
+    return print_list(get_tail(lst))
+  }
+}
@@ -0,0 +1,31 @@
+/*
+ * The lists of pairs.nl, with the native list functions: list, cons, head,
+ * tail, len, nth and concat
+ */
+
+make_range = \(lo, hi) {
+  if lo == hi {
+    return list()
+  } else {
+    return cons(lo, make_range(lo + 1, hi))
+  }
+}
+
+map = \(f, lst) {
+  if lst == list() {
+    return list()
+  } else {
+    return cons(f(head(lst)), map(f, tail(lst)))
+  }
+}
+
+squares = map(\(n) { return n*n }, make_range(0, 10))
+
+// Prints [0, 1, 4, 9, 16, 25, 36, 49, 64, 81]
+print(squares)
+
+// Prints 10 16
+print(len(squares), nth(squares, 4))
+
+// Lists share their tails, and compare by their elements. Prints True
+print(concat(list(0, 1), tail(tail(squares))) == squares)
@@ -1,7 +1,28 @@
 import argparse
-
-from compiler_studies.no_loop import scanner
+import collections
+import contextlib
+import functools
+import sys
+
+from compiler_studies.no_loop import async_eval
+from compiler_studies.no_loop import batch
+from compiler_studies.no_loop import bulk
 from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop import compiler
+from compiler_studies.no_loop import io_natives
+from compiler_studies.no_loop import limits
+from compiler_studies.no_loop import lists
+from compiler_studies.no_loop import memo
+from compiler_studies.no_loop import modules
+from compiler_studies.no_loop import nlcache
+from compiler_studies.no_loop import optimizer
+from compiler_studies.no_loop import parallel
+from compiler_studies.no_loop import profiler
+from compiler_studies.no_loop import resolver
+from compiler_studies.no_loop import scanner
+from compiler_studies.no_loop import stack_eval
+from compiler_studies.no_loop import vm
+from compiler_studies.no_loop.runtime import Env, Frame, Function, NativeFunction, UNSET
 
 
 def eval(ast, env):
@@ -27,13 +48,15 @@ def eval(ast, env):
     elif isinstance(ast, parser.Num):
         return int(ast.value)
 
-    elif isinstance(ast, parser.String):
+    elif isinstance(ast, (parser.String, parser.Const)):
         return ast.value
 
     elif isinstance(ast, parser.IfElse):
         return eval(ast.cons, env) if eval(ast.cond, env) else eval(ast.alt, env)
 
     elif isinstance(ast, parser.LambDef):
+        if ast.memoize:
+            return memo.memoized(Function(ast.args, ast.body, env), ast.memoize, call_function)
         return Function(ast.args, ast.body, env)
 
     elif isinstance(ast, parser.FunCall):
@@ -71,8 +94,13 @@ def apply(ast, env):
     if isinstance(fun, NativeFunction):
         return fun.callable(*args)
 
-    if len(fun.args) != len(ast.args):
-        raise RuntimeError('Wrong number of arguments for {}'.format(ast.name))
+    return call_function(fun, args)
+
+
+def call_function(fun, args):
+    if len(fun.args) != len(args):
+        raise RuntimeError('Wrong number of arguments: expected {}, got {}'.format(
+            len(fun.args), len(args)))
 
     # Augment function environment with arguments
     new_env = Env(fun.env, **{
@@ -83,63 +111,534 @@ def apply(ast, env):
     ret = eval(fun.body, new_env)
 
     if ret is None:
-        raise RuntimeError('Missing return statement in {}'.format(ast.name))
+        raise RuntimeError('Missing return statement')
 
     return ret
 
 
-class Function:
-    def __init__(self, args, body, env):
-        self.args = args
-        self.body = body
-        self.env = env
+# Compiling to closures
+#
+# `eval` above re-dispatches on the node type (and `eval_astnode` on the
+# operator) every time a node is visited. `compile` does that dispatch once
+# per node, turning the AST into nested Python callables that take an env.
 
-    def __repr__(self):
-        return '<Function>'
+def compile(ast):
+    if isinstance(ast, parser.Stmts):
+        return compile_stmts(ast)
 
+    elif isinstance(ast, parser.ASTNode):
+        return compile_astnode(ast)
+
+    elif isinstance(ast, parser.VarLookup):
+        return compile_varlookup(ast)
 
-class NativeFunction:
-    def __init__(self, name, callable):
-        self.name = name
-        self.callable = callable
+    elif isinstance(ast, parser.Num):
+        value = int(ast.value)
+        return lambda env: value
 
+    elif isinstance(ast, (parser.String, parser.Const)):
+        value = ast.value
+        return lambda env: value
 
-class Env(dict):
-    def __init__(self, parent=None, **kwargs):
-        super().__init__(**kwargs)
-        self.parent = parent
+    elif isinstance(ast, parser.IfElse):
+        return compile_ifelse(ast)
 
-    def lookup(self, name):
-        if name in self:
-            return self[name]
-        elif self.parent is not None:
-            return self.parent.lookup(name)
+    elif isinstance(ast, parser.LambDef):
+        return compile_lambdef(ast)
+
+    elif isinstance(ast, parser.FunCall):
+        return compile_funcall(ast)
+
+    elif isinstance(ast, parser.Comment):
+        return lambda env: None
+
+    raise RuntimeError('Unable to compile {}'.format(ast.__class__.__name__))
+
+
+# How a compiled statement affects the enclosing block
+STMT, RETURN, IFELSE = range(3)
+
+
+def compile_stmts(ast, tail=False):
+    '''Compiles a block of statements
+
+    `tail` is set for function bodies, and the if-else blocks in them, where
+    returning the result of a call is the last thing the function does.
+    '''
+    compiled = []
+    for stmt in ast.stmts:
+        if isinstance(stmt, parser.Comment):
+            continue
+        elif isinstance(stmt, parser.Return) and tail and isinstance(stmt.expr, parser.FunCall):
+            compiled.append((RETURN, compile_tailcall(stmt.expr)))
+        elif isinstance(stmt, parser.Return):
+            compiled.append((RETURN, compile(stmt.expr)))
+        elif isinstance(stmt, parser.IfElse):
+            compiled.append((IFELSE, compile_ifelse(stmt, tail)))
         else:
+            compiled.append((STMT, compile(stmt)))
+
+    # Function bodies are very often a single return statement
+    if len(compiled) == 1 and compiled[0][0] == RETURN:
+        return compiled[0][1]
+
+    def stmts(env):
+        for kind, code in compiled:
+            ret = code(env)
+            if kind == RETURN:
+                return ret
+
+            # We can return from a if-else block
+            elif kind == IFELSE and ret is not None:
+                return ret
+
+    return stmts
+
+
+def compile_varlookup(ast):
+    return compile_lookup(ast.value, ast.depth, ast.slot, ast.fallbacks)
+
+
+def compile_lookup(name, depth, slot, fallbacks):
+    if slot is None:
+        return lambda env: frame_at(env, depth).lookup(name)
+
+    # Unset locals read the name they shadow
+    if fallbacks:
+        unset = compile_lookup(name, *fallbacks[0], fallbacks[1:])
+    else:
+        def unset(env):
             raise Exception('{} is not defined'.format(name))
 
-    def __repr__(self):
-        has_parent = 'Yes' if self.parent is not None else 'No'
-        return '<Env has_parent={} {}>'.format(has_parent, super().__repr__())
+    # The number of frames to go up is known, so unroll the usual cases
+    if depth == 0:
+        def lookup(env):
+            value = env[slot]
+            if value is UNSET:
+                return unset(env)
+            return value
+
+    elif depth == 1:
+        def lookup(env):
+            value = env.parent[slot]
+            if value is UNSET:
+                return unset(env)
+            return value
+
+    else:
+        def lookup(env):
+            value = frame_at(env, depth)[slot]
+            if value is UNSET:
+                return unset(env)
+            return value
+
+    return lookup
+
+
+def frame_at(env, depth):
+    for _ in range(depth):
+        env = env.parent
+    return env
+
+
+BINARY_OPERATORS = {
+    '+': lambda left, right: lambda env: left(env) + right(env),
+    '-': lambda left, right: lambda env: left(env) - right(env),
+    '*': lambda left, right: lambda env: left(env) * right(env),
+    '/': lambda left, right: lambda env: left(env) / right(env),
+    '==': lambda left, right: lambda env: left(env) == right(env),
+    '>=': lambda left, right: lambda env: left(env) >= right(env),
+    '<=': lambda left, right: lambda env: left(env) <= right(env),
+}
+
+# Same as above, for the (very common) case of a literal right operand
+BINARY_OPERATORS_CONST = {
+    '+': lambda left, right: lambda env: left(env) + right,
+    '-': lambda left, right: lambda env: left(env) - right,
+    '*': lambda left, right: lambda env: left(env) * right,
+    '/': lambda left, right: lambda env: left(env) / right,
+    '==': lambda left, right: lambda env: left(env) == right,
+    '>=': lambda left, right: lambda env: left(env) >= right,
+    '<=': lambda left, right: lambda env: left(env) <= right,
+}
+
+
+def compile_astnode(ast):
+    left, right = ast.children
+
+    if ast.type == '=':
+        if not isinstance(left, parser.VarLookup):
+            raise RuntimeError('Cannot assign to {}'.format(left.__class__.__name__))
+
+        # Assignments always target the current frame (or the global env
+        # at the top level, where there's no slot)
+        key = left.value if left.slot is None else left.slot
+        value = compile(right)
+
+        def asgn(env):
+            env[key] = value(env)
+            return env[key]
+
+        return asgn
+
+    if isinstance(right, parser.Num):
+        return BINARY_OPERATORS_CONST[ast.type](compile(left), int(right.value))
+
+    elif isinstance(right, parser.Const):
+        return BINARY_OPERATORS_CONST[ast.type](compile(left), right.value)
+
+    return BINARY_OPERATORS[ast.type](compile(left), compile(right))
+
+
+def compile_ifelse(ast, tail=False):
+    cond = compile(ast.cond)
+    cons = compile_stmts(ast.cons, tail)
+    alt = compile_stmts(ast.alt, tail)
+
+    return lambda env: cons(env) if cond(env) else alt(env)
+
+
+def compile_lambdef(ast):
+    args = ast.args
+    body = ast.body
+    code = compile_stmts(body, tail=True)
+
+    # `call` fills the frame with the arguments; make room for the locals
+    padding = [UNSET] * (ast.nslots - len(args))
+    if padding:
+        body_code = code
+
+        def code(frame):
+            frame.extend(padding)
+            return body_code(frame)
+
+    if ast.memoize:
+        memoize = ast.memoize
+        return lambda env: memo.memoized(Function(args, body, env, code), memoize, call)
+
+    return lambda env: Function(args, body, env, code)
+
+
+def compile_funcall(ast):
+    fun = compile(ast.expr)
+    args = [compile(a) for a in ast.args]
+
+    # Avoid building the argument list through a comprehension for the
+    # common small arities
+    if len(args) == 0:
+        return lambda env: call(fun(env), [])
+
+    elif len(args) == 1:
+        arg, = args
+        return lambda env: call(fun(env), [arg(env)])
+
+    elif len(args) == 2:
+        arg0, arg1 = args
+        return lambda env: call(fun(env), [arg0(env), arg1(env)])
+
+    return lambda env: call(fun(env), [a(env) for a in args])
+
+
+def compile_tailcall(ast):
+    fun = compile(ast.expr)
+    args = [compile(a) for a in ast.args]
+
+    # Rather than calling the function, hand it back to `call`, which will
+    # run it in place of the current one, without growing the Python stack
+    def tailcall(env):
+        f = fun(env)
+        a = [arg(env) for arg in args]
+
+        if isinstance(f, NativeFunction):
+            return f.callable(*a)
+
+        return TailCall(f, a)
+
+    return tailcall
+
+
+def call(fun, args):
+    if isinstance(fun, NativeFunction):
+        return fun.callable(*args)
+
+    while True:
+        if len(fun.args) != len(args):
+            raise RuntimeError('Wrong number of arguments: expected {}, got {}'.format(
+                len(fun.args), len(args)))
+
+        # Arguments take the first slots of the new frame
+        frame = Frame(args)
+        frame.parent = fun.env
+
+        ret = fun.code(frame)
+
+        if ret.__class__ is not TailCall:
+            break
+
+        fun = ret.fun
+        args = ret.args
+
+    if ret is None:
+        raise RuntimeError('Missing return statement')
+
+    return ret
+
+
+class TailCall:
+    '''A call in tail position, returned by a compiled function body'''
+
+    __slots__ = ('fun', 'args')
+
+    def __init__(self, fun, args):
+        self.fun = fun
+        self.args = args
+
+
+def make_argsparser(**kwargs):
+    '''The options of the interpreter which the server shares: all but those
+    reporting on a run'''
+    argsparser = argparse.ArgumentParser(**kwargs)
+    argsparser.add_argument(
+        '--mode', choices=['closure', 'eval', 'stack', 'vm', 'async'], default='closure',
+        help='compile to closures (default), walk the tree with eval or '
+             'without recursion with stack_eval, compile to bytecode for the vm, '
+             'or walk it with async_eval, overlapping the I/O of call arguments')
+    argsparser.add_argument(
+        '--optimize', action='store_true',
+        help='inline small functions, fold constant expressions and if-else '
+             'blocks before running')
+    argsparser.add_argument(
+        '--inline-size', type=int, default=optimizer.INLINE_SIZE,
+        help='size, in AST nodes, of the largest function body to inline '
+             '(0 disables inlining)')
+    argsparser.add_argument(
+        '--no-cache', action='store_true',
+        help='parse every file, instead of loading the statements cached in '
+             'the __nlcache__ directory next to it')
+    argsparser.add_argument(
+        '--memoize', choices=['off', 'annotated', 'auto'], default='off',
+        help='cache the results of pure functions preceded by a // @memoize '
+             'comment, or of all of them with auto')
+    argsparser.add_argument(
+        '--cache-size', type=int, default=memo.CACHE_SIZE,
+        help='results cached per memoized function, unless the comment says otherwise')
+    argsparser.add_argument(
+        '--max-steps', type=int, metavar='N',
+        help='stop the program once its function calls have cost N steps: '
+             'each costs the size of the function\'s body, in AST nodes, and '
+             'natives going through lists a step per element')
+    argsparser.add_argument(
+        '--max-depth', type=int, metavar='N',
+        help='stop the program if it gets more than N calls deep')
+    argsparser.add_argument(
+        '--max-seconds', type=float, metavar='S',
+        help='stop the program if it\'s still running after S seconds')
+    argsparser.add_argument(
+        '--max-envs', type=int, metavar='N',
+        help='stop the program if it keeps more than N environments alive, one '
+             'per call in progress and one per function')
+    argsparser.add_argument(
+        '--jobs', type=int,
+        help='run every file on its own, in globals of its own, on a pool of '
+             'this many processes, and report on each one')
+    argsparser.add_argument(
+        '--timeout', type=float, default=60,
+        help='with --jobs, seconds after which a file is stopped (default 60)')
+    return argsparser
 
 
 def parse_args():
-    argsparser = argparse.ArgumentParser()
+    argsparser = make_argsparser()
+    argsparser.add_argument(
+        '--memo-stats', action='store_true',
+        help='print the cache hits and misses of memoized functions when done')
+    argsparser.add_argument(
+        '--profile', action='store_true',
+        help='report the calls, time spent and memory allocated in each function')
+    argsparser.add_argument(
+        '--profile-sample', type=float, metavar='MS',
+        help='with --profile, find the running function every MS milliseconds '
+             'instead of timing every call, which is cheaper')
+    argsparser.add_argument(
+        '--profile-output', metavar='FILE',
+        help='with --profile, also write the call stacks to FILE as collapsed '
+             'stacks, for flamegraph.pl')
     argsparser.add_argument('files', nargs='+', type=str)
     return argsparser.parse_args()
 
 
-def main():
-    source_files = parse_args().files
-
-    global_env = Env(
+# How natives call functions, in each mode
+CALLS = {
+    'eval': call_function,
+    'closure': call,
+    'stack': stack_eval.call,
+    'vm': vm.call,
+    'async': async_eval.call_blocking,
+}
+
+
+def run(ast, env, mode):
+    if mode == 'eval':
+        return eval(ast, env)
+    elif mode == 'stack':
+        return stack_eval.eval(ast, env)
+    elif mode == 'vm':
+        return vm.run(compiler.compile(resolver.resolve(ast)), env)
+    elif mode == 'async':
+        return async_eval.run(ast, env)
+    else:
+        return compile(resolver.resolve(ast))(env)
+
+
+def run_file(source_file, env, args, profile=None, budget=None, source=None, assignments=None):
+    '''Runs `source_file`, or program text `source` as if it were in it
+
+    `assignments` counts the names assigned by the files sharing `env`, when
+    there are others.
+    '''
+    if source is None:
+        stmts = nlcache.parse_file(source_file, use_cache=not args.no_cache)
+    else:
+        stmts = parser.parse_iter(parser.Stream(scanner.scan(source)))
+
+    # Inlining and memoizing need to see the whole program
+    if args.optimize or args.memoize != 'off':
+        ast = parser.Stmts(list(stmts))
+
+        if args.optimize:
+            inlined = optimizer.inline(ast, args.inline_size, assignments)
+            print('{}: inlined {} calls'.format(source_file, inlined), file=sys.stderr)
+
+        if args.memoize != 'off':
+            _, impure = memo.mark(ast, args.memoize == 'auto', args.cache_size, assignments)
+            for name in impure:
+                print('{}: not memoizing {}, which isn\'t pure'.format(
+                    source_file, name), file=sys.stderr)
+
+        if args.optimize:
+            ast = optimizer.optimize(ast)
+
+        if profile is not None:
+            profile.instrument(ast, source_file)
+        if budget is not None:
+            ast = budget.instrument(ast)
+
+        return run(ast, env, args.mode)
+
+    # Otherwise, run every top level statement as soon as it's parsed (or
+    # loaded), so that neither the whole program nor its lexemes are kept in
+    # memory
+    with contextlib.closing(stmts):
+        for stmt in stmts:
+            if profile is not None:
+                profile.instrument(stmt, source_file)
+            if budget is not None:
+                stmt = budget.instrument(stmt)
+
+            res = run(parser.Stmts([stmt]), env, args.mode)
+
+            # Just like returning from a block, a top level return ends the
+            # program
+            if isinstance(stmt, parser.Return) or res is not None:
+                return res
+
+
+def make_globals(args, profile=None, assignments=None):
+    '''A global env with the builtins, and the loader running files in it
+
+    `assignments` counts the names assigned by all the files run in it.
+    '''
+    builtins = Env(
         print=NativeFunction('print', print),
+        **lists.builtins(),
+        **bulk.builtins(CALLS[args.mode]),
+        **parallel.builtins(args.mode),
+        **io_natives.builtins(args.mode)
     )
+    if profile is not None:
+        builtins.update(profile.natives())
+
+    # Every set of globals gets limits of its own, as each file does with --jobs
+    budget = None
+    if any(limit is not None for limit in (
+            args.max_steps, args.max_depth, args.max_seconds, args.max_envs)):
+        budget = limits.Limits(args.max_steps, args.max_depth, args.max_seconds, args.max_envs)
+        builtins.update(budget.charging(builtins))
+        builtins.update(budget.natives())
+
+    global_env = Env(parent=builtins)
+
+    def run_module(path, env, source=None):
+        # Modules have globals of their own
+        shared = assignments if env is global_env else None
+        if budget is None:
+            return run_file(path, env, args, profile, budget, source, shared)
+        with budget.timer():
+            return run_file(path, env, args, profile, budget, source, shared)
 
+    loader = modules.ModuleLoader(run_module, builtins)
+
+    return loader, global_env
+
+
+def count_assignments(source_files, args):
+    '''Counts the names the top level of `source_files` assigns, all together'''
+    assignments = collections.Counter()
     for source_file in source_files:
-        with open(source_file) as f:
-            stream = parser.Stream(scanner.scan(f.read()))
-        ast = parser.parse(stream)
-        res = eval(ast, global_env)
+        try:
+            stmts = parser.Stmts(list(nlcache.parse_file(source_file, use_cache=not args.no_cache)))
+        except (OSError, ValueError, scanner.MalformedInput, parser.InvalidSyntax):
+            # It won't run, so it won't assign anything
+            continue
+        assignments.update(resolver.assigned_names(stmts))
+
+    return assignments
+
+
+def run_isolated(source_file, args, source=None):
+    '''Runs `source_file` (or `source`) in globals (and modules) of its own'''
+    loader, global_env = make_globals(args)
+    return loader.run(source_file, global_env, source)
+
+
+def main():
+    args = parse_args()
+
+    if args.jobs is not None:
+        run_file = functools.partial(run_isolated, args=args)
+        sys.exit(batch.run(args.files, run_file, args.jobs, args.timeout))
+
+    profile = None
+    if args.profile:
+        if args.profile_sample is None:
+            profile = profiler.Profiler()
+        else:
+            profile = profiler.Profiler(sampling=True, interval=args.profile_sample / 1000)
+
+    # Every file on the command line runs in the same global scope, and each
+    # import in one of its own. What's assigned once in one of them may be
+    # assigned again in another, so inlining and memoizing count assignments
+    # in them all
+    assignments = None
+    if len(args.files) > 1 and (args.optimize or args.memoize != 'off'):
+        assignments = count_assignments(args.files, args)
+    loader, global_env = make_globals(args, profile, assignments)
+
+    if profile is not None:
+        profile.start()
+    try:
+        for source_file in args.files:
+            loader.run(source_file, global_env)
+    finally:
+        if profile is not None:
+            profile.stop()
+            profile.report(sys.stderr)
+            if args.profile_output:
+                with open(args.profile_output, 'w') as f:
+                    profile.collapsed(f)
+
+    if args.memo_stats:
+        memo.report(sys.stderr)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,194 @@
+import asyncio
+import urllib.parse
+
+from compiler_studies.no_loop.async_eval import run_sync
+from compiler_studies.no_loop.modules import unquote
+from compiler_studies.no_loop.runtime import NativeFunction
+
+
+# Natives doing I/O
+#
+#   read_file(path)          the contents of the file at `path`
+#   write_file(path, text)   writes `text` to the file at `path`, returning
+#                            how many characters it wrote
+#   sleep(ms)                waits `ms` milliseconds, returning `ms`
+#   http_get(url)            the body of the response to a GET of an http://
+#                            `url`, failing unless its status is 2xx
+#
+# They're coroutine functions, which the async mode awaits, overlapping all
+# but write_file when they're arguments of the same call. Every other mode
+# runs them to completion when they're called.
+#
+# Paths are relative to the directory the interpreter runs in. Strings keep
+# their quotes in No-Loop, so paths, URLs and texts are unquoted, and what's
+# read quoted.
+
+# Seconds to wait for a response
+HTTP_TIMEOUT = 30
+
+
+def quote(text):
+    return '\'{}\''.format(text)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        return f.write(text)
+
+
+async def read_file(path):
+    # Files don't have non-blocking reads, so they run in the default
+    # thread pool instead
+    text = await asyncio.get_running_loop().run_in_executor(None, read, unquote(path))
+    return quote(text)
+
+
+async def write_file(path, text):
+    return await asyncio.get_running_loop().run_in_executor(None, write, unquote(path), unquote(text))
+
+
+async def sleep(ms):
+    # Milliseconds, since No-Loop has no float literals
+    if not isinstance(ms, (int, float)) or ms < 0:
+        raise Exception('sleep expects a number of milliseconds, got {}'.format(ms))
+    await asyncio.sleep(ms / 1000)
+    return ms
+
+
+async def http_get(url):
+    url = unquote(url)
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme != 'http' or not parts.hostname:
+        raise Exception('http_get only gets http:// URLs, got {}'.format(url))
+
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    try:
+        # HTTP/1.0, so that the server closes the connection after the body
+        writer.write('GET {} HTTP/1.0\r\nHost: {}\r\n\r\n'.format(path, parts.netloc).encode())
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), HTTP_TIMEOUT)
+    finally:
+        writer.close()
+
+    head, _, body = response.partition(b'\r\n\r\n')
+    status_line = head.split(b'\r\n', 1)[0].decode('latin-1')
+    status = status_line.split(' ', 2)
+    if len(status) < 2 or not status[1].isdigit():
+        raise Exception('Invalid response from {}: {}'.format(url, status_line))
+    if not 200 <= int(status[1]) < 300:
+        raise Exception('GET {} failed: {}'.format(url, status_line))
+
+    return quote(body.decode())
+
+
+NATIVES = {
+    'read_file': read_file,
+    'write_file': write_file,
+    'sleep': sleep,
+    'http_get': http_get,
+}
+
+
+def blocking(coroutine_function):
+    '''A function running `coroutine_function` to completion'''
+    return lambda *args: run_sync(coroutine_function(*args))
+
+
+def builtins(mode):
+    '''The I/O natives, for programs run in `mode`'''
+    return {
+        name: NativeFunction(name, native if mode == 'async' else blocking(native))
+        for name, native in NATIVES.items()
+    }
+
+
+def test():
+    '''Runs the natives against a local fake server, checking async overlaps them'''
+    import http.server
+    import os
+    import shutil
+    import tempfile
+    import threading
+    import time
+
+    from compiler_studies.no_loop import ast_parser as parser
+    from compiler_studies.no_loop import interpreter
+    from compiler_studies.no_loop import scanner
+    from compiler_studies.no_loop.runtime import Env
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not self.path.startswith('/slow/'):
+                self.send_error(404)
+                return
+            time.sleep(0.2)
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write('hello {}'.format(self.path[len('/slow/'):]).encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    path = os.path.join(tempfile.mkdtemp(), 'out.txt')
+
+    programs = [
+        # Program, result, and seconds it should take run in order and overlapped
+        ('join = \\(a, b) {{ return a + b }} result = join(http_get("{0}/slow/1"), http_get("{0}/slow/2"))'.format(url),
+         '\'hello 1\'\'hello 2\'', 0.4, 0.2),
+        ('add = \\(a, b, c) { return a + b + c } result = add(sleep(200), 1, sleep(200))',
+         401, 0.4, 0.2),
+        ('n = write_file("{0}", "some text") result = read_file("{0}")'.format(path),
+         '\'some text\'', 0, 0),
+        # Writes stay in order with the arguments around them
+        ('second = \\(a, b) {{ return b }} text = "abc" * 1000000 '
+         'result = second(write_file("{0}", text), read_file("{0}"))'.format(path),
+         quote(unquote('"abc"' * 1000000)), 0, 0),
+        ('same = \\(a, b, c) {{ if b == c {{ return b }} else {{ return 0 }} }} '
+         'text = "abcd" * 1000000 '
+         'result = same(write_file("{0}", text), read_file("{0}"), read_file("{0}"))'.format(path),
+         quote(unquote('"abcd"' * 1000000)), 0, 0),
+        # As do calls to functions
+        ('add = \\(a, b) { return a + b } nap = \\(ms) { return sleep(ms) } '
+         'result = add(nap(200), sleep(200))', 400, 0.4, 0.4),
+    ]
+
+    try:
+        for mode in ('closure', 'async'):
+            for program, expected, in_order, overlapped in programs:
+                env = Env(parent=Env(**builtins(mode)))
+                start = time.perf_counter()
+                interpreter.run(parser.parse(parser.Stream(scanner.scan(program))), env, mode)
+                elapsed = time.perf_counter() - start
+
+                assert env['result'] == expected, (mode, program, str(env['result'])[:100])
+                seconds = overlapped if mode == 'async' else in_order
+                assert seconds <= elapsed < seconds + 0.15, (mode, program, elapsed)
+                print('ok {:>8} {:.2f}s {}'.format(mode, elapsed, str(env['result'])[:40]))
+
+            env = Env(parent=Env(**builtins(mode)))
+            try:
+                interpreter.run(parser.parse(parser.Stream(scanner.scan(
+                    'x = http_get("{}/missing")'.format(url)))), env, mode)
+                raise AssertionError('Expected a 404')
+            except Exception as e:
+                assert '404' in str(e), e
+                print('ok {:>8} {}'.format(mode, e))
+    finally:
+        server.shutdown()
+        shutil.rmtree(os.path.dirname(path))
+
+
+if __name__ == '__main__':
+    test()
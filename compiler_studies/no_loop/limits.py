@@ -0,0 +1,327 @@
+import contextlib
+import gc
+import inspect
+import signal
+import threading
+import time
+import weakref
+
+from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop.lists import Cons, List
+from compiler_studies.no_loop.optimizer import size
+from compiler_studies.no_loop.profiler import report_calls
+from compiler_studies.no_loop.runtime import NativeFunction
+
+
+# Resource limits
+#
+# No-Loop has no loops, so a program only runs for long (or keeps much in
+# memory) by calling functions. Like the profiler, `Limits.instrument`
+# rewrites every LambDef of a program to report its calls, and checks the
+# limits as they're made, in any execution mode:
+#
+#   - steps: every call costs the size of the function's body, in AST
+#     nodes, which bounds the work it does outside of calls. Natives looping
+#     over lists, ranges or texts (see NATIVE_COSTS) cost a step per element
+#     or character on top, and `charging` wraps them to count it
+#   - depth: calls in progress (tail calls return first)
+#   - seconds: wall-clock time since the Limits were created. Run in
+#     `timer`, a SIGALRM also interrupts natives waiting (as sleep does),
+#     though not those computing in C (as sum does) until they return
+#   - envs: environments kept alive, one per call in progress plus one per
+#     live function. Functions are counted by wrapping each LambDef in a
+#     call to CLOSURE, which keeps a weak reference to what it returns
+#
+# Going over a limit raises ResourceExceeded, which ends the program like
+# any other error, so the interpreter running it can carry on with the next.
+# The natives checking the limits don't run in pmap workers, so limited
+# programs can't use pmap.
+
+STEPS = 'steps'
+DEPTH = 'depth'
+SECONDS = 'seconds'
+ENVS = 'envs'
+
+ENTER = '@limits_enter'
+EXIT = '@limits_exit'
+CALL_DEPTH = '@limits_depth'
+CLOSURE = '@limits_closure'
+
+
+def length(value):
+    return len(value) if isinstance(value, (List, str)) else 0
+
+
+def range_length(args):
+    if len(args) == 2 and type(args[0]) is int and type(args[1]) is int:
+        return max(args[1] - args[0], 0)
+    return 0
+
+
+def lengths(*positions):
+    '''The cost of a native going through its arguments at `positions`'''
+    return lambda args: sum(length(args[i]) for i in positions if i < len(args))
+
+
+def walked(args):
+    # nth follows Cons cells one by one
+    if len(args) == 2 and isinstance(args[0], Cons) and type(args[1]) is int:
+        return max(args[1], 0)
+    return 0
+
+
+# Steps natives cost, by name: worked out from their arguments before they
+# run, or from their result (RESULT_COST) after
+RESULT_COST = None
+NATIVE_COSTS = {
+    'range': range_length,
+    'map': lengths(1),
+    'filter': lengths(1),
+    'reduce': lengths(1),
+    'sum': lengths(0),
+    'concat': lambda args: sum(map(length, args)),
+    'nth': walked,
+    'write_file': lengths(1),
+    'read_file': RESULT_COST,
+    'http_get': RESULT_COST,
+}
+
+
+class ResourceExceeded(Exception):
+    '''A program went over its `limit` of `maximum`, using `used`'''
+
+    def __init__(self, limit, maximum, used):
+        super().__init__('Exceeded the {} limit of {}: used {}'.format(
+            limit, maximum, used if isinstance(used, int) else '{:.3f}'.format(used)))
+        self.limit = limit
+        self.maximum = maximum
+        self.used = used
+
+
+class Limits:
+    def __init__(self, steps=None, depth=None, seconds=None, envs=None):
+        self.max_steps = steps
+        self.max_depth = depth
+        self.max_seconds = seconds
+        self.max_envs = envs
+
+        self.steps = 0
+        self.depth = 0
+        self.started = time.perf_counter()
+        self.deadline = None if seconds is None else self.started + seconds
+
+        # Weak references to the live functions
+        self.closures = set()
+
+        self.timing = False
+
+    # Instrumenting
+
+    def instrument(self, ast):
+        '''`ast`, with its functions checking the limits as they're called'''
+        if isinstance(ast, parser.LambDef):
+            cost = size(ast.body)
+            self.instrument(ast.body)
+            report_calls(ast, ENTER, EXIT, CALL_DEPTH, cost)
+
+            if self.max_envs is not None:
+                return parser.FunCall(parser.VarLookup(CLOSURE), [ast])
+
+        elif isinstance(ast, parser.Stmts):
+            ast.stmts = [self.instrument(stmt) for stmt in ast.stmts]
+
+        elif isinstance(ast, parser.ASTNode):
+            ast.children = [self.instrument(child) for child in ast.children]
+
+        elif isinstance(ast, parser.Return):
+            ast.expr = self.instrument(ast.expr)
+
+        elif isinstance(ast, parser.IfElse):
+            ast.cond = self.instrument(ast.cond)
+            ast.cons = self.instrument(ast.cons)
+            ast.alt = self.instrument(ast.alt)
+
+        elif isinstance(ast, parser.FunCall):
+            ast.expr = self.instrument(ast.expr)
+            ast.args = [self.instrument(arg) for arg in ast.args]
+
+        return ast
+
+    def natives(self):
+        return {
+            ENTER: NativeFunction(ENTER, self.enter),
+            EXIT: NativeFunction(EXIT, self.exit),
+            CLOSURE: NativeFunction(CLOSURE, self.closure),
+        }
+
+    def charging(self, natives):
+        '''`natives`, those in NATIVE_COSTS charging the steps they take'''
+        return {
+            name: self.charged(native) if name in NATIVE_COSTS else native
+            for name, native in natives.items()
+        }
+
+    def charged(self, native):
+        function = native.callable
+        cost = NATIVE_COSTS[native.name]
+
+        def charged(*args):
+            if cost is not RESULT_COST:
+                self.charge(cost(args))
+                return function(*args)
+
+            value = function(*args)
+            if inspect.isawaitable(value):
+                return self.charge_result(value)
+            self.charge(length(value))
+            return value
+
+        return NativeFunction(native.name, charged)
+
+    async def charge_result(self, awaitable):
+        value = await awaitable
+        self.charge(length(value))
+        return value
+
+    # Running
+
+    @contextlib.contextmanager
+    def timer(self):
+        '''Raises ResourceExceeded in the main thread when the time is up'''
+        if (self.timing or self.deadline is None
+                or threading.current_thread() is not threading.main_thread()):
+            # Nested (as imports are), or left to the checks on calls
+            yield
+            return
+
+        previous = signal.signal(signal.SIGALRM, self.out_of_time)
+        signal.setitimer(signal.ITIMER_REAL, max(self.deadline - time.perf_counter(), 1e-6))
+        self.timing = True
+        try:
+            yield
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+            self.timing = False
+
+    def out_of_time(self, signum, frame):
+        raise ResourceExceeded(SECONDS, self.max_seconds, time.perf_counter() - self.started)
+
+    def charge(self, cost):
+        self.steps += cost
+
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise ResourceExceeded(STEPS, self.max_steps, self.steps)
+        if self.deadline is not None:
+            now = time.perf_counter()
+            if now > self.deadline:
+                raise ResourceExceeded(SECONDS, self.max_seconds, now - self.started)
+
+    def enter(self, cost):
+        self.depth += 1
+        self.charge(cost)
+
+        if self.max_depth is not None and self.depth > self.max_depth:
+            raise ResourceExceeded(DEPTH, self.max_depth, self.depth)
+        if self.max_envs is not None:
+            self.check_envs()
+
+        return self.depth
+
+    def exit(self, depth, *value):
+        # Returning None carries on after the if-else block, so the call
+        # isn't over
+        if value and value[0] is None:
+            return None
+
+        self.depth = depth - 1
+        return value[0] if value else 0
+
+    def closure(self, function):
+        self.closures.add(weakref.ref(function, self.closures.discard))
+        self.check_envs()
+        return function
+
+    def check_envs(self):
+        if self.depth + len(self.closures) > self.max_envs:
+            # Functions in the frame they're created in (as local recursive
+            # functions are) are only freed by the garbage collector
+            gc.collect()
+            if self.depth + len(self.closures) > self.max_envs:
+                raise ResourceExceeded(ENVS, self.max_envs, self.depth + len(self.closures))
+
+
+def test():
+    '''Runs programs going over each limit, or not, in every mode
+
+    Small enough for eval, which doesn't run tail calls in constant space.
+    '''
+    from compiler_studies.no_loop import bulk
+    from compiler_studies.no_loop import interpreter
+    from compiler_studies.no_loop import io_natives
+    from compiler_studies.no_loop import scanner
+    from compiler_studies.no_loop.runtime import Env
+
+    programs = {
+        'fib': '''
+            fib = \\(n) { if n <= 1 { return n } else { return fib(n - 1) + fib(n - 2) } }
+            result = fib(15)
+        ''',
+        'tail': '''
+            count = \\(n, acc) { if n == 0 { return acc } else { return count(n - 1, acc + 1) } }
+            result = count(80, 0)
+        ''',
+        'deep': '''
+            sum_to = \\(n) { if n == 0 { return 0 } else { return n + sum_to(n - 1) } }
+            result = sum_to(60)
+        ''',
+        'closures': '''
+            pair = \\(a, b) { return \\(first) { if first { return a } else { return b } } }
+            build = \\(n, acc) { if n == 0 { return acc } else { return build(n - 1, pair(n, acc)) } }
+            result = build(60, 0)(1)
+        ''',
+        'bulk': 'result = sum(range(0, 1000000))',
+        'sleep': 'f = \\() { return sleep(2000) } result = f()',
+    }
+
+    cases = [
+        # Program, limits and the limit it goes over, if any
+        ('fib', {}, None),
+        ('fib', {STEPS: 100000}, None),
+        ('fib', {STEPS: 10000}, STEPS),
+        ('fib', {SECONDS: 0.0}, SECONDS),
+        ('tail', {DEPTH: 10}, None),
+        ('deep', {DEPTH: 100}, None),
+        ('deep', {DEPTH: 30}, DEPTH),
+        ('closures', {ENVS: 1000}, None),
+        ('closures', {ENVS: 30}, ENVS),
+        ('bulk', {STEPS: 2000000}, None),
+        ('bulk', {STEPS: 1000}, STEPS),
+        ('sleep', {SECONDS: 0.2}, SECONDS),
+    ]
+
+    for mode in interpreter.CALLS:
+        for name, kwargs, expected in cases:
+            limits = Limits(**kwargs)
+            ast = parser.parse(parser.Stream(scanner.scan(programs[name])))
+            natives = limits.charging(dict(
+                **bulk.builtins(interpreter.CALLS[mode]), **io_natives.builtins(mode)))
+            env = Env(parent=Env(**natives, **limits.natives()))
+
+            tripped = None
+            try:
+                with limits.timer():
+                    interpreter.run(limits.instrument(ast), env, mode)
+            except ResourceExceeded as e:
+                tripped = e.limit
+
+            assert tripped == expected, (mode, name, kwargs, tripped)
+            assert time.perf_counter() - limits.started < 1, (mode, name, kwargs)
+            if expected is None:
+                assert env['result'] == {
+                    'fib': 610, 'tail': 80, 'deep': 1830, 'closures': 1, 'bulk': 499999500000}[name]
+            print('ok {:>8} {:>9} {}: {}'.format(mode, name, kwargs, tripped or 'within limits'))
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,157 @@
+from compiler_studies.no_loop.runtime import NativeFunction
+
+
+# Native persistent lists
+#
+# Lists are immutable, so they share their tails: `cons` makes a Cons cell
+# pointing to an existing list, and `tail` returns the list a cell points to.
+# Lists made at once, by `list` or `concat`, are a Slice of a tuple instead
+# (or of an array, see bulk.py), whose tails are slices of the same tuple, so
+# they're indexed in O(1) time.
+#
+#   lst = cons(0, list(1, 2, 3))
+#   print(head(lst), len(lst), nth(lst, 2), concat(lst, lst))
+
+
+class List:
+    __slots__ = ()
+
+    def __eq__(self, other):
+        if not isinstance(other, List):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for (a, b) in zip(self, other))
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __str__(self):
+        return '[{}]'.format(', '.join(map(str, self)))
+
+    def __repr__(self):
+        return '<List {}>'.format(self)
+
+
+class Cons(List):
+    __slots__ = ('head', 'tail', 'length')
+
+    def __init__(self, head, tail):
+        self.head = head
+        self.tail = tail
+        self.length = len(tail) + 1
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        lst = self
+        while isinstance(lst, Cons):
+            yield lst.head
+            lst = lst.tail
+        yield from lst
+
+    def nth(self, n):
+        lst = self
+        while isinstance(lst, Cons):
+            if n == 0:
+                return lst.head
+            lst = lst.tail
+            n -= 1
+        return lst.nth(n)
+
+
+class Slice(List):
+    __slots__ = ('items', 'start')
+
+    def __init__(self, items, start=0):
+        self.items = items
+        self.start = start
+
+    @property
+    def head(self):
+        return self.items[self.start]
+
+    @property
+    def tail(self):
+        return Slice(self.items, self.start + 1)
+
+    def __len__(self):
+        return len(self.items) - self.start
+
+    def __iter__(self):
+        items = self.items
+        for i in range(self.start, len(items)):
+            yield items[i]
+
+    def nth(self, n):
+        return self.items[self.start + n]
+
+
+EMPTY = Slice(())
+
+
+def make_list(*items):
+    return Slice(items) if items else EMPTY
+
+
+def cons(head, tail):
+    check_list(tail, 'cons')
+    return Cons(head, tail)
+
+
+def head(lst):
+    check_list(lst, 'head')
+    if not lst:
+        raise Exception('head of an empty list')
+    return lst.head
+
+
+def tail(lst):
+    check_list(lst, 'tail')
+    if not lst:
+        raise Exception('tail of an empty list')
+    return lst.tail
+
+
+def length(lst):
+    check_list(lst, 'len')
+    return len(lst)
+
+
+def nth(lst, n):
+    check_list(lst, 'nth')
+    if not isinstance(n, int) or not 0 <= n < len(lst):
+        raise Exception('Index {} out of range for a list of {}'.format(n, len(lst)))
+    return lst.nth(n)
+
+
+def concat(*lists):
+    for lst in lists:
+        check_list(lst, 'concat')
+
+    # Nothing to copy
+    non_empty = [lst for lst in lists if lst]
+    if len(non_empty) <= 1:
+        return non_empty[0] if non_empty else EMPTY
+
+    return Slice(tuple(item for lst in non_empty for item in lst))
+
+
+def check_list(value, name):
+    if not isinstance(value, List):
+        raise Exception('{} expects a list, got {}'.format(name, value))
+
+
+def builtins():
+    '''The list natives, by name'''
+    return {
+        name: NativeFunction(name, callable)
+        for (name, callable) in [
+            ('list', make_list),
+            ('cons', cons),
+            ('head', head),
+            ('tail', tail),
+            ('len', length),
+            ('nth', nth),
+            ('concat', concat),
+        ]
+    }
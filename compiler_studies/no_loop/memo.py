@@ -0,0 +1,248 @@
+import collections
+import functools
+import weakref
+
+from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop.resolver import assigned_names
+from compiler_studies.no_loop.runtime import NativeFunction
+
+
+# Memoization of pure functions
+#
+# `mark` finds the functions of a program whose result only depends on their
+# arguments, and marks their LambDef to be memoized. Every execution mode
+# then wraps the functions it creates from a marked LambDef with `memoized`.
+#
+# Only top level functions, assigned once, are considered. A function is pure
+# if it doesn't create lambdas (which are compared by identity), only calls
+# itself and other pure functions (so no natives, like print, nor functions
+# it's passed), and only reads its own variables and globals which are
+# assigned once (by any program running in the same globals). Functions can't
+# assign to outer scopes in No-Loop, since `=` always binds in the current
+# one.
+#
+# Functions are memoized when preceded by a `// @memoize` comment (or
+# `// @memoize <cache size>`), or all pure functions with `auto`, but those
+# which call themselves in tail position: calls to memoized functions nest
+# like calls to natives, so they'd run out of stack, and their arguments
+# (as accumulators) rarely repeat anyway.
+
+ANNOTATION = '@memoize'
+
+CACHE_SIZE = 1024
+
+# Every memoized function, for `report`
+INSTANCES = weakref.WeakSet()
+
+
+def mark(ast, auto=False, cache_size=CACHE_SIZE, assignments=None):
+    '''Marks the functions to memoize in program `ast`
+
+    `assignments` counts the names assigned by every program running in the
+    same globals as `ast`, if it doesn't have them to itself. Returns the
+    names of the memoized functions and of the annotated ones which aren't
+    pure.
+    '''
+    if assignments is None:
+        assignments = collections.Counter(assigned_names(ast))
+    constants = {name for (name, count) in assignments.items() if count == 1}
+
+    functions = {}
+    sizes = {}
+    previous = None
+    for stmt in ast.stmts:
+        if isinstance(stmt, parser.ASTNode) and stmt.type == '=':
+            left, right = stmt.children
+            if (isinstance(left, parser.VarLookup) and isinstance(right, parser.LambDef)
+                    and left.value in constants):
+                functions[left.value] = right
+                sizes[left.value] = annotation(previous)
+
+        previous = stmt
+
+    # Assume they're all pure, and rule out those that aren't (and those
+    # calling them) until there are none left to rule out
+    pure = set(functions)
+    changed = True
+    while changed:
+        changed = False
+        for name in sorted(pure):
+            if not is_pure(functions[name].body, set(functions[name].args), pure, constants):
+                pure.discard(name)
+                changed = True
+
+    memoized = []
+    impure = []
+    for name, lambdef in functions.items():
+        size = sizes[name]
+        if size is None and not auto:
+            continue
+
+        if size is None and name in self_tail_calling(functions):
+            continue
+
+        if name in pure:
+            lambdef.memoize = (name, size or cache_size)
+            memoized.append(name)
+        elif size is not None:
+            impure.append(name)
+
+    return memoized, impure
+
+
+def self_tail_calling(functions):
+    '''The names of `functions` returning calls to themselves'''
+    return {
+        name
+        for name, lambdef in functions.items()
+        if any(isinstance(call.expr, parser.VarLookup) and call.expr.value == name
+               for call in tail_calls(lambdef.body))
+    }
+
+
+def tail_calls(stmts):
+    for stmt in stmts.stmts:
+        if isinstance(stmt, parser.Return) and isinstance(stmt.expr, parser.FunCall):
+            yield stmt.expr
+
+        elif isinstance(stmt, parser.IfElse):
+            yield from tail_calls(stmt.cons)
+            yield from tail_calls(stmt.alt)
+
+
+def annotation(stmt):
+    '''The cache size asked for by a `// @memoize` comment, or None'''
+    if not isinstance(stmt, parser.Comment):
+        return None
+
+    text = stmt.value.strip('/* \n\t')
+    if not text.startswith(ANNOTATION):
+        return None
+
+    size = text[len(ANNOTATION):]
+    if size and not size[0].isspace():
+        return None
+
+    size = size.strip()
+    return int(size) if size.isdigit() else CACHE_SIZE
+
+
+def is_pure(ast, local, pure, constants):
+    if isinstance(ast, parser.Stmts):
+        local = local | set(assigned_names(ast))
+        return all(is_pure(stmt, local, pure, constants) for stmt in ast.stmts)
+
+    elif isinstance(ast, parser.LambDef):
+        return False
+
+    elif isinstance(ast, parser.FunCall):
+        fun = ast.expr
+        if not isinstance(fun, parser.VarLookup) or fun.value in local or fun.value not in pure:
+            return False
+        return all(is_pure(arg, local, pure, constants) for arg in ast.args)
+
+    elif isinstance(ast, parser.VarLookup):
+        return ast.value in local or ast.value in constants
+
+    elif isinstance(ast, parser.ASTNode):
+        return all(is_pure(child, local, pure, constants) for child in ast.children)
+
+    elif isinstance(ast, parser.Return):
+        return is_pure(ast.expr, local, pure, constants)
+
+    elif isinstance(ast, parser.IfElse):
+        return (is_pure(ast.cond, local, pure, constants)
+                and is_pure(ast.cons, local, pure, constants)
+                and is_pure(ast.alt, local, pure, constants))
+
+    return True
+
+
+class MemoizedFunction(NativeFunction):
+    '''Calls `function` through a bounded LRU cache of its results
+
+    Since results are cached by the arguments' values and types, calls
+    don't go through the execution mode's usual path for functions, but
+    through `call(function, args)`, like natives.
+    '''
+
+    def __init__(self, name, function, call, cache_size):
+        @functools.lru_cache(maxsize=cache_size, typed=True)
+        def cached(*args):
+            return call(function, list(args))
+
+        super().__init__(name, cached)
+        self.function = function
+        INSTANCES.add(self)
+
+    def cache_info(self):
+        return self.callable.cache_info()
+
+    def __repr__(self):
+        return '<MemoizedFunction {}>'.format(self.name)
+
+
+def memoized(function, memoize, call):
+    '''Wraps `function`, created from a LambDef marked with `memoize`'''
+    name, cache_size = memoize
+    return MemoizedFunction(name, function, call, cache_size)
+
+
+def report(file=None):
+    '''Prints the cache statistics of every memoized function'''
+    for function in sorted(INSTANCES, key=lambda f: f.name):
+        info = function.cache_info()
+        calls = info.hits + info.misses
+        print('{}: {} hits, {} misses ({:.0%} hit rate), {}/{} cached'.format(
+            function.name, info.hits, info.misses, info.hits / calls if calls else 0,
+            info.currsize, info.maxsize), file=file)
+
+
+def test():
+    '''Checks which functions `mark` finds pure'''
+    from compiler_studies.no_loop import scanner
+
+    program = '''
+        // @memoize
+        fib = \\(n) { if n <= 1 { return n } else { return fib(n-1) + fib(n-2) } }
+        // @memoize 8
+        twice = \\(n) { return double(double(n)) }
+        double = \\(n) { return n * 2 }
+        // @memoize
+        noisy = \\(n) { print(n) return n }
+        louder = \\(n) { return noisy(n) + 1 }
+        apply = \\(f, n) { return f(n) }
+        adder = \\(n) { return \\(m) { return n + m } }
+        counter = 0
+        counter = counter + 1
+        count = \\(n) { return n + counter }
+        offset = 2
+        shift = \\(n) { k = n + offset return k }
+        total = \\(n, acc) { if n == 0 { return acc } else { return total(n - 1, acc + n) } }
+        // @memoize
+        sum_to = \\(n, acc) { if n == 0 { return acc } else { return sum_to(n - 1, acc + n) } }
+    '''
+
+    ast = parser.parse(parser.Stream(scanner.scan(program)))
+    assert mark(ast) == (['fib', 'twice', 'sum_to'], ['noisy'])
+
+    ast = parser.parse(parser.Stream(scanner.scan(program)))
+    memoized, _ = mark(ast, auto=True, cache_size=16)
+    assert memoized == ['fib', 'twice', 'double', 'shift', 'sum_to']
+    sizes = {stmt.children[0].value: stmt.children[1].memoize
+             for stmt in ast.stmts
+             if isinstance(stmt, parser.ASTNode) and isinstance(stmt.children[1], parser.LambDef)}
+    assert sizes['twice'] == ('twice', 8) and sizes['double'] == ('double', 16)
+
+    # Another program, running in the same globals, assigns offset again
+    ast = parser.parse(parser.Stream(scanner.scan(program)))
+    other = parser.parse(parser.Stream(scanner.scan('offset = 100 print(shift(1))')))
+    assignments = collections.Counter(assigned_names(ast))
+    assignments.update(assigned_names(other))
+    memoized, _ = mark(ast, auto=True, assignments=assignments)
+    assert memoized == ['fib', 'twice', 'double', 'sum_to']
+    print('ok')
+
+
+if __name__ == '__main__':
+    test()
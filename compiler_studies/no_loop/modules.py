@@ -0,0 +1,93 @@
+import os
+
+from compiler_studies.no_loop.runtime import Env, NativeFunction
+
+
+# Modules
+#
+# `import('lib.nl')` runs lib.nl in an Env of its own, whose parent holds the
+# builtins, and returns it as a Module: a function of a name, since No-Loop
+# has no attribute access:
+#
+#   lib = import('lib.nl')
+#   make_pair = lib('make_pair')
+#
+# Paths are relative to the directory of the file being run. Every module is
+# run once per process, however many times and from wherever it's imported.
+
+
+class CyclicImport(Exception):
+    pass
+
+
+class Module(NativeFunction):
+    '''The variables a module assigned at its top level'''
+
+    def __init__(self, path, env):
+        super().__init__(path, self.get)
+        self.path = path
+        self.env = env
+
+    def get(self, name):
+        name = unquote(name)
+        if name not in self.env:
+            raise Exception('{} has no {}'.format(self.path, name))
+        return self.env[name]
+
+    def __repr__(self):
+        return '<Module {}>'.format(self.path)
+
+
+def unquote(string):
+    # String values keep their quotes
+    if not isinstance(string, str) or len(string) < 2 or string[0] not in '\'"' or string[-1] != string[0]:
+        raise Exception('Expected a string, got {}'.format(string))
+    return string[1:-1]
+
+
+class ModuleLoader:
+    '''Imports modules by running them with `run_file(path, env, source)`'''
+
+    def __init__(self, run_file, builtins):
+        self.run_file = run_file
+        self.builtins = builtins
+
+        # Modules by real path, and the files being run, innermost last
+        self.modules = {}
+        self.running = []
+
+        self.builtins['import'] = NativeFunction('import', self.load)
+
+    def run(self, path, env, source=None):
+        '''Runs `path` (a module or a program) in `env`
+
+        Or program text `source`, imports in which are relative to `path`.
+        '''
+        self.running.append(os.path.realpath(path))
+        try:
+            return self.run_file(path, env, source)
+        finally:
+            self.running.pop()
+
+    def load(self, name):
+        name = unquote(name)
+        if self.running:
+            name = os.path.join(os.path.dirname(self.running[-1]), name)
+        path = os.path.realpath(name)
+
+        if path in self.modules:
+            return self.modules[path]
+
+        if path in self.running:
+            cycle = self.running[self.running.index(path):] + [path]
+            raise CyclicImport('Cyclic import: {}'.format(
+                ' -> '.join(cycle)))
+
+        if not os.path.isfile(path):
+            raise Exception('No module {}'.format(name))
+
+        env = Env(parent=self.builtins)
+        self.run(path, env)
+
+        module = self.modules[path] = Module(os.path.normpath(name), env)
+        return module
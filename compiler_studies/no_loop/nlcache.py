@@ -0,0 +1,233 @@
+import hashlib
+import io
+import os
+import pickle
+import struct
+import sys
+
+from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop import scanner
+
+
+# On disk cache of parsed programs
+#
+# Like Python's __pycache__, the top level statements of `dir/prog.nl` are
+# kept in `dir/__nlcache__/prog.nl.<tag>.nlc`, as a header followed by
+# batches of pickled statements, so that they can be loaded (and run) a few
+# at a time. Statements are pickled as soon as they're parsed, since the
+# caller may change them (as the profiler does) once it gets them.
+#
+# The header holds the sha256 of the source and of the interpreter version:
+# the Python implementation plus the sources of the scanner and parser, which
+# define the AST. An entry whose digest doesn't match, or whose length isn't
+# the one recorded in its header, is stale and gets replaced after parsing.
+# Entries are written to a temporary file and renamed into place, so readers
+# never see one half written.
+
+DIRECTORY = '__nlcache__'
+
+MAGIC = b'NLC2'
+
+# Magic, digest and length of the pickles
+HEADER = struct.Struct('<4s32sQ')
+
+PROTOCOL = pickle.HIGHEST_PROTOCOL
+
+# Statements per batch of pickles sharing their memo: larger batches share
+# more of the pickled class references
+BATCH_SIZE = 256
+
+
+def interpreter_version():
+    '''Identifies the implementation the entries are valid for'''
+    version = hashlib.sha256(sys.implementation.cache_tag.encode())
+    for module in (scanner, parser):
+        with open(module.__file__, 'rb') as f:
+            version.update(f.read())
+    return version.digest()
+
+
+VERSION = interpreter_version()
+
+
+def cache_path(source_file):
+    directory, name = os.path.split(os.path.abspath(source_file))
+    return os.path.join(directory, DIRECTORY, '{}.{}.nlc'.format(
+        name, sys.implementation.cache_tag))
+
+
+def digest(f):
+    '''The cache key for the contents of binary file `f`'''
+    key = hashlib.sha256(VERSION)
+    for chunk in iter(lambda: f.read(1 << 16), b''):
+        key.update(chunk)
+    return key.digest()
+
+
+def load(path, key):
+    '''The open cache entry at `path` if it's fresh, positioned after its header'''
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+
+    header = f.read(HEADER.size)
+    if len(header) == HEADER.size:
+        magic, entry_key, length = HEADER.unpack(header)
+        if (magic, entry_key) == (MAGIC, key) and os.fstat(f.fileno()).st_size == HEADER.size + length:
+            return f
+
+    f.close()
+    return None
+
+
+def entry_stmts(f):
+    with f:
+        while True:
+            # A new memo for every batch
+            unpickler = pickle.Unpickler(f)
+            for _ in range(BATCH_SIZE):
+                try:
+                    yield unpickler.load()
+                except EOFError:
+                    return
+
+
+def parse_and_store(source, path, key):
+    '''Yields the statements parsed from text file `source`, storing them at `path`
+
+    If closed early, as when the program returns, the rest of the statements
+    are parsed just to be stored. Nothing is stored if any can't be parsed.
+    '''
+    tmp = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = open('{}.{}.tmp'.format(path, os.getpid()), 'wb')
+        tmp.write(HEADER.pack(MAGIC, key, 0))
+        pickler = pickle.Pickler(tmp, PROTOCOL)
+    except OSError:
+        # Not writable, just parse
+        if tmp is not None:
+            discard(tmp)
+        tmp = None
+
+    batch = 0
+
+    def dump(stmt):
+        nonlocal tmp, batch
+        if tmp is None:
+            return
+
+        try:
+            pickler.dump(stmt)
+            batch += 1
+            if batch == BATCH_SIZE:
+                # Batches are independent of each other
+                pickler.clear_memo()
+                batch = 0
+        except (OSError, RecursionError, pickle.PicklingError):
+            discard(tmp)
+            tmp = None
+
+    stmts = parser.parse_iter(parser.Stream(scanner.scan_iter(source)))
+    done = False
+    try:
+        for stmt in stmts:
+            dump(stmt)
+            yield stmt
+
+        done = True
+    except GeneratorExit:
+        if tmp is not None:
+            try:
+                for stmt in stmts:
+                    dump(stmt)
+                done = True
+            except (parser.InvalidSyntax, scanner.MalformedInput):
+                pass
+        raise
+    finally:
+        if tmp is not None:
+            if done:
+                store(tmp, path, key)
+            else:
+                discard(tmp)
+
+
+def store(tmp, path, key):
+    try:
+        length = tmp.tell() - HEADER.size
+        tmp.seek(0)
+        tmp.write(HEADER.pack(MAGIC, key, length))
+        tmp.close()
+        os.replace(tmp.name, path)
+    except OSError:
+        discard(tmp)
+
+
+def discard(tmp):
+    tmp.close()
+    try:
+        os.remove(tmp.name)
+    except OSError:
+        pass
+
+
+def parse_file(source_file, use_cache=True):
+    '''Yields the top level statements of `source_file`
+
+    They're loaded from its cache entry when fresh, otherwise parsed and,
+    with `use_cache`, stored for next time.
+    '''
+    with open(source_file, 'rb') as f:
+        if not use_cache:
+            yield from parser.parse_iter(parser.Stream(scanner.scan_iter(io.TextIOWrapper(f))))
+            return
+
+        key = digest(f)
+        path = cache_path(source_file)
+
+        entry = load(path, key)
+        if entry is not None:
+            yield from entry_stmts(entry)
+            return
+
+        f.seek(0)
+        yield from parse_and_store(io.TextIOWrapper(f), path, key)
+
+
+def test():
+    '''Checks that cached programs load the same statements they were parsed into'''
+    import glob
+    import shutil
+    import tempfile
+
+    examples = os.path.join(os.path.dirname(__file__), 'examples', '*.nl')
+    directory = tempfile.mkdtemp()
+    try:
+        for example in sorted(glob.glob(examples)):
+            source_file = shutil.copy(example, directory)
+            expected = list(map(pickle.dumps, parse_file(source_file, use_cache=False)))
+
+            # Cold, warm, then stale after the source changes
+            assert list(map(pickle.dumps, parse_file(source_file))) == expected
+            assert os.path.exists(cache_path(source_file))
+            assert list(map(pickle.dumps, parse_file(source_file))) == expected
+
+            with open(source_file, 'a') as f:
+                f.write('\nextra = 1\n')
+            assert len(list(parse_file(source_file))) == len(expected) + 1
+            assert len(list(parse_file(source_file))) == len(expected) + 1
+
+            # Truncated entries are ignored
+            with open(cache_path(source_file), 'r+b') as f:
+                f.truncate(HEADER.size + 1)
+            assert len(list(parse_file(source_file))) == len(expected) + 1
+
+            print('ok {}'.format(os.path.basename(example)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,446 @@
+import collections
+import operator
+
+from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop.resolver import assigned_names
+
+
+# Simplifies a parsed No-Loop AST before it's evaluated:
+#
+# - literals become Const nodes, holding their Python value (so numbers
+#   aren't converted from their text over and over again),
+# - binary operations on Consts are replaced by the Const of their result,
+# - if-else blocks with a Const condition are replaced by the branch that
+#   would run.
+#
+# Nothing is folded that could behave differently at run time: operations
+# that fail (like 1 / 0 or 1 + 'a') are left for the program to fail on.
+
+FOLDABLE = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '==': operator.eq,
+    '>=': operator.ge,
+    '<=': operator.le,
+}
+
+# Don't build huge strings (think 'a' * 1000000000) ahead of time
+MAX_FOLDED_STRING = 1024
+
+
+def optimize(ast):
+    '''Returns the optimized `ast`, which is changed in place'''
+    if isinstance(ast, parser.Stmts):
+        ast.stmts = optimize_stmts(ast.stmts)
+
+    elif isinstance(ast, parser.ASTNode):
+        left, right = ast.children
+
+        if ast.type == '=':
+            ast.children = [left, optimize(right)]
+        else:
+            ast.children = [optimize(left), optimize(right)]
+            return fold(ast)
+
+    elif isinstance(ast, parser.Num):
+        return parser.Const(int(ast.value))
+
+    elif isinstance(ast, parser.String):
+        return parser.Const(ast.value)
+
+    elif isinstance(ast, parser.Return):
+        ast.expr = optimize(ast.expr)
+
+    elif isinstance(ast, parser.IfElse):
+        ast.cond = optimize(ast.cond)
+        ast.cons = optimize(ast.cons)
+        ast.alt = optimize(ast.alt)
+
+    elif isinstance(ast, parser.LambDef):
+        ast.body = optimize(ast.body)
+
+    elif isinstance(ast, parser.FunCall):
+        ast.expr = optimize(ast.expr)
+        ast.args = [optimize(a) for a in ast.args]
+
+    return ast
+
+
+def fold(ast):
+    left, right = ast.children
+
+    if not (isinstance(left, parser.Const) and isinstance(right, parser.Const)):
+        return ast
+
+    if folded_length(ast.type, left.value, right.value) > MAX_FOLDED_STRING:
+        return ast
+
+    try:
+        value = FOLDABLE[ast.type](left.value, right.value)
+    except (ArithmeticError, TypeError, MemoryError):
+        return ast
+
+    return parser.Const(value)
+
+
+def folded_length(op, left, right):
+    '''The length of the string `left op right` makes, before making it (0 if none)'''
+    if op == '+' and isinstance(left, str) and isinstance(right, str):
+        return len(left) + len(right)
+
+    elif op == '*' and isinstance(left, str) and isinstance(right, int):
+        return len(left) * right
+
+    elif op == '*' and isinstance(left, int) and isinstance(right, str):
+        return left * len(right)
+
+    return 0
+
+
+def optimize_stmts(stmts):
+    optimized = []
+
+    for stmt in stmts:
+        stmt = optimize(stmt)
+
+        # Returning None from an if-else block carries on after it, which
+        # a return spliced into the enclosing block wouldn't do
+        if (isinstance(stmt, parser.IfElse) and isinstance(stmt.cond, parser.Const)
+                and not has_return(stmt.cons) and not has_return(stmt.alt)):
+            optimized.extend((stmt.cons if stmt.cond.value else stmt.alt).stmts)
+        else:
+            optimized.append(stmt)
+
+    return optimized
+
+
+def has_return(stmts):
+    for stmt in stmts.stmts:
+        if isinstance(stmt, parser.Return):
+            return True
+
+        elif isinstance(stmt, parser.IfElse) and (has_return(stmt.cons) or has_return(stmt.alt)):
+            return True
+
+    return False
+
+
+# Inlining
+#
+# Calls to small functions are replaced by their body, with the arguments
+# substituted for the parameters (beta-reduction). Only functions which are
+#
+# - assigned once, at the top level, to a lambda whose body is a single
+#   return of an expression of at most `max_size` nodes (and nowhere else,
+#   when other programs run in the same globals: see `assignments`),
+# - not recursive,
+#
+# are inlined, and only at calls which
+#
+# - come after their definition in the program,
+# - pass as many arguments as there are parameters, all of them literals
+#   or variables (so nothing is evaluated more or less often than before),
+#   and only literals for parameters used by a nested lambda (which would
+#   otherwise see later assignments to the variable),
+# - don't shadow any of the function's free variables, nor have variable
+#   arguments captured by the function's nested lambdas.
+#
+# What gets inlined is the function as it was written, so calls in inlined
+# code aren't inlined any further. Note that a function returning None
+# raises an error, while its inlined body doesn't.
+
+INLINE_SIZE = 16
+
+ATOMS = (parser.Num, parser.String, parser.Const, parser.VarLookup)
+
+
+def inline(ast, max_size=INLINE_SIZE, assignments=None):
+    '''Inlines calls to small functions in program `ast`, returning how many
+
+    `assignments` counts the names assigned by every program running in the
+    same globals as `ast`, if it doesn't have them to itself.
+    '''
+    if assignments is None:
+        assignments = collections.Counter(assigned_names(ast))
+
+    definitions = {}
+    for i, stmt in enumerate(ast.stmts):
+        if isinstance(stmt, parser.ASTNode) and stmt.type == '=':
+            left, right = stmt.children
+            if (isinstance(left, parser.VarLookup) and isinstance(right, parser.LambDef)
+                    and assignments[left.value] == 1):
+                function = Inlinable.of(left.value, right, max_size)
+                if function is not None:
+                    definitions[left.value] = (i, function)
+
+    inliner = Inliner()
+    for i, stmt in enumerate(ast.stmts):
+        inliner.functions = {
+            name: function
+            for (name, (defined_at, function)) in definitions.items()
+            if defined_at < i
+        }
+        ast.stmts[i] = inliner.rewrite(stmt, frozenset())
+
+    return inliner.count
+
+
+class Inlinable:
+    def __init__(self, params, expr):
+        self.params = params
+
+        # A copy, so that inlining calls in the definition itself doesn't
+        # affect what gets inlined
+        self.expr = substitute(expr, {})
+        self.free = set(free_names(expr, set(params)))
+        self.bound = set(bound_names(expr))
+        self.captured = set(captured_params(expr, set(params)))
+
+    @classmethod
+    def of(cls, name, ast, max_size):
+        stmts = [s for s in ast.body.stmts if not isinstance(s, parser.Comment)]
+        if len(stmts) != 1 or not isinstance(stmts[0], parser.Return):
+            return None
+
+        expr = stmts[0].expr
+        if size(expr) > max_size:
+            return None
+
+        function = cls(ast.args, expr)
+        if name in function.free:
+            return None
+
+        return function
+
+
+class Inliner:
+    def __init__(self):
+        self.functions = {}
+        self.count = 0
+
+    def rewrite(self, ast, bound):
+        '''Inlines the calls in `ast`, where the names in `bound` are local'''
+        if isinstance(ast, parser.Stmts):
+            ast.stmts = [self.rewrite(stmt, bound) for stmt in ast.stmts]
+
+        elif isinstance(ast, parser.ASTNode):
+            ast.children = [self.rewrite(child, bound) for child in ast.children]
+
+        elif isinstance(ast, parser.Return):
+            ast.expr = self.rewrite(ast.expr, bound)
+
+        elif isinstance(ast, parser.IfElse):
+            ast.cond = self.rewrite(ast.cond, bound)
+            ast.cons = self.rewrite(ast.cons, bound)
+            ast.alt = self.rewrite(ast.alt, bound)
+
+        elif isinstance(ast, parser.LambDef):
+            ast.body = self.rewrite(ast.body, bound | set(ast.args) | set(assigned_names(ast.body)))
+
+        elif isinstance(ast, parser.FunCall):
+            ast.expr = self.rewrite(ast.expr, bound)
+            ast.args = [self.rewrite(a, bound) for a in ast.args]
+            return self.inline_call(ast, bound)
+
+        return ast
+
+    def inline_call(self, ast, bound):
+        if not isinstance(ast.expr, parser.VarLookup) or ast.expr.value in bound:
+            return ast
+
+        function = self.functions.get(ast.expr.value)
+        if function is None or len(function.params) != len(ast.args):
+            return ast
+
+        if function.free & bound:
+            return ast
+
+        args = dict(zip(function.params, ast.args))
+        for param, arg in args.items():
+            if not isinstance(arg, ATOMS):
+                return ast
+
+            if isinstance(arg, parser.VarLookup) and (
+                    param in function.captured or arg.value in function.bound):
+                return ast
+
+        self.count += 1
+        return substitute(function.expr, args)
+
+
+def substitute(ast, args):
+    '''A copy of `ast` with the variables in `args` replaced by copies of their value'''
+    if isinstance(ast, parser.Stmts):
+        return parser.Stmts([substitute(stmt, args) for stmt in ast.stmts])
+
+    elif isinstance(ast, parser.ASTNode):
+        return parser.ASTNode(ast.type, [substitute(child, args) for child in ast.children])
+
+    elif isinstance(ast, parser.VarLookup):
+        if ast.value in args:
+            return substitute(args[ast.value], {})
+        return parser.VarLookup(ast.value)
+
+    elif isinstance(ast, parser.Return):
+        return parser.Return(substitute(ast.expr, args))
+
+    elif isinstance(ast, parser.IfElse):
+        return parser.IfElse(
+            substitute(ast.cond, args), substitute(ast.cons, args), substitute(ast.alt, args))
+
+    elif isinstance(ast, parser.LambDef):
+        # Don't replace the parameters of the nested lambda
+        shadowed = set(ast.args) | set(assigned_names(ast.body))
+        inner = {name: value for (name, value) in args.items() if name not in shadowed}
+        return parser.LambDef(list(ast.args), substitute(ast.body, inner), ast.position)
+
+    elif isinstance(ast, parser.FunCall):
+        return parser.FunCall(substitute(ast.expr, args), [substitute(a, args) for a in ast.args])
+
+    elif isinstance(ast, (parser.Num, parser.String, parser.Const, parser.Comment)):
+        return ast.__class__(ast.value)
+
+    raise RuntimeError('Unable to copy {}'.format(ast.__class__.__name__))
+
+
+def children(ast):
+    if isinstance(ast, parser.Return):
+        return [ast.expr]
+    elif isinstance(ast, parser.FunCall):
+        return [ast.expr] + ast.args
+    return getattr(ast, 'children', [])
+
+
+def size(ast):
+    return 1 + sum(size(child) for child in children(ast))
+
+
+def free_names(ast, bound):
+    '''Names used in `ast` that aren't in `bound` nor bound by its lambdas'''
+    if isinstance(ast, parser.VarLookup):
+        if ast.value not in bound:
+            yield ast.value
+
+    elif isinstance(ast, parser.LambDef):
+        yield from free_names(ast.body, bound | set(ast.args) | set(assigned_names(ast.body)))
+
+    else:
+        for child in children(ast):
+            yield from free_names(child, bound)
+
+
+def bound_names(ast):
+    '''Names bound by the lambdas in `ast`'''
+    if isinstance(ast, parser.LambDef):
+        yield from ast.args
+        yield from assigned_names(ast.body)
+
+    for child in children(ast):
+        yield from bound_names(child)
+
+
+def captured_params(ast, params):
+    '''Parameters in `params` used by the lambdas in `ast`'''
+    if isinstance(ast, parser.LambDef):
+        yield from (name for name in free_names(ast, set()) if name in params)
+
+    else:
+        for child in children(ast):
+            yield from captured_params(child, params)
+
+
+def test():
+    '''Checks that every mode prints what eval does, with and without optimizing'''
+    import glob
+    import os
+
+    from compiler_studies.no_loop import bulk
+    from compiler_studies.no_loop import async_eval
+    from compiler_studies.no_loop import compiler
+    from compiler_studies.no_loop import interpreter
+    from compiler_studies.no_loop import lists
+    from compiler_studies.no_loop import resolver
+    from compiler_studies.no_loop import scanner
+    from compiler_studies.no_loop import stack_eval
+    from compiler_studies.no_loop import vm
+    from compiler_studies.no_loop.runtime import Env, NativeFunction
+
+    modes = {
+        'eval': interpreter.eval,
+        'closure': lambda ast, env: interpreter.compile(resolver.resolve(ast))(env),
+        'stack': stack_eval.eval,
+        'vm': lambda ast, env: vm.run(compiler.compile(resolver.resolve(ast)), env),
+        'async': async_eval.run,
+    }
+
+    programs = [
+        'print(1 + 2 * 3 - 4 / 2, 7 - 2 - 1, 2 * 3 == 6, 1 >= 2, 3 <= 3)',
+        'print(\'a\' + \'b\', \'ab\' * 3, "x" == "x")',
+        'x = 10 print(x * (2 + 3), 1 + x + 2 * 4)',
+        'if 1 + 1 == 2 { a = 1 } else { a = 2 } print(a)',
+        'if 0 { a = 1 } else { if 1 { a = 3 } else { a = 4 } } print(a)',
+        'f = \\(n) { if 1 { return print(n) } else { return 0 } return n + 1 } print(f(5))',
+        'f = \\(n) { if 2 <= 1 { return 1 } else { x = n * (4 - 2) } return x } print(f(21))',
+        'f = \\(a, b) { return a * b + 1 } x = 2 print(f(x, 3), f(f(1, 2), x))',
+        'f = \\(n) { return g(n) } g = \\(n) { return n + 1 } print(f(1))',
+        'f = \\(n) { return n + 1 } f = \\(n) { return n } print(f(1))',
+        'f = \\(n) { if n == 0 { return 0 } else { return f(n - 1) } } print(f(3))',
+        'y = 1 f = \\(n) { return n + y } g = \\(y) { return f(y) } print(g(5))',
+        'f = \\(n) { return \\() { return n } } g = \\(n) { h = f(n) n = 2 return h() } '
+        'print(g(1))',
+        'f = \\(x) { return \\(n) { return n + x } } n = 10 print(f(n)(1))',
+        'x = 1 f = \\() { y = x x = 2 return y + x } print(f(), x)',
+        'x = 1 f = \\(c) { if c { x = 5 } else { y = 0 } return x } print(f(1), f(0))',
+        'x = 1 f = \\() { g = \\() { y = x x = 9 return y } x = 4 return g() } print(f())',
+        'f = \\(a) { g = \\() { y = a a = 7 return y } return g() } print(f(3))',
+        'print(1 / 0)',
+        'print(1 + \'a\')',
+        # Files run one after the other, in the same globals
+        ('f = \\(x) { return x } g = \\(x) { return f(x) }', 'f = \\(x) { return x + 100 } print(g(1))'),
+    ]
+
+    examples = os.path.join(os.path.dirname(__file__), 'examples', '*.nl')
+    for path in sorted(glob.glob(examples)):
+        with open(path) as f:
+            programs.append(f.read())
+
+    def run(mode, program, optimized):
+        printed = []
+        env = Env(
+            print=NativeFunction('print', lambda *args: printed.append(args)),
+            **lists.builtins(),
+            **bulk.builtins(interpreter.CALLS[mode])
+        )
+
+        sources = program if isinstance(program, tuple) else (program,)
+        try:
+            asts = [parser.parse(parser.Stream(scanner.scan(source))) for source in sources]
+            assignments = collections.Counter(name for ast in asts for name in assigned_names(ast))
+            for ast in asts:
+                if optimized:
+                    inline(ast, assignments=assignments)
+                    ast = optimize(ast)
+                modes[mode](ast, env)
+        except Exception as e:
+            printed.append(repr(e))
+
+        return printed
+
+    for program in programs:
+        expected = run('eval', program, optimized=False)
+        for mode in modes:
+            for optimized in (False, True):
+                actual = run(mode, program, optimized)
+
+                if actual != expected:
+                    raise AssertionError('{} differs in {} mode{}: {} != {}'.format(
+                        program, mode, ' when optimized' if optimized else '',
+                        actual, expected))
+
+    print('{} programs print the same in every mode, optimized or not'.format(len(programs)))
+
+
+if __name__ == '__main__':
+    test()
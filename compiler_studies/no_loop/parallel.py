@@ -0,0 +1,249 @@
+import concurrent.futures
+import functools
+import multiprocessing
+import os
+import pickle
+
+from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop import bulk
+from compiler_studies.no_loop import lists
+from compiler_studies.no_loop import profiler
+from compiler_studies.no_loop.memo import MemoizedFunction
+from compiler_studies.no_loop.optimizer import children
+from compiler_studies.no_loop.resolver import assigned_names
+from compiler_studies.no_loop.runtime import Env, Function, NativeFunction, UNSET
+
+
+# Parallel map
+#
+# `pmap(f, lst)` (or `pmap(f, lst, chunksize)`) is `map(f, lst)`, run in
+# chunks by a pool of processes. Functions can't be pickled as they are, since
+# they hold compiled code and whole environments, so `f` is shipped as its
+# LambDef plus the values of the variables it uses from outer scopes, which
+# are shipped in turn. Each worker evaluates the LambDef in a global scope of
+# its own, holding those values, in the same execution mode as the program.
+#
+# Workers only get the natives which compute a result from their arguments
+# (so not print nor import), and elements and results have to be data:
+# numbers, strings and lists of them. Functions can't assign to outer scopes
+# in No-Loop, so the rest of the program can't observe they ran elsewhere.
+#
+# Daemon processes can't start processes of their own, so in the workers of
+# --jobs and of the server, which already keep every core busy, the chunks
+# run one after the other instead, shipped all the same.
+
+WORKERS = os.cpu_count() or 1
+
+# Natives workers provide, which functions can use. Profiled functions report
+# their calls with natives which do nothing in workers.
+PURE_NATIVES = set(lists.builtins()) | set(bulk.builtins(None)) | set(profiler.passthrough_natives())
+
+# The pool, started by the first pmap
+EXECUTOR = None
+
+
+class ImpureFunction(Exception):
+    pass
+
+
+class Shipped:
+    '''A function, as sent to workers'''
+
+    __slots__ = ('lambdef', 'captured')
+
+    def __init__(self, lambdef):
+        self.lambdef = lambdef
+        self.captured = {}
+
+
+class ShippedNative:
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+def is_data(value):
+    if isinstance(value, lists.Slice) and not isinstance(value.items, tuple):
+        # Arrays only hold numbers
+        return True
+    elif isinstance(value, lists.List):
+        return all(map(is_data, value))
+    return isinstance(value, (int, float, str))
+
+
+def free_lookups(ast, bound, assigned, level=0):
+    '''The VarLookups in `ast` of names not in `bound`, how many lambdas in they
+    are, and whether a lambda assigns their name'''
+    if isinstance(ast, parser.VarLookup):
+        if ast.value not in bound:
+            yield ast, level, ast.value in assigned
+
+    elif isinstance(ast, parser.LambDef):
+        yield from free_lookups(
+            ast.body, bound | set(ast.args), assigned | set(assigned_names(ast.body)), level + 1)
+
+    else:
+        for child in children(ast):
+            yield from free_lookups(child, bound, assigned, level)
+
+
+def function_lambdef(function):
+    if function.body is None:
+        # Only VM functions have no AST of their own
+        return function.code.lambdef
+    return parser.LambDef(function.args, function.body)
+
+
+def captured(function, lambdef):
+    '''The values of the variables `function` uses from outer scopes, by name'''
+    lookups = free_lookups(lambdef.body, set(lambdef.args), set(assigned_names(lambdef.body)))
+
+    for ast, level, assigned in lookups:
+        try:
+            value = outer_value(function, ast, level)
+        except Exception:
+            # Assigned names only read outer ones before they're assigned,
+            # which needn't be defined
+            if assigned:
+                continue
+            raise
+
+        if value is not UNSET:
+            yield ast.value, value
+
+
+def outer_value(function, ast, level):
+    '''The value `ast`, `level` lambdas into `function`, finds outside of it'''
+    if function.code is None:
+        # Interpreted, env is a chain of Envs
+        return function.env.lookup(ast.value)
+
+    # Compiled, env is the frame the function was created in: find the one
+    # the name was resolved to from where it's used
+    for depth, slot in ((ast.depth, ast.slot),) + ast.fallbacks:
+        if depth <= level:
+            continue
+
+        env = function.env
+        for _ in range(depth - level - 1):
+            env = env.parent
+
+        if slot is None:
+            return env.lookup(ast.value)
+        elif env[slot] is not UNSET:
+            return env[slot]
+
+    return UNSET
+
+
+def ship(value, shipped, name):
+    '''What to pickle of `value`, found at variable `name`'''
+    if isinstance(value, MemoizedFunction):
+        value = value.function
+
+    if isinstance(value, Function):
+        if id(value) not in shipped:
+            lambdef = function_lambdef(value)
+            result = shipped[id(value)] = Shipped(lambdef)
+            for captured_name, captured_value in captured(value, lambdef):
+                if captured_name not in result.captured:
+                    result.captured[captured_name] = ship(captured_value, shipped, captured_name)
+        return shipped[id(value)]
+
+    elif isinstance(value, NativeFunction):
+        if value.name not in PURE_NATIVES:
+            raise ImpureFunction('pmap can\'t run functions using {}'.format(name))
+        return ShippedNative(value.name)
+
+    elif not is_data(value):
+        raise ImpureFunction('pmap can\'t ship {}, the value of {}'.format(value, name))
+
+    return value
+
+
+# In workers
+
+
+@functools.lru_cache(maxsize=16)
+def load(mode, payload):
+    '''The function shipped in `payload`, created in `mode`'''
+    # The interpreter imports this module
+    from compiler_studies.no_loop import interpreter
+
+    builtins = Env(
+        **lists.builtins(),
+        **bulk.builtins(interpreter.CALLS[mode]),
+        **profiler.passthrough_natives()
+    )
+    functions = {}
+
+    def rebuild(value):
+        if isinstance(value, ShippedNative):
+            return builtins[value.name]
+        elif not isinstance(value, Shipped):
+            return value
+        elif id(value) in functions:
+            return functions[id(value)]
+
+        env = Env(parent=builtins)
+        program = parser.Stmts([parser.Return(value.lambdef)])
+        function = functions[id(value)] = interpreter.run(program, env, mode)
+
+        # After creating the function, since it may use itself
+        for name, captured_value in value.captured.items():
+            env[name] = rebuild(captured_value)
+        return function
+
+    return rebuild(pickle.loads(payload))
+
+
+def run_chunk(mode, payload, chunk):
+    from compiler_studies.no_loop import interpreter
+
+    function = bulk.python_function(load(mode, payload), interpreter.CALLS[mode], 1)
+    results = list(map(function, chunk))
+
+    for result in results:
+        if not is_data(result):
+            raise ImpureFunction('pmap can\'t return {} from a worker'.format(result))
+    return results
+
+
+def executor():
+    global EXECUTOR
+    if EXECUTOR is None:
+        EXECUTOR = concurrent.futures.ProcessPoolExecutor(WORKERS)
+    return EXECUTOR
+
+
+def builtins(mode):
+    '''The pmap native, for programs run in `mode`'''
+
+    def pmap(function, lst, chunksize=None):
+        lists.check_list(lst, 'pmap')
+        values = bulk.items(lst)
+        if not is_data(lst):
+            raise ImpureFunction('pmap can only ship numbers, strings and lists of them')
+
+        payload = pickle.dumps(ship(function, {}, 'the function'))
+
+        if chunksize is None:
+            # A few chunks per worker, so that they finish together
+            chunksize = max(1, -(-len(values) // (4 * WORKERS)))
+        if type(chunksize) is not int or chunksize < 1:
+            raise Exception('pmap expects a positive chunk size, got {}'.format(chunksize))
+
+        chunks = [values[i:i + chunksize] for i in range(0, len(values), chunksize)]
+        if multiprocessing.current_process().daemon:
+            run_chunks = map
+        else:
+            run_chunks = executor().map
+
+        results = []
+        for chunk_results in run_chunks(run_chunk, [mode] * len(chunks), [payload] * len(chunks), chunks):
+            results.extend(chunk_results)
+
+        return bulk.pack(results)
+
+    return {'pmap': NativeFunction('pmap', pmap)}
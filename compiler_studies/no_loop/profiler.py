@@ -0,0 +1,323 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop.optimizer import children
+from compiler_studies.no_loop.runtime import NativeFunction
+
+
+# Profiling No-Loop functions
+#
+# Rather than hooking into every execution mode, `Profiler.instrument`
+# rewrites the LambDefs of a program so that they report their own calls:
+#
+#   \(n) {                      \(n) {
+#     if n <= 1 {                 @depth = @enter(<function id>)
+#       return n                  if n <= 1 {
+#     } else {          ==>         return @exit(@depth, n)
+#       return f(n - 1)           } else {
+#     }                             @depth0 = n - 1
+#   }                               @exit(@depth)
+#                                   return f(@depth0)
+#                                 }
+#                               }
+#
+# Tail calls report returning before the call, so they stay tail calls, and
+# after computing their arguments, which are the caller's work.
+# Names starting with @ can't be written in No-Loop, so they don't clash with
+# the program's. Functions are identified by the name they're assigned to and
+# where they're defined.
+#
+# When tracing, every call is timed and the memory blocks it allocated (net
+# of those freed) counted. When sampling, calls only push and pop the stack,
+# and a thread counts which function is running every `interval` seconds.
+
+ENTER = '@enter'
+EXIT = '@exit'
+DEPTH = '@depth'
+
+
+class CallNode:
+    '''A function, called from the path of CallNodes above it'''
+
+    __slots__ = ('function', 'parent', 'children', 'calls', 'time', 'blocks', 'samples')
+
+    def __init__(self, function, parent=None):
+        self.function = function
+        self.parent = parent
+        self.children = {}
+        self.calls = 0
+        self.time = 0.0
+        self.blocks = 0
+        self.samples = 0
+
+
+class Profiler:
+    def __init__(self, sampling=False, interval=0.001):
+        self.sampling = sampling
+        self.interval = interval
+
+        # Name, source file and position of every function, by id
+        self.functions = [('<program>', None, None)]
+        self.root = CallNode(0)
+
+        # Records of the calls in progress, innermost last: their CallNode,
+        # and when tracing, when they started, the time spent in the calls
+        # they made, and the same for allocated blocks
+        self.stack = []
+        self.active = collections.Counter()
+        self.inclusive = collections.Counter()
+
+        self.sampler = None
+        self.started = None
+        self.elapsed = None
+
+    # Instrumenting
+
+    def instrument(self, ast, source_file):
+        '''Makes the functions in `ast` report their calls, returns `ast`'''
+        self.visit(ast, source_file, None)
+        return ast
+
+    def visit(self, ast, source_file, name):
+        if isinstance(ast, parser.ASTNode) and ast.type == '=':
+            left, right = ast.children
+            if isinstance(left, parser.VarLookup) and isinstance(right, parser.LambDef):
+                self.visit(right, source_file, left.value)
+                return
+
+        if isinstance(ast, parser.LambDef):
+            function = len(self.functions)
+            self.functions.append((name or '<lambda>', source_file, ast.position))
+
+            self.visit(ast.body, source_file, None)
+            report_calls(ast, ENTER, EXIT, DEPTH, function, hoist=True)
+            return
+
+        for child in children(ast):
+            self.visit(child, source_file, None)
+
+    def natives(self):
+        return {
+            ENTER: NativeFunction(ENTER, self.enter),
+            EXIT: NativeFunction(EXIT, self.exit),
+        }
+
+    # Running
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.active[self.root.function] += 1
+        self.stack.append([self.root, self.started, 0.0, sys.getallocatedblocks(), 0])
+
+        if self.sampling:
+            # Or the sampler only gets to run every 5ms
+            self.switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(min(self.switch_interval, self.interval))
+
+            self.sampler = threading.Thread(target=self.sample, daemon=True)
+            self.sampler.start()
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+
+        # Calls interrupted by an error, if any, then the program
+        while self.stack:
+            self.pop()
+
+        if self.sampler is not None:
+            self.sampler.join()
+            sys.setswitchinterval(self.switch_interval)
+
+    def sample(self):
+        while self.stack:
+            time.sleep(self.interval)
+            try:
+                self.stack[-1][0].samples += 1
+            except IndexError:
+                pass
+
+    def enter(self, function):
+        stack = self.stack
+        parent = stack[-1][0]
+        node = parent.children.get(function)
+        if node is None:
+            node = parent.children[function] = CallNode(function, parent)
+        node.calls += 1
+
+        if self.sampling:
+            stack.append([node])
+        else:
+            self.active[function] += 1
+            stack.append([node, time.perf_counter(), 0.0, sys.getallocatedblocks(), 0])
+
+        return len(stack)
+
+    def exit(self, depth, *value):
+        # Returning None carries on after the if-else block, so the call
+        # isn't over
+        if value and value[0] is None:
+            return None
+
+        while len(self.stack) >= depth:
+            self.pop()
+
+        return value[0] if value else 0
+
+    def pop(self):
+        record = self.stack.pop()
+        if self.sampling:
+            return
+
+        node, start, child_time, start_blocks, child_blocks = record
+        elapsed = time.perf_counter() - start
+        blocks = sys.getallocatedblocks() - start_blocks
+
+        node.time += elapsed - child_time
+        node.blocks += blocks - child_blocks
+
+        # Recursive calls are only counted once in the inclusive time
+        self.active[node.function] -= 1
+        if not self.active[node.function]:
+            self.inclusive[node.function] += elapsed
+
+        if self.stack:
+            parent = self.stack[-1]
+            parent[2] += elapsed
+            parent[4] += blocks
+
+    # Reporting
+
+    def label(self, function):
+        name, source_file, position = self.functions[function]
+        if position is None:
+            return name
+        return '{} ({}:{}:{})'.format(name, os.path.basename(source_file), *position)
+
+    def nodes(self):
+        '''Every CallNode, with the functions on the path to it, outermost first'''
+        pending = [(self.root, ())]
+        while pending:
+            node, path = pending.pop()
+            path = path + (node.function,)
+            yield node, path
+            pending.extend((child, path) for child in node.children.values())
+
+    def stats(self):
+        '''Calls, inclusive and exclusive seconds and blocks, by function'''
+        stats = collections.defaultdict(lambda: [0, 0.0, 0.0, 0])
+
+        for node, path in self.nodes():
+            function_stats = stats[node.function]
+            function_stats[0] += node.calls
+            if self.sampling:
+                seconds = node.samples * self.interval
+                function_stats[2] += seconds
+                for function in set(path):
+                    stats[function][1] += seconds
+            else:
+                function_stats[2] += node.time
+                function_stats[3] += node.blocks
+
+        if not self.sampling:
+            for function, seconds in self.inclusive.items():
+                stats[function][1] = seconds
+
+        return stats
+
+    def report(self, file=None):
+        print('Profile of {:.3f}s, {}'.format(
+            self.elapsed, 'sampled every {:g}ms'.format(self.interval * 1000)
+            if self.sampling else 'traced'), file=file)
+        print('{:>10} {:>10} {:>10} {:>10}  {}'.format(
+            'calls', 'total (s)', 'self (s)', 'blocks', 'function'), file=file)
+
+        stats = self.stats()
+        for function in sorted(stats, key=lambda function: -stats[function][2]):
+            calls, inclusive, exclusive, blocks = stats[function]
+            print('{:>10} {:>10.3f} {:>10.3f} {:>10}  {}'.format(
+                calls, inclusive, exclusive, '-' if self.sampling else blocks,
+                self.label(function)), file=file)
+
+    def collapsed(self, file=None):
+        '''Writes the call stacks as collapsed stacks, as flamegraph.pl reads them
+
+        Weighted by microseconds when tracing, by samples when sampling.
+        '''
+        for node, path in self.nodes():
+            weight = node.samples if self.sampling else round(node.time * 1e6)
+            if weight:
+                print('{} {}'.format(';'.join(map(self.label, path)), weight), file=file)
+
+
+def report_calls(lambdef, enter, exit, depth, argument, hoist=False):
+    '''Makes the body of `lambdef` start with `depth = enter(argument)`, and
+    report returning with `exit(depth, value)`, or `exit(depth)` before a
+    tail call (after computing its function and arguments, with `hoist`)'''
+    entering = parser.ASTNode('=', [
+        parser.VarLookup(depth),
+        parser.FunCall(parser.VarLookup(enter), [parser.Const(argument)])])
+    lambdef.body = parser.Stmts(
+        [entering] + reporting_returns(lambdef.body.stmts, exit, depth, hoist))
+
+
+def is_tail_call(stmt):
+    # Calls to instrumenting natives, as made by returns which already
+    # report, aren't: the value they wrap still has to be computed
+    return (isinstance(stmt.expr, parser.FunCall) and not (
+        isinstance(stmt.expr.expr, parser.VarLookup) and stmt.expr.expr.value.startswith('@')))
+
+
+def reporting_returns(stmts, exit=EXIT, depth=DEPTH, hoist=False):
+    '''`stmts` reporting returning with `exit`'''
+    reporting = []
+
+    for stmt in stmts:
+        if isinstance(stmt, parser.Return) and is_tail_call(stmt):
+            if hoist:
+                reporting.extend(hoist_operands(stmt.expr, depth))
+
+            # Before the call, so that it's still a tail call
+            reporting.append(parser.FunCall(parser.VarLookup(exit), [parser.VarLookup(depth)]))
+            reporting.append(stmt)
+
+        elif isinstance(stmt, parser.Return):
+            reporting.append(parser.Return(parser.FunCall(
+                parser.VarLookup(exit), [parser.VarLookup(depth), stmt.expr])))
+
+        elif isinstance(stmt, parser.IfElse):
+            stmt.cons = parser.Stmts(reporting_returns(stmt.cons.stmts, exit, depth, hoist))
+            stmt.alt = parser.Stmts(reporting_returns(stmt.alt.stmts, exit, depth, hoist))
+            reporting.append(stmt)
+
+        else:
+            reporting.append(stmt)
+
+    return reporting
+
+
+def hoist_operands(call, depth):
+    '''Assignments computing the function and arguments of `call` which aren't
+    simple values into variables, which `call` is changed to use instead'''
+    operands = [call.expr] + call.args
+    hoisted = []
+
+    for i, operand in enumerate(operands):
+        if isinstance(operand, (parser.ASTNode, parser.FunCall)):
+            name = '{}{}'.format(depth, i)
+            hoisted.append(parser.ASTNode('=', [parser.VarLookup(name), operand]))
+            operands[i] = parser.VarLookup(name)
+
+    call.expr, call.args = operands[0], operands[1:]
+    return hoisted
+
+
+def passthrough_natives():
+    '''ENTER and EXIT, not reporting anything, for instrumented functions run elsewhere'''
+    return {
+        ENTER: NativeFunction(ENTER, lambda function: 0),
+        EXIT: NativeFunction(EXIT, lambda depth, *value: value[0] if value else 0),
+    }
@@ -0,0 +1,92 @@
+from compiler_studies.no_loop import ast_parser as parser
+
+
+# Resolves every variable to a (depth, slot) pair at compile time, so that
+# compiled code can find it in O(1) instead of walking a chain of dicts.
+#
+# Every LambDef opens a scope holding its arguments, followed by every name
+# assigned in its body (if-else branches included, nested lambdas excluded).
+# A name used inside a function is looked up in the innermost enclosing
+# scope that declares it: `depth` is how many frames up that scope is and
+# `slot` is the position of the name in it. Names no function declares are
+# globals: their `slot` is None and they are looked up by name in the
+# global env, found `depth` frames up.
+#
+# Assigned names start out unset, and until they're assigned reading them
+# reads the name they shadow, as in the tree-walking interpreter: the next
+# scopes out declaring it (up to the first which has it as an argument, so
+# is always set) or the globals are the lookup's `fallbacks`.
+
+
+class Scope:
+    def __init__(self, args, body):
+        self.names = list(args)
+        self.nargs = len(self.names)
+
+        for name in assigned_names(body):
+            if name not in self.names:
+                self.names.append(name)
+
+        self.slots = {name: slot for (slot, name) in enumerate(self.names)}
+
+
+def assigned_names(stmts):
+    for stmt in stmts.stmts:
+        if isinstance(stmt, parser.ASTNode) and stmt.type == '=':
+            left, _ = stmt.children
+            if isinstance(left, parser.VarLookup):
+                yield left.value
+
+        elif isinstance(stmt, parser.IfElse):
+            yield from assigned_names(stmt.cons)
+            yield from assigned_names(stmt.alt)
+
+
+def resolve(ast, scopes=None):
+    scopes = scopes or []
+
+    if isinstance(ast, parser.Stmts):
+        for stmt in ast.stmts:
+            resolve(stmt, scopes)
+
+    elif isinstance(ast, parser.ASTNode):
+        for child in ast.children:
+            resolve(child, scopes)
+
+    elif isinstance(ast, parser.VarLookup):
+        resolve_name(ast, scopes)
+
+    elif isinstance(ast, parser.Return):
+        resolve(ast.expr, scopes)
+
+    elif isinstance(ast, parser.IfElse):
+        resolve(ast.cond, scopes)
+        resolve(ast.cons, scopes)
+        resolve(ast.alt, scopes)
+
+    elif isinstance(ast, parser.FunCall):
+        resolve(ast.expr, scopes)
+        for arg in ast.args:
+            resolve(arg, scopes)
+
+    elif isinstance(ast, parser.LambDef):
+        scope = Scope(ast.args, ast.body)
+        ast.nslots = len(scope.names)
+        resolve(ast.body, scopes + [scope])
+
+    return ast
+
+
+def resolve_name(ast, scopes):
+    found = []
+    for depth, scope in enumerate(reversed(scopes)):
+        slot = scope.slots.get(ast.value)
+        if slot is not None:
+            found.append((depth, slot))
+            if slot < scope.nargs:
+                break
+    else:
+        found.append((len(scopes), None))
+
+    (ast.depth, ast.slot), *fallbacks = found
+    ast.fallbacks = tuple(fallbacks)
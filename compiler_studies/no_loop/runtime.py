@@ -0,0 +1,53 @@
+# Values and environments shared by the tree-walking interpreter, the
+# closure compiler and the bytecode VM
+
+
+class Function:
+    def __init__(self, args, body, env, code=None):
+        self.args = args
+        self.body = body
+        self.env = env
+
+        # Compiled body, set when the function is created by a compiled
+        # (rather than eval'd) LambDef
+        self.code = code
+
+    def __repr__(self):
+        return '<Function>'
+
+
+class NativeFunction:
+    def __init__(self, name, callable):
+        self.name = name
+        self.callable = callable
+
+
+class Env(dict):
+    def __init__(self, parent=None, **kwargs):
+        super().__init__(**kwargs)
+        self.parent = parent
+
+    def lookup(self, name):
+        if name in self:
+            return self[name]
+        elif self.parent is not None:
+            return self.parent.lookup(name)
+        else:
+            raise Exception('{} is not defined'.format(name))
+
+    def __repr__(self):
+        has_parent = 'Yes' if self.parent is not None else 'No'
+        return '<Env has_parent={} {}>'.format(has_parent, super().__repr__())
+
+
+class Frame(list):
+    '''The variables of a compiled function call, indexed by slot'''
+
+    __slots__ = ('parent',)
+
+    def __repr__(self):
+        return '<Frame {}>'.format(super().__repr__())
+
+
+# Value of the local variables that haven't been assigned yet
+UNSET = object()
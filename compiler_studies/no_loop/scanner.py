@@ -1,3 +1,5 @@
+import array
+import re
 
 KEYWORDS = {
     'if',
@@ -12,13 +14,46 @@ OPERATORS = {
 
 
 class MalformedInput(Exception):
-    pass
+    def __init__(self, message, line=None, col=None):
+        if line is not None:
+            message = '{} at line {}, column {}'.format(message, line, col)
+
+        super().__init__(message)
+        self.line = line
+        self.col = col
+
+
+def position(program, pos, line=1, col=1):
+    '''Line and column of `pos` in `program`, which starts at `line`, `col`'''
+    newlines = program.count('\n', 0, pos)
+    if newlines:
+        return line + newlines, pos - program.rfind('\n', 0, pos)
+    return line, col + pos
 
 
 class Lexeme:
-    def __init__(self, type, value):
+    __slots__ = ('type', 'cached', 'lexemes', 'start', 'end')
+
+    def __init__(self, type, value=None, lexemes=None, start=None, end=None):
         self.type = type
-        self.value = value
+
+        # Without a value, it's sliced out of `lexemes.source` when needed
+        self.cached = value
+        self.lexemes = lexemes
+        self.start = start
+        self.end = end
+
+    @property
+    def value(self):
+        if self.cached is None:
+            self.cached = self.lexemes.source[self.start:self.end]
+        return self.cached
+
+    def position(self):
+        '''Line and column of the lexeme, if we know where it came from'''
+        if self.lexemes is None:
+            return None
+        return self.lexemes.position(self.start)
 
     def __repr__(self):
         return '<Lexeme {} {}>'.format(self.type, self.value)
@@ -59,32 +94,31 @@ def scanner(type, terminator=None):
                 if terminator is not None and terminator(program[end_pos-1]):
                     break
 
+            value = program[pos:end_pos]
+
             if type == 'operator':
-                return end_pos, Lexeme(program[pos:end_pos], program[pos:end_pos])
+                return end_pos, Lexeme(value, value)
             else:
-                return end_pos, Lexeme(type, program[pos:end_pos])
+                return end_pos, Lexeme(type, value)
         return inner
     return decorator
 
 
-def guarded_scanner(type, start_guard, end_guard):
+def guarded_scanner(type, start_guard, end_guard, required=True):
     def decorator(f):
         def inner(program, pos):
-            end_pos = pos
-
-            if program[end_pos:end_pos+len(start_guard)] != start_guard:
-                raise MalformedInput('Malformed as pos {}. Expected {}, found {}'.format(
-                    pos, start_guard, program[end_pos:end_pos+len(start_guard)]))
-
-            end_pos += len(start_guard)
+            if not program.startswith(start_guard, pos):
+                raise MalformedInput('Expected {}, found {}'.format(
+                    start_guard, program[pos:pos+len(start_guard)]), *position(program, pos))
 
-            while True:
-                if program[end_pos:end_pos+len(end_guard)] != end_guard:
-                    end_pos += 1
+            end_pos = program.find(end_guard, pos + len(start_guard))
 
-                else:
-                    end_pos += len(end_guard)
-                    break
+            if end_pos != -1:
+                end_pos += len(end_guard)
+            elif required:
+                raise MalformedInput('Unterminated {}'.format(type), *position(program, pos))
+            else:
+                end_pos = len(program)
 
             return end_pos, Lexeme(type, program[pos:end_pos])
         return inner
@@ -103,13 +137,18 @@ def scan_single_quote_string():
 def scan_multiline_comment():
     pass
 
+# The last line of a program might not have a newline
+@guarded_scanner('comment', '//', '\n', required=False)
+def scan_single_line_comment_with_newline():
+    pass
+
 def scan_single_line_comment(program, pos):
-    @guarded_scanner('comment', '//', '\n')
-    def inner():
-        pass
+    end_pos, lexeme = scan_single_line_comment_with_newline(program, pos)
+
+    if lexeme.value.endswith('\n'):
+        lexeme.cached = lexeme.value[:-1]
 
-    end_pos, lexeme = inner(program, pos)
-    return end_pos, Lexeme(lexeme.type, lexeme.value[:-1])
+    return end_pos, lexeme
 
 @scanner('num')
 def scan_number(token):
@@ -128,7 +167,8 @@ def scan_operator(token):
     return is_operator(token)
 
 
-def scan(program):
+def scan_by_char(program):
+    '''Reference scanner, dispatching on every character'''
 
     lexemes = []
 
@@ -176,11 +216,200 @@ def scan(program):
             lexemes.append(lexeme)
 
         else:
-            raise MalformedInput('Invalid token: {}'.format(token))
+            raise MalformedInput('Invalid token: {}'.format(token), *position(program, pos))
 
     return lexemes
 
 
+# Single pass scanner
+#
+# All the lexemes are matched by a single regular expression, with one
+# group per kind of lexeme. Whitespace is skipped as part of the match of
+# the lexeme that follows it, and every other character matches one of the
+# alternatives (`invalid` catches the rest), so nothing else is skipped.
+#
+# The most common lexemes are tried first. Other than keywords coming
+# before names, only the order of the alternatives starting with `/`, `"`
+# and `'` matters, and it's the same one `scan_by_char` tries its
+# predicates in.
+
+TOKEN_REGEX = re.compile(r'''
+    [ \n\t]*
+    (?:
+        ({keywords})(?![a-z0-9_])   # keyword
+      | ([a-z][a-z0-9_]*)           # name
+      | ([\\,(){{}}\[\]])             # punctuation
+      | ([0-9]+)                    # num
+      | (/\*.*?\*/)                 # comment
+      | (//[^\n]*)\n?               # single line comment
+      | ("[^"]*"|'[^']*')           # string
+      | (/\*|"|')                   # unterminated comment or string
+      | ([{operators}]+)    # operator
+      | ([^ \n\t])                  # invalid
+    )
+'''.format(
+    keywords='|'.join(sorted(k for k in KEYWORDS if k.isalpha())),
+    operators=''.join(re.escape(op) for op in sorted(OPERATORS)),
+), re.VERBOSE | re.DOTALL)
+
+# The group matched by each kind of lexeme
+(KEYWORD, NAME, PUNCTUATION, NUM, COMMENT, LINE_COMMENT, STRING, UNTERMINATED, OPERATOR,
+ INVALID) = range(1, 11)
+
+
+# Type codes for all but operators and punctuation, which get theirs as they
+# are found
+LEXEME_TYPES = ['name', 'keyword', 'num', 'string', 'comment']
+NAME_TYPE, KEYWORD_TYPE, NUM_TYPE, STRING_TYPE, COMMENT_TYPE = range(len(LEXEME_TYPES))
+
+# The type code of the lexemes matched by each group of TOKEN_REGEX, if
+# it doesn't depend on their value
+KIND_TYPES = [None] * (INVALID + 1)
+KIND_TYPES[KEYWORD] = KEYWORD_TYPE
+KIND_TYPES[NAME] = NAME_TYPE
+KIND_TYPES[NUM] = NUM_TYPE
+KIND_TYPES[STRING] = STRING_TYPE
+KIND_TYPES[COMMENT] = KIND_TYPES[LINE_COMMENT] = COMMENT_TYPE
+
+
+class Lexemes:
+    '''The lexemes in `source`, which starts at `line`, `col` in the program
+
+    Rather than as Lexeme objects, they are stored as parallel arrays of type
+    codes and offsets into `source`, and only turned into Lexemes when read.
+    '''
+
+    def __init__(self, source, line=1, col=1):
+        self.source = source
+        self.line = line
+        self.col = col
+
+        self.types = list(LEXEME_TYPES)
+        self.type_codes = {type: code for (code, type) in enumerate(self.types)}
+
+        self.codes = array.array('I')
+        self.starts = array.array('q')
+        self.ends = array.array('q')
+
+        # The last position asked for, and its line and column
+        self.last = (0, line, col)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return Lexeme(self.types[self.codes[i]], None, self, self.starts[i], self.ends[i])
+
+    def __iter__(self):
+        types = self.types
+        for (code, start, end) in zip(self.codes, self.starts, self.ends):
+            type = types[code]
+
+            # Operators and punctuation are their own value
+            if code > COMMENT_TYPE:
+                yield Lexeme(type, type, self, start, end)
+            else:
+                yield Lexeme(type, None, self, start, end)
+
+    def position(self, pos):
+        # Positions are mostly asked for in order, as the parser goes, so
+        # only count the lines since the last one
+        last, line, col = self.last
+        if pos < last:
+            last, line, col = 0, self.line, self.col
+
+        newlines = self.source.count('\n', last, pos)
+        if newlines:
+            line, col = line + newlines, pos - self.source.rfind('\n', last, pos)
+        else:
+            col += pos - last
+
+        self.last = (pos, line, col)
+        return line, col
+
+
+def lex(lexemes, final=True):
+    '''Stores the lexemes in `lexemes.source` in `lexemes`
+
+    Unless the source is the `final` part of the program, stops at the first
+    lexeme which might carry on past its end. Returns where it stopped.
+    '''
+    source = lexemes.source
+    size = len(source)
+
+    types = lexemes.types
+    type_codes = lexemes.type_codes
+    add_code = lexemes.codes.append
+    add_start = lexemes.starts.append
+    add_end = lexemes.ends.append
+
+    for match in TOKEN_REGEX.finditer(source):
+        kind = match.lastindex
+        start, end = match.span(kind)
+
+        if not final and (match.end() == size or kind == UNTERMINATED):
+            return match.start()
+
+        code = KIND_TYPES[kind]
+
+        if code is not None:
+            add_code(code)
+
+        elif kind == PUNCTUATION or kind == OPERATOR:
+            value = source[start:end]
+            code = type_codes.get(value)
+
+            if code is None:
+                code = type_codes[value] = len(types)
+                types.append(value)
+
+            add_code(code)
+
+        elif kind == UNTERMINATED:
+            raise MalformedInput(
+                'Unterminated {}'.format('comment' if source[start:end] == '/*' else 'string'),
+                *lexemes.position(start))
+
+        else:
+            raise MalformedInput(
+                'Invalid token: {}'.format(source[start:end]), *lexemes.position(start))
+
+        add_start(start)
+        add_end(end)
+
+    # Only whitespace left
+    return size
+
+
+def scan(program):
+    lexemes = Lexemes(program)
+    lex(lexemes)
+    return lexemes
+
+
+def scan_iter(f, chunk_size=64 * 1024):
+    '''Lazily scans the program in file object `f`, reading it in chunks'''
+    buf = ''
+    line, col = 1, 1
+
+    while True:
+        # Read at least as much as we're holding on to, so that lexemes
+        # spanning many chunks (like long comments) aren't rescanned over
+        # and over again
+        chunk = f.read(max(chunk_size, len(buf)))
+        buf += chunk
+
+        lexemes = Lexemes(buf, line, col)
+        pos = lex(lexemes, final=not chunk)
+        yield from lexemes
+
+        if not chunk:
+            return
+
+        line, col = lexemes.position(pos)
+        buf = buf[pos:]
+
+
 def test():
     program = '''
     my_n = 5/2
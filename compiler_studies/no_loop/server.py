@@ -0,0 +1,227 @@
+import concurrent.futures
+import functools
+import json
+import os
+import queue
+import signal
+import socketserver
+import sys
+import threading
+import time
+
+from compiler_studies.no_loop import batch
+from compiler_studies.no_loop import interpreter
+
+
+# Evaluation server
+#
+#   python -m compiler_studies.no_loop.server [--socket PATH] [--jobs N] ...
+#
+# Running a program from the command line pays for starting Python and
+# importing the interpreter every time. The server does that once, then
+# forks a pool of workers which run the programs it's sent, each in globals
+# (and modules) of its own, as `--jobs` runs files.
+#
+# Requests and responses are JSON objects, one per line, on stdin and stdout
+# or on the connections to a Unix socket:
+#
+#   {"id": 1, "source": "print(1 + 2)"}
+#   {"id": 2, "path": "examples/fib.nl"}
+#
+#   {"id": 1, "status": "ok", "stdout": "3\n", "stderr": "", "value": null,
+#    "error": null, "elapsed": 0.0008}
+#
+# Requests are run concurrently, so responses may come out of order: `id`,
+# which can be anything, is sent back as is. Imports in sources are relative
+# to the directory the server runs in. The interpreter's options apply to
+# every request, and --timeout to each one: a worker which doesn't finish in
+# time is killed and replaced, like one which crashes.
+#
+# test() sends a few requests to a pool of its own:
+#
+#   python -c 'from compiler_studies.no_loop import server; server.test()'
+
+# Program text given in requests runs as if it were in this file
+SOURCE_FILE = '<request>'
+
+
+def run_request(request, args):
+    '''Runs the program `request` holds, in a worker'''
+    if 'source' in request:
+        return interpreter.run_isolated(SOURCE_FILE, args, request['source'])
+    return interpreter.run_isolated(request['path'], args)
+
+
+class Pool:
+    '''Workers waiting for requests, which run one at a time'''
+
+    def __init__(self, args, size, timeout=None):
+        self.run = functools.partial(run_request, args=args)
+        self.timeout = timeout
+        self.idle = queue.Queue()
+        self.workers = []
+
+        for _ in range(size):
+            self.release(batch.Worker(self.run))
+
+    def release(self, worker):
+        self.workers.append(worker)
+        self.idle.put(worker)
+
+    def submit(self, request):
+        '''Runs `request` on the first idle worker, returning the response'''
+        worker = self.idle.get()
+        self.workers.remove(worker)
+
+        status, stdout, stderr, value, error = batch.CRASHED, '', '', None, None
+        try:
+            worker.send(None, request)
+            if worker.conn.poll(self.timeout):
+                status, stdout, stderr, value, error = worker.conn.recv()
+            else:
+                worker.kill()
+                status, error = batch.TIMED_OUT, 'Timed out after {}s'.format(self.timeout)
+        except (EOFError, OSError):
+            worker.kill()
+            error = 'Worker exited with code {}'.format(worker.process.exitcode)
+        finally:
+            elapsed = time.perf_counter() - worker.started
+            self.release(worker if worker.process.is_alive() else batch.Worker(self.run))
+
+        return {
+            'id': request.get('id'),
+            'status': status,
+            'stdout': stdout,
+            'stderr': stderr,
+            'value': value,
+            'error': error,
+            'elapsed': elapsed,
+        }
+
+    def close(self):
+        while self.workers:
+            self.workers.pop().stop()
+
+
+def respond(pool, line):
+    '''The response to the request on `line`, as a line'''
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict) or not isinstance(
+                request.get('source', request.get('path')), str):
+            raise ValueError('expected an object with a source or a path')
+    except ValueError as e:
+        response = {'id': None, 'status': batch.FAILED, 'error': 'Invalid request: {}'.format(e)}
+    else:
+        response = pool.submit(request)
+
+    return json.dumps(response) + '\n'
+
+
+def serve_stdio(pool, jobs):
+    '''Answers the requests on stdin until it's closed'''
+    lock = threading.Lock()
+
+    def answer(line):
+        response = respond(pool, line)
+        with lock:
+            sys.stdout.write(response)
+            sys.stdout.flush()
+
+    # One thread per worker, so that requests wait in the pool's queue
+    # rather than in the pipe
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        for line in sys.stdin:
+            if line.strip():
+                executor.submit(answer, line)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # Each connection sends a request after the other
+        for line in self.rfile:
+            if line.strip():
+                self.wfile.write(respond(self.server.pool, line).encode())
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_socket(pool, path):
+    '''Answers the requests on connections to the Unix socket at `path`'''
+    if os.path.exists(path):
+        os.remove(path)
+
+    # Stopping cleanly on SIGTERM too, so that the socket gets removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    with Server(path, Handler) as server:
+        server.pool = pool
+        print('Listening on {}'.format(path), file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(path)
+
+
+def parse_args():
+    argsparser = interpreter.make_argsparser(
+        description='Runs the No-Loop programs it\'s sent on a pool of warm processes')
+    argsparser.add_argument(
+        '--socket', metavar='PATH',
+        help='listen on a Unix socket at PATH, instead of reading stdin')
+    args = argsparser.parse_args()
+
+    if args.jobs is None:
+        args.jobs = os.cpu_count() or 1
+    if args.jobs < 1:
+        argsparser.error('need at least one job, got {}'.format(args.jobs))
+    return args
+
+
+def main():
+    args = parse_args()
+
+    pool = Pool(args, args.jobs, args.timeout)
+    try:
+        if args.socket is None:
+            serve_stdio(pool, args.jobs)
+        else:
+            serve_socket(pool, args.socket)
+    finally:
+        pool.close()
+
+
+def test():
+    '''Sends requests to a pool of two workers, checking their responses'''
+    args = interpreter.make_argsparser().parse_args(['--no-cache'])
+
+    requests = [
+        # Request and the status and stdout it gets
+        ('{"id": 1, "source": "print(1 + 2)"}', batch.OK, '3\n'),
+        ('{"id": 2, "source": "print(pmap(\\\\(x) { return x * 2 }, list(1, 2, 3), 1))"}',
+         batch.OK, '[2, 4, 6]\n'),
+        ('{"id": 3, "source": "print(sum(pmap(\\\\(x) { return x * x }, range(0, 100), 7)))"}',
+         batch.OK, '328350\n'),
+        ('{"id": 4, "source": "print(1 / 0)"}', batch.FAILED, ''),
+        ('{"id": 5, "source": "f = \\\\(n) { return f(n + 1) } f(0)"}', batch.TIMED_OUT, ''),
+        ('[1]', batch.FAILED, None),
+    ]
+
+    pool = Pool(args, 2, timeout=5)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(len(requests)) as executor:
+            responses = list(executor.map(lambda request: json.loads(respond(pool, request[0])), requests))
+    finally:
+        pool.close()
+
+    for (request, status, stdout), response in zip(requests, responses):
+        assert (response['status'], response.get('stdout')) == (status, stdout), (request, response)
+        print('ok {:<10} {}'.format(response['status'], request))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+from compiler_studies.no_loop import ast_parser as parser
+from compiler_studies.no_loop import memo
+from compiler_studies.no_loop.runtime import Env, Function, NativeFunction
+
+
+# A tree-walking evaluator with the same semantics as `interpreter.eval`,
+# but which never recurses in Python.
+#
+# Instead, what's left to do is kept in a heap-allocated stack of tasks
+# (a continuation stack): evaluating a node pushes the tasks for its
+# children, followed by the one that combines their values. Intermediate
+# values go on a separate value stack. Recursion depth in No-Loop is then
+# only limited by memory.
+
+# Tasks
+EVAL = 0            # evaluate `arg`, pushing its value
+DISCARD = 1         # pop the value of an expression statement
+NEXT_STMT = 2       # run statement `i` of `arg` = (stmts, i)
+IFELSE_STMT = 3     # an if-else block in `arg` = (stmts, i) is done
+BRANCH = 4          # pop a condition and evaluate one of if-else `arg`
+BINOP = 5           # pop two values and push the result of operator `arg`
+ASSIGN = 6          # assign the value on top of the stack to name `arg`
+APPLY = 7           # call a function with `arg` arguments
+CHECK_RETURN = 8    # fail if the function that just returned had no return
+
+OPERATORS = {
+    '+': lambda left, right: left + right,
+    '-': lambda left, right: left - right,
+    '*': lambda left, right: left * right,
+    '/': lambda left, right: left / right,
+    '==': lambda left, right: left == right,
+    '>=': lambda left, right: left >= right,
+    '<=': lambda left, right: left <= right,
+}
+
+
+def eval(ast, env):
+    return run([(EVAL, ast, env)], [])
+
+
+def run(tasks, values):
+    while tasks:
+        task, arg, env = tasks.pop()
+
+        if task == EVAL:
+            eval_node(arg, env, tasks, values)
+
+        elif task == NEXT_STMT:
+            stmts, i = arg
+            run_stmt(stmts, i, env, tasks, values)
+
+        elif task == IFELSE_STMT:
+            # We can return from a if-else block
+            if values[-1] is None:
+                values.pop()
+                stmts, i = arg
+                tasks.append((NEXT_STMT, (stmts, i + 1), env))
+
+        elif task == DISCARD:
+            values.pop()
+
+        elif task == BRANCH:
+            branch = arg.cons if values.pop() else arg.alt
+            tasks.append((EVAL, branch, env))
+
+        elif task == BINOP:
+            right = values.pop()
+            values[-1] = OPERATORS[arg](values[-1], right)
+
+        elif task == ASSIGN:
+            env[arg] = values[-1]
+
+        elif task == APPLY:
+            apply(arg, tasks, values)
+
+        elif task == CHECK_RETURN:
+            if values[-1] is None:
+                raise RuntimeError('Missing return statement')
+
+    return values.pop()
+
+
+def eval_node(ast, env, tasks, values):
+    if isinstance(ast, parser.Stmts):
+        tasks.append((NEXT_STMT, (ast.stmts, 0), env))
+
+    elif isinstance(ast, parser.ASTNode):
+        left, right = ast.children
+
+        if ast.type == '=':
+            tasks.append((ASSIGN, left.value, env))
+            tasks.append((EVAL, right, env))
+        else:
+            # Tasks run in reverse order: left, right and then the operator
+            tasks.append((BINOP, ast.type, env))
+            tasks.append((EVAL, right, env))
+            tasks.append((EVAL, left, env))
+
+    elif isinstance(ast, parser.VarLookup):
+        values.append(env.lookup(ast.value))
+
+    elif isinstance(ast, parser.Num):
+        values.append(int(ast.value))
+
+    elif isinstance(ast, (parser.String, parser.Const)):
+        values.append(ast.value)
+
+    elif isinstance(ast, parser.IfElse):
+        tasks.append((BRANCH, ast, env))
+        tasks.append((EVAL, ast.cond, env))
+
+    elif isinstance(ast, parser.LambDef):
+        if ast.memoize:
+            values.append(memo.memoized(Function(ast.args, ast.body, env), ast.memoize, call))
+        else:
+            values.append(Function(ast.args, ast.body, env))
+
+    elif isinstance(ast, parser.FunCall):
+        tasks.append((APPLY, len(ast.args), env))
+        for a in reversed(ast.args):
+            tasks.append((EVAL, a, env))
+        tasks.append((EVAL, ast.expr, env))
+
+    else:
+        values.append(None)
+
+
+def run_stmt(stmts, i, env, tasks, values):
+    if i == len(stmts):
+        values.append(None)
+        return
+
+    stmt = stmts[i]
+
+    # The value of the return expression is the value of the block
+    if isinstance(stmt, parser.Return):
+        tasks.append((EVAL, stmt.expr, env))
+
+    elif isinstance(stmt, parser.IfElse):
+        tasks.append((IFELSE_STMT, (stmts, i), env))
+        tasks.append((EVAL, stmt, env))
+
+    else:
+        tasks.append((NEXT_STMT, (stmts, i + 1), env))
+        tasks.append((DISCARD, None, env))
+        tasks.append((EVAL, stmt, env))
+
+
+def apply(nargs, tasks, values):
+    if nargs:
+        args = values[-nargs:]
+        del values[-nargs:]
+    else:
+        args = []
+
+    fun = values.pop()
+
+    if isinstance(fun, NativeFunction):
+        values.append(fun.callable(*args))
+        return
+
+    if len(fun.args) != nargs:
+        raise RuntimeError('Wrong number of arguments: expected {}, got {}'.format(
+            len(fun.args), nargs))
+
+    # Augment function environment with arguments
+    new_env = Env(fun.env, **{
+        name: value
+        for (name, value) in zip(fun.args, args)
+    })
+
+    # Tail calls run in constant space: the value of a function is never
+    # None, so the enclosing if-else blocks would just pass it on, and the
+    # check of the caller's return will do for this call too
+    while tasks and tasks[-1][0] == IFELSE_STMT:
+        tasks.pop()
+
+    if not tasks or tasks[-1][0] != CHECK_RETURN:
+        tasks.append((CHECK_RETURN, None, None))
+
+    tasks.append((EVAL, fun.body, new_env))
+
+
+def call(fun, args):
+    '''Calls `fun` on its own, as memoized functions do'''
+    tasks = []
+    values = [fun] + args
+    apply(len(args), tasks, values)
+    return run(tasks, values)
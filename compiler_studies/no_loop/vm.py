@@ -0,0 +1,291 @@
+from compiler_studies.no_loop.compiler import (
+    LOAD, LOAD_CHECKED, LOAD_DEREF, LOAD_GLOBAL, CONST, STORE, STORE_GLOBAL,
+    POP, ADD, SUB, MUL, DIV, EQ, GE, LE, ADD_CONST, SUB_CONST, MUL_CONST,
+    DIV_CONST, EQ_CONST, GE_CONST, LE_CONST, JUMP, JUMP_IF_FALSE,
+    MAKE_FUNCTION, CALL, RETURN, EQ_CONST_JUMP, CALL_GLOBAL, TAIL_CALL,
+    TAIL_CALL_GLOBAL,
+)
+from compiler_studies.no_loop import memo
+from compiler_studies.no_loop.runtime import Frame, Function, NativeFunction, UNSET
+
+
+CALLS = {CALL, CALL_GLOBAL, TAIL_CALL, TAIL_CALL_GLOBAL}
+
+
+def run(code, env):
+    '''Runs a code object from `compiler.compile` in `env`
+
+    `env` is the global Env for the program's code object and a Frame for
+    function code objects.
+    '''
+    instrs = code.instrs
+    consts = code.consts
+    names = code.names
+
+    # Caller state for every function call in progress
+    frames = []
+
+    # Shared by all calls; each only uses what it pushed itself
+    stack = []
+    push = stack.append
+    pop = stack.pop
+
+    pc = 0
+    while True:
+        op = instrs[pc]
+
+        # Roughly ordered by how often they run
+        if op == LOAD:
+            push(env[instrs[pc+1]])
+            pc += 2
+
+        elif op == SUB_CONST:
+            stack[-1] = stack[-1] - consts[instrs[pc+1]]
+            pc += 2
+
+        elif op == EQ_CONST_JUMP:
+            if pop() == consts[instrs[pc+1]]:
+                pc += 3
+            else:
+                pc = instrs[pc+2]
+
+        elif op in CALLS:
+            if op == CALL_GLOBAL or op == TAIL_CALL_GLOBAL:
+                depth, name = names[instrs[pc+1]]
+                nargs = instrs[pc+2]
+                pc += 3
+
+                scope = env
+                while depth:
+                    scope = scope.parent
+                    depth -= 1
+
+                fun = scope[name] if name in scope else scope.lookup(name)
+
+            else:
+                nargs = instrs[pc+1]
+                pc += 2
+                fun = stack[-nargs-1]
+
+            # The arguments become the first slots of the callee's frame
+            if nargs:
+                frame = Frame(stack[-nargs:])
+                del stack[-nargs:]
+            else:
+                frame = Frame()
+
+            if op == CALL or op == TAIL_CALL:
+                pop()
+
+            if isinstance(fun, NativeFunction):
+                push(fun.callable(*frame))
+                continue
+
+            fun_code = fun.code
+
+            if fun_code.nargs != nargs:
+                raise RuntimeError('Wrong number of arguments for {}: expected {}, got {}'.format(
+                    fun_code.name, fun_code.nargs, nargs))
+
+            # Tail calls take the place of the current call
+            if op == CALL or op == CALL_GLOBAL:
+                frames.append((code, pc, env))
+
+            env = frame
+            env.parent = fun.env
+            if fun_code.nslots > nargs:
+                env.extend([UNSET] * (fun_code.nslots - nargs))
+
+            code = fun_code
+            instrs = code.instrs
+            consts = code.consts
+            names = code.names
+            pc = 0
+
+        elif op == RETURN:
+            value = pop()
+
+            # Returning None from within an if-else block carries on after it
+            if value is None and instrs[pc+1]:
+                pc = instrs[pc+1]
+                continue
+
+            if not frames:
+                return value
+
+            if value is None:
+                raise RuntimeError('Missing return statement in {}'.format(code.name))
+
+            code, pc, env = frames.pop()
+            instrs = code.instrs
+            consts = code.consts
+            names = code.names
+            push(value)
+
+        elif op == CONST:
+            push(consts[instrs[pc+1]])
+            pc += 2
+
+        elif op == ADD:
+            right = pop()
+            stack[-1] = stack[-1] + right
+            pc += 1
+
+        elif op == LOAD_GLOBAL:
+            depth, name = names[instrs[pc+1]]
+            pc += 2
+
+            scope = env
+            while depth:
+                scope = scope.parent
+                depth -= 1
+
+            if name in scope:
+                push(scope[name])
+            else:
+                push(scope.lookup(name))
+
+        elif op == EQ_CONST:
+            stack[-1] = stack[-1] == consts[instrs[pc+1]]
+            pc += 2
+
+        elif op == JUMP_IF_FALSE:
+            if pop():
+                pc += 2
+            else:
+                pc = instrs[pc+1]
+
+        elif op == ADD_CONST:
+            stack[-1] = stack[-1] + consts[instrs[pc+1]]
+            pc += 2
+
+        elif op == MUL:
+            right = pop()
+            stack[-1] = stack[-1] * right
+            pc += 1
+
+        elif op == SUB:
+            right = pop()
+            stack[-1] = stack[-1] - right
+            pc += 1
+
+        elif op == EQ:
+            right = pop()
+            stack[-1] = stack[-1] == right
+            pc += 1
+
+        elif op == JUMP:
+            pc = instrs[pc+1]
+
+        elif op == POP:
+            pop()
+            pc += 1
+
+        elif op == LOAD_DEREF:
+            depth, slot, name, fallbacks = names[instrs[pc+1]]
+            pc += 2
+
+            frame = env
+            while depth:
+                frame = frame.parent
+                depth -= 1
+
+            value = frame[slot]
+            if value is UNSET:
+                value = load_unset(env, name, fallbacks)
+            push(value)
+
+        elif op == LOAD_CHECKED:
+            _, slot, name, fallbacks = names[instrs[pc+1]]
+            pc += 2
+
+            value = env[slot]
+            if value is UNSET:
+                value = load_unset(env, name, fallbacks)
+            push(value)
+
+        elif op == STORE:
+            env[instrs[pc+1]] = pop()
+            pc += 2
+
+        elif op == STORE_GLOBAL:
+            env[names[instrs[pc+1]]] = pop()
+            pc += 2
+
+        elif op == MAKE_FUNCTION:
+            fun_code = consts[instrs[pc+1]]
+            pc += 2
+
+            if fun_code.memoize:
+                push(memo.memoized(Function(None, None, env, fun_code), fun_code.memoize, call))
+            else:
+                push(Function(None, None, env, fun_code))
+
+        elif op == MUL_CONST:
+            stack[-1] = stack[-1] * consts[instrs[pc+1]]
+            pc += 2
+
+        elif op == DIV_CONST:
+            stack[-1] = stack[-1] / consts[instrs[pc+1]]
+            pc += 2
+
+        elif op == GE_CONST:
+            stack[-1] = stack[-1] >= consts[instrs[pc+1]]
+            pc += 2
+
+        elif op == LE_CONST:
+            stack[-1] = stack[-1] <= consts[instrs[pc+1]]
+            pc += 2
+
+        elif op == DIV:
+            right = pop()
+            stack[-1] = stack[-1] / right
+            pc += 1
+
+        elif op == GE:
+            right = pop()
+            stack[-1] = stack[-1] >= right
+            pc += 1
+
+        elif op == LE:
+            right = pop()
+            stack[-1] = stack[-1] <= right
+            pc += 1
+
+        else:
+            raise RuntimeError('Invalid opcode {} at {}'.format(op, pc))
+
+
+def load_unset(env, name, fallbacks):
+    '''The value of the name an unset local `name` shadows'''
+    for depth, slot in fallbacks:
+        frame = env
+        for _ in range(depth):
+            frame = frame.parent
+
+        if slot is None:
+            return frame.lookup(name)
+        if frame[slot] is not UNSET:
+            return frame[slot]
+
+    raise Exception('{} is not defined'.format(name))
+
+
+def call(fun, args):
+    '''Calls `fun` in a VM of its own, as memoized functions do'''
+    code = fun.code
+
+    if code.nargs != len(args):
+        raise RuntimeError('Wrong number of arguments for {}: expected {}, got {}'.format(
+            code.name, code.nargs, len(args)))
+
+    frame = Frame(args)
+    frame.parent = fun.env
+    frame.extend([UNSET] * (code.nslots - code.nargs))
+
+    value = run(code, frame)
+
+    if value is None:
+        raise RuntimeError('Missing return statement in {}'.format(code.name))
+
+    return value